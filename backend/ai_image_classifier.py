@@ -2,73 +2,34 @@
 """
 AI Image Classifier using Google Gemini API for Electronic Waste Detection
 """
+import asyncio
 import os
 import base64
+import hashlib
 import io
+import random
+import threading
+import time
+from collections import deque
 from typing import Dict, List, Tuple, Optional
 from PIL import Image
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from circuit_breaker import CircuitBreaker
+from classification_cache import ClassificationCache, content_hash
+from image_index import ImageHashIndex, dhash
 
-class EwasteImageClassifier:
-    def __init__(self, api_key: str):
-        """Initialize the Gemini API client"""
-        self.api_key = api_key
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Configure safety settings to be less restrictive for e-waste detection
-        self.safety_settings = {
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        }
-        
-        # Test the API connection
-        self._test_api_connection()
-    
-    def _test_api_connection(self):
-        """Test the API connection with a simple request"""
-        try:
-            # Test with a simple text generation to verify API key works
-            test_response = self.model.generate_content("Hello, test connection")
-            print("✅ Gemini API connection successful")
-            return True
-        except Exception as e:
-            print(f"⚠️  Gemini API connection test failed: {e}")
-            print("   This might be due to an invalid API key or network issues")
-            return False
-    
-    def preprocess_image(self, image_data: bytes) -> Image.Image:
-        """Preprocess the uploaded image"""
-        try:
-            # Open image from bytes
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Resize if too large (Gemini has size limits)
-            max_size = 2048
-            if max(image.size) > max_size:
-                image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            return image
-        except Exception as e:
-            raise ValueError(f"Invalid image format: {str(e)}")
-    
-    def analyze_image(self, image: Image.Image) -> Dict:
-        """
-        Analyze image using Gemini API to detect electronic waste
-        Returns classification result with device count, type, and validation
-        """
-        try:
-            print("🤖 Calling Gemini API for image analysis...")
-            
-            # Create the prompt for electronic waste detection with device type classification
-            prompt = """
+MODEL_NAME = 'gemini-1.5-flash'
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("GEMINI_WARMUP_TIMEOUT", "10"))
+CALL_TIMEOUT_SECONDS = float(os.getenv("GEMINI_CALL_TIMEOUT", "8"))  # Per attempt
+CLASSIFY_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE", "20"))  # All attempts and backoff together
+CLASSIFY_MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 4.0
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+LATENCY_SAMPLES = 256
+
+# Prompt for electronic waste detection with device type classification (sent verbatim)
+CLASSIFY_PROMPT = """
             You are an expert at identifying electronic devices in images for e-waste recycling purposes.
             
             CRITICAL: Only identify images that contain ACTUAL ELECTRONIC DEVICES. Do NOT classify people, animals, food, furniture, or other non-electronic objects as electronic devices.
@@ -176,58 +137,226 @@ class EwasteImageClassifier:
             
             Be very strict - only classify as electronic waste if you can clearly see an actual electronic device!
             """
+# Cached classifications are only reused under the same model and prompt
+CLASSIFIER_VERSION = f"{MODEL_NAME}:{hashlib.sha256(CLASSIFY_PROMPT.encode()).hexdigest()[:12]}"
+
+# Readiness states: the SDK is only imported and the model built by warm_up(); until it ends 'ready' or
+# 'degraded', classify_image() serves cached results and raises ClassifierUnavailable for the rest
+READINESS_STATES = ('cold', 'warming', 'ready', 'degraded', 'failed')
+
+class ClassifierUnavailable(Exception):
+    """Raised when an image is not cached and the model is not ready to classify it"""
+
+    def __init__(self, state: str):
+        super().__init__(f"Image classifier is {state}")
+        self.state = state
+
+class EwasteImageClassifier:
+    def __init__(self, api_key: str, cache: Optional[ClassificationCache] = None, index: Optional[ImageHashIndex] = None):
+        """Store the API key; the Gemini client is only created by warm_up()"""
+        self.api_key = api_key
+        self.cache = cache
+        self.index = index
+        self.model = None
+        self.safety_settings = None
+        self.state = 'cold'
+        self.error: Optional[str] = None
+        self.warmup_ms: Optional[float] = None
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+        # Metrics
+        self._latencies_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._calls = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._short_circuited = 0
+
+    def _ensure_model(self):
+        """Import google.generativeai and build the model, once (thread-safe)"""
+        if self.model is not None:
+            return self.model
+        with self._lock:
+            if self.model is None:
+                # Importing the SDK takes most of a second, so it stays off the import path of main.py
+                import google.generativeai as genai
+                from google.generativeai.types import HarmCategory, HarmBlockThreshold
+                genai.configure(api_key=self.api_key)
+                # Configure safety settings to be less restrictive for e-waste detection
+                self.safety_settings = {
+                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+                }
+                self.model = genai.GenerativeModel(MODEL_NAME)
+        return self.model
+
+    def warm_up(self) -> str:
+        """Load the SDK and test the API connection; blocking, so run it off the event loop
+
+        Ends 'ready' if the test call succeeds, 'degraded' if the model was built
+        but the API could not be reached (classification still tries), or
+        'failed' if the SDK could not be loaded. Returns the new state.
+        """
+        self.state = 'warming'
+        started = time.perf_counter()
+        try:
+            self._ensure_model()
+        except Exception as e:
+            self.state, self.error = 'failed', str(e)
+            print(f"⚠️  Gemini client could not be initialized: {e}")
+        else:
+            if self._test_api_connection():
+                self.state, self.error = 'ready', None
+            else:
+                self.state = 'degraded'
+        self.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self.state
+
+    @property
+    def available(self) -> bool:
+        return self.state in ('ready', 'degraded')
+
+    def get_status(self) -> dict:
+        latencies = sorted(self._latencies_ms)
+        def percentile(pct):
+            return round(latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))], 1) if latencies else None
+        return {
+            "state": self.state,
+            "model": MODEL_NAME,
+            "warmup_ms": self.warmup_ms,
+            "error": self.error,
+            "breaker": self.breaker.get_stats(),
+            "calls": self._calls,
+            "errors": self._errors,
+            "timeouts": self._timeouts,
+            "short_circuited": self._short_circuited,
+            "latency_ms": {"p50": percentile(50), "p95": percentile(95), "max": percentile(100),
+                           "samples": len(latencies)}
+        }
+
+    def _test_api_connection(self):
+        """Test the API connection with a simple request"""
+        try:
+            # Test with a simple text generation to verify API key works. The client's default
+            # retry policy keeps retrying an unreachable host for minutes, so it is disabled here
+            self.model.generate_content("Hello, test connection",
+                                        request_options={"timeout": WARMUP_TIMEOUT_SECONDS, "retry": None})
+            print("✅ Gemini API connection successful")
+            return True
+        except Exception as e:
+            self.error = str(e)
+            print(f"⚠️  Gemini API connection test failed: {e}")
+            print("   This might be due to an invalid API key or network issues")
+            return False
+    
+    def preprocess_image(self, image_data: bytes) -> Image.Image:
+        """Preprocess the uploaded image"""
+        try:
+            # Open image from bytes
+            image = Image.open(io.BytesIO(image_data))
             
-            # Generate content using Gemini with retry logic
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    print(f"🔄 Gemini API attempt {attempt + 1}/{max_retries}")
-                    response = self.model.generate_content(
-                        [prompt, image],
-                        safety_settings=self.safety_settings
-                    )
-                    
-                    if response and response.text:
-                        print(f"✅ Gemini API response received: {len(response.text)} characters")
-                        print(f"📝 Response preview: {response.text[:200]}...")
-                        
-                        # Parse the response
-                        result = self._parse_gemini_response(response.text)
-                        
-                        # Validate the result
-                        validated_result = self._validate_result(result)
-                        
-                        print(f"🎯 Gemini API result: {validated_result.get('device_type', 'unknown')} with {validated_result.get('confidence', 0):.2f} confidence")
-                        return validated_result
-                    else:
-                        print(f"⚠️  Empty response from Gemini API (attempt {attempt + 1})")
-                        if attempt == max_retries - 1:
-                            raise Exception("Empty response from Gemini API")
-                        
-                except Exception as e:
-                    print(f"⚠️  Gemini API attempt {attempt + 1} failed: {str(e)}")
-                    if attempt == max_retries - 1:
-                        raise e
-                    else:
-                        import time
-                        time.sleep(1)  # Wait before retry
+            # Convert to RGB if necessary
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            
+            # Resize if too large (Gemini has size limits)
+            max_size = 2048
+            if max(image.size) > max_size:
+                image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
             
-            # This should not be reached, but just in case
-            raise Exception("All Gemini API attempts failed")
+            return image
+        except Exception as e:
+            raise ValueError(f"Invalid image format: {str(e)}")
+    
+    async def analyze_image(self, image: Image.Image) -> Dict:
+        """
+        Analyze image using Gemini API to detect electronic waste
+        Returns classification result with device count, type, and validation
+        """
+        if not self.breaker.allow():
+            # Gemini keeps failing: go straight to the fallback instead of waiting on the network
+            self._short_circuited += 1
+            return self._error_result("Gemini API unavailable (circuit open)", circuit_open=True)
+        try:
+            print("🤖 Calling Gemini API for image analysis...")
+            self._ensure_model()
             
+            # Retry with jittered exponential backoff, all within one overall deadline
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + CLASSIFY_DEADLINE_SECONDS
+            last_error: Optional[Exception] = None
+            for attempt in range(CLASSIFY_MAX_ATTEMPTS):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                timeout = min(remaining, CALL_TIMEOUT_SECONDS)
+                started = time.perf_counter()
+                try:
+                    print(f"🔄 Gemini API attempt {attempt + 1}/{CLASSIFY_MAX_ATTEMPTS}")
+                    # The SDK's own retry policy would ignore our deadline, so it is disabled
+                    response = await asyncio.wait_for(self.model.generate_content_async(
+                        [CLASSIFY_PROMPT, image],
+                        safety_settings=self.safety_settings,
+                        request_options={"timeout": timeout, "retry": None}
+                    ), timeout=timeout)
+                    if not (response and response.text):
+                        raise ValueError("Empty response from Gemini API")
+                except Exception as e:
+                    self._record_call(started, e)
+                    self.breaker.record_failure()
+                    last_error = e
+                    print(f"⚠️  Gemini API attempt {attempt + 1} failed: {type(e).__name__}: {e}")
+                    if self.breaker.state == 'open' or attempt == CLASSIFY_MAX_ATTEMPTS - 1:
+                        break
+                    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                    if loop.time() + delay >= deadline:
+                        break
+                    await asyncio.sleep(delay)
+                    continue
+
+                self._record_call(started)
+                self.breaker.record_success()
+                print(f"✅ Gemini API response received: {len(response.text)} characters")
+                print(f"📝 Response preview: {response.text[:200]}...")
+
+                # Parse the response
+                result = self._parse_gemini_response(response.text)
+
+                # Validate the result
+                validated_result = self._validate_result(result)
+
+                print(f"🎯 Gemini API result: {validated_result.get('device_type', 'unknown')} with {validated_result.get('confidence', 0):.2f} confidence")
+                return validated_result
+
+            raise last_error or TimeoutError("Gemini API deadline exceeded")
+
         except Exception as e:
             print(f"❌ Gemini API error: {str(e)}")
             print(f"🔍 Error type: {type(e).__name__}")
             # Return a result that will trigger fallback detection
-            return {
-                "is_electronic_waste": False,
-                "device_count": 0,
-                "detected_devices": [],
-                "device_type": "other",
-                "confidence": 0.0,
-                "message": f"API error: {str(e)}",
-                "error": True
-            }
+            return self._error_result(f"API error: {str(e) or type(e).__name__}")
+
+    def _error_result(self, message: str, **extra) -> Dict:
+        return {
+            "is_electronic_waste": False,
+            "device_count": 0,
+            "detected_devices": [],
+            "device_type": "other",
+            "confidence": 0.0,
+            "message": message,
+            "error": True,
+            **extra
+        }
+
+    def _record_call(self, started: float, error: Optional[Exception] = None):
+        self._latencies_ms.append((time.perf_counter() - started) * 1000)
+        self._calls += 1
+        if isinstance(error, asyncio.TimeoutError) or type(error).__name__ == 'DeadlineExceeded':
+            self._timeouts += 1
+        elif error is not None:
+            self._errors += 1
     
     def _parse_gemini_response(self, response_text: str) -> Dict:
         """Parse Gemini API response and extract JSON"""
@@ -385,20 +514,58 @@ class EwasteImageClassifier:
         
         return validated
     
-    def classify_image(self, image_data: bytes) -> Dict:
+    def _prepare(self, image_data: bytes) -> Tuple[Image.Image, Optional[str], Optional[int]]:
+        """Preprocess the image and compute its content hash and perceptual hash (dHash)"""
+        image = self.preprocess_image(image_data)
+        image_hash = content_hash(image) if self.cache is not None or self.index is not None else None
+        phash = dhash(image) if self.index is not None else None
+        return image, image_hash, phash
+
+    async def classify_image(self, image_data: bytes, user_id: int) -> Dict:
         """
         Main method to classify an uploaded image
         Returns validation result for the e-waste booking system
         """
         try:
-            # Preprocess the image
-            image = self.preprocess_image(image_data)
-            
-            # Analyze with Gemini
-            result = self.analyze_image(image)
-            
+            # Preprocess and hash the image (decoding, resizing and hashing are CPU work, so off the event loop)
+            image, image_hash, phash = await asyncio.to_thread(self._prepare, image_data)
+
+            # Identical pixels (the same file, or a lossless re-encode) reuse an earlier result of this classifier version
+            result = None
+            if self.cache is not None:
+                result = await self.cache.get(image_hash, CLASSIFIER_VERSION)
+                if result is not None:
+                    result['cached'] = True
+
+            # Near-duplicates (recompressed, rescaled, slightly cropped) reuse the nearest cached result
+            matches = await self.index.find(phash) if phash is not None else []
+            if result is None and self.cache is not None and matches:
+                for match in self.index.reusable(matches):
+                    result = await self.cache.get(match.content_hash, CLASSIFIER_VERSION)
+                    if result is not None:
+                        result.update(cached=True, near_duplicate=True)
+                        self.index.record_reuse()
+                        break
+
+            if result is None:
+                if not self.available:
+                    raise ClassifierUnavailable(self.state)
+                # Analyze with Gemini
+                started = time.perf_counter()
+                result = await self.analyze_image(image)
+
+                # Errors and short-circuits are transient, so only real classifications are cached
+                if self.cache is not None and not result.get('error'):
+                    await self.cache.put(image_hash, CLASSIFIER_VERSION, result, (time.perf_counter() - started) * 1000)
+
+            # Index every classified image; near-duplicates of another user's image are flagged for review
+            if phash is not None and not result.get('error'):
+                await self.index.record(phash, image_hash, user_id, matches)
+
             return result
-            
+
+        except ClassifierUnavailable:
+            raise
         except Exception as e:
             return {
                 "is_electronic_waste": False,
@@ -420,5 +587,5 @@ if __name__ == "__main__":
         exit(1)
     
     classifier = EwasteImageClassifier(api_key)
-    print("E-waste Image Classifier initialized successfully!")
+    print(f"E-waste Image Classifier warm-up: {classifier.warm_up()}")
 
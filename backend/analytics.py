@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Time-bucketed booking rollups and the /analytics/timeseries query engine
+
+Run directly to rebuild the hourly and daily rollups from bookings.
+"""
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from yields import YieldTable
+
+INTERVALS = ('hour', 'day', 'week', 'month')
+GROUP_BYS = ('none', 'state', 'pincode', 'category')
+MAX_HOURLY_DAYS = 93
+
+# Rollup tables: bucket expression (over a created_at value) and key columns besides the bucket.
+# The state-level table keeps year-long national and per-state queries to a few thousand rows.
+ROLLUP_TABLES = {
+    'booking_stats_hourly': ("strftime('%Y-%m-%d %H:00:00', {})", ('state', 'pincode', 'category')),
+    'booking_stats_daily': ("date({})", ('state', 'pincode', 'category')),
+    'booking_stats_daily_state': ("date({})", ('state', 'category')),
+}
+
+# Coarser intervals are rolled up from the daily table at query time (weeks start on Monday)
+ROLLUP_EXPRESSIONS = {
+    'hour': 'bucket',
+    'day': 'bucket',
+    'week': "date(bucket, 'weekday 0', '-6 days')",
+    'month': "substr(bucket, 1, 7) || '-01'",
+}
+
+def _add_booking(table: str, bucket_expr: str, columns: Tuple[str, ...], row: str, count: str) -> str:
+    """Trigger statement adding count to the rollup row of a booking (NEW or OLD)"""
+    keys = ', '.join(('bucket',) + columns)
+    values = ', '.join([bucket_expr.format(f'{row}.created_at')] + [f"COALESCE({row}.{column}, '')" for column in columns])
+    return f'''
+            INSERT INTO {table} ({keys}, bookings)
+            VALUES ({values}, {count})
+            ON CONFLICT({keys}) DO UPDATE SET bookings = bookings + excluded.bookings;'''
+
+def ensure_analytics_rollups(conn: sqlite3.Connection):
+    """Create the hourly/daily booking rollups and the triggers that maintain them
+
+    Rows are keyed by bucket plus location and category; material recovery is
+    derived from the category counts with the yield engine at query time.
+    """
+    created = not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'booking_stats_daily_state'"
+    ).fetchone()
+    for table, (_, columns) in ROLLUP_TABLES.items():
+        column_defs = ''.join(f'{column} TEXT NOT NULL, ' for column in columns)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL, {column_defs}
+                bookings INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, {', '.join(columns)})
+            ) WITHOUT ROWID
+        ''')
+        for column in columns:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column}_bucket ON {table}({column}, bucket)")
+
+    insert_body = ''.join(_add_booking(table, expr, columns, 'NEW', '1') for table, (expr, columns) in ROLLUP_TABLES.items())
+    delete_body = ''.join(_add_booking(table, expr, columns, 'OLD', '-1') for table, (expr, columns) in ROLLUP_TABLES.items())
+    triggers = {
+        'trg_bookings_stats_insert': ('AFTER INSERT ON bookings', insert_body),
+        'trg_bookings_stats_delete': ('AFTER DELETE ON bookings', delete_body),
+        'trg_bookings_stats_update': ('AFTER UPDATE OF created_at, state, pincode, category ON bookings',
+                                      delete_body + insert_body),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            BEGIN{body}
+            END
+        ''')
+
+    if created:
+        rebuild_analytics_rollups(conn)
+
+def rebuild_analytics_rollups(conn: sqlite3.Connection):
+    """Recompute the hourly and daily rollups from bookings (reconciliation)"""
+    for table, (bucket_expr, columns) in ROLLUP_TABLES.items():
+        keys = ', '.join(('bucket',) + columns)
+        values = ', '.join([bucket_expr.format('created_at')] + [f"COALESCE({column}, '')" for column in columns])
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''
+            INSERT INTO {table} ({keys}, bookings)
+            SELECT {values}, COUNT(*)
+            FROM bookings
+            GROUP BY {', '.join(str(i) for i in range(1, len(columns) + 2))}
+        ''')
+
+def recovery_equivalents(metals: Dict[str, np.ndarray]):
+    """EV battery packs and solar panels recoverable from material totals (kg)
+
+    Works element-wise on arrays of totals; a missing material means zero units.
+    """
+    def get(material):
+        return np.asarray(metals.get(material, 0.0), dtype=float)
+    ev_battery_units = np.floor(np.minimum.reduce([get('lithium') / 5, get('cobalt') / 2, get('nickel') / 3]))
+    solar_units = np.floor(np.minimum(get('rare_earth') / 0.5, get('copper') / 1))
+    return ev_battery_units.astype(int), solar_units.astype(int)
+
+def rollup_table_for(interval: str, group_by: str, pincode: Optional[str]) -> str:
+    """Smallest rollup table that can answer the query"""
+    if interval == 'hour':
+        return 'booking_stats_hourly'
+    if pincode is None and group_by != 'pincode':
+        return 'booking_stats_daily_state'
+    return 'booking_stats_daily'
+
+def timeseries(conn: sqlite3.Connection, table: YieldTable, interval: str, start: date, end: date,
+               group_by: str = 'none', state: Optional[str] = None, pincode: Optional[str] = None,
+               category: Optional[str] = None) -> List[dict]:
+    """Series of bookings, material recovery and equivalents per bucket
+
+    One GROUP BY over the rollup rows in range, then a single matrix product
+    of (point x category) counts with the yield matrix for the materials.
+    """
+    rollup_table = rollup_table_for(interval, group_by, pincode)
+    bucket = ROLLUP_EXPRESSIONS[interval]
+    end_bucket = (end + timedelta(days=1)).isoformat()
+    clauses, params = ['bucket >= ?', 'bucket < ?'], [start.isoformat(), end_bucket]
+    for column, value in (('state', state), ('pincode', pincode), ('category', category)):
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    key = "''" if group_by == 'none' else group_by
+    rows = conn.execute(f'''
+        SELECT {key} as series_key, {bucket} as period, category, SUM(bookings) as bookings
+        FROM {rollup_table}
+        WHERE {' AND '.join(clauses)}
+        GROUP BY 1, 2, 3
+        HAVING SUM(bookings) != 0
+        ORDER BY 1, 2
+    ''', params).fetchall()
+    if not rows:
+        return []
+
+    points = {}
+    for series_key, period, _, _ in rows:
+        points.setdefault((series_key, period), len(points))
+    counts = np.zeros((len(points), len(table.categories) + 1))
+    point_rows = [points[(row[0], row[1])] for row in rows]
+    np.add.at(counts, (point_rows, table.category_rows([row[2] for row in rows])),
+              [row[3] for row in rows])
+    # The extra column collects unknown categories, which count as bookings but yield nothing
+    materials = counts @ np.round(table.matrix, 4)
+    metals = {material: materials[:, i] for i, material in enumerate(table.materials)}
+    ev_battery_units, solar_units = recovery_equivalents(metals)
+    # Convert once to Python scalars rather than per point
+    bookings = counts.sum(axis=1).astype(int).tolist()
+    material_values = materials.round(4).tolist()
+    ev_battery_units, solar_units = ev_battery_units.tolist(), solar_units.tolist()
+
+    series = {}
+    for (series_key, period), i in points.items():
+        series.setdefault(series_key, []).append({
+            'bucket': period,
+            'bookings': bookings[i],
+            'materials': dict(zip(table.materials, material_values[i])),
+            'ev_battery_units': ev_battery_units[i],
+            'solar_panel_units': solar_units[i]
+        })
+    return [{'key': None if group_by == 'none' else series_key, 'points': points_list}
+            for series_key, points_list in series.items()]
+
+if __name__ == "__main__":
+    conn = sqlite3.connect('e_waste.db')
+    ensure_analytics_rollups(conn)
+    rebuild_analytics_rollups(conn)
+    conn.commit()
+    days = conn.execute('SELECT COUNT(DISTINCT bucket) FROM booking_stats_daily_state').fetchone()[0]
+    conn.close()
+    print(f"✅ Rebuilt analytics rollups ({days} days)")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Async data-access layer: runs blocking sqlite3 work on a dedicated DB thread pool
+"""
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+from database_manager import DatabaseManager, db_manager
+from db_writer import DatabaseWriter, db_writer
+
+class AsyncDatabase:
+    """Awaitable query helpers backed by a DatabaseManager pool
+
+    Reads check out a pooled connection on one of the DB threads, so the event
+    loop never blocks on SQLite and concurrency scales with the pool size. The
+    executor is sized to the pool, so queued calls wait in the executor rather
+    than inside the pool. Writes (``execute`` and ``transaction``) are handed to
+    the single DatabaseWriter and group-committed; write functions must not call
+    ``conn.commit()`` themselves.
+    """
+
+    def __init__(self, manager: DatabaseManager, writer: DatabaseWriter, max_workers: Optional[int] = None):
+        self.manager = manager
+        self.writer = writer
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or manager.max_connections,
+            thread_name_prefix="db"
+        )
+
+    async def submit(self, call: Callable[[], Any]) -> Any:
+        """Run a zero-argument callable on the DB thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, call)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(conn, *args) with a pooled read-only connection on the DB thread pool"""
+        def call():
+            with self.manager.get_connection() as conn:
+                return fn(conn, *args)
+        return await self.submit(call)
+
+    async def fetch_all(self, sql: str, params: Sequence = ()) -> List[dict]:
+        """Run a query and return all rows as dicts"""
+        def query(conn: sqlite3.Connection):
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        return await self.run(query)
+
+    async def fetch_one(self, sql: str, params: Sequence = ()) -> Optional[dict]:
+        """Run a query and return the first row as a dict, or None"""
+        def query(conn: sqlite3.Connection):
+            row = conn.execute(sql, params).fetchone()
+            return dict(row) if row else None
+        return await self.run(query)
+
+    async def fetch_value(self, sql: str, params: Sequence = ()) -> Any:
+        """Run a query and return the first column of the first row, or None"""
+        def query(conn: sqlite3.Connection):
+            row = conn.execute(sql, params).fetchone()
+            return row[0] if row else None
+        return await self.run(query)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Run a single write statement on the writer and return lastrowid (or rowcount)"""
+        def write(conn: sqlite3.Connection):
+            cur = conn.execute(sql, params)
+            return cur.lastrowid if cur.lastrowid else cur.rowcount
+        return await self.writer.transaction(write)
+
+    async def transaction(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(conn, *args) on the writer: committed with its batch, rolled back on error"""
+        return await self.writer.transaction(fn, *args)
+
+    def shutdown(self):
+        """Stop the DB thread pool and flush the writer"""
+        self._executor.shutdown(wait=False)
+        self.writer.stop()
+
+class RequestDatabase:
+    """Request-scoped view of an AsyncDatabase
+
+    Shared by the auth dependency and the handler. Each read checks out a
+    pooled connection on a DB thread and returns it on that thread before the
+    call completes, so no connection is held across an ``await`` (a bcrypt hash,
+    a Gemini call) and a release never queues behind a blocked acquire. Writes
+    still go through the single writer. Query counts and time spent in the
+    database are recorded for the response's Server-Timing header.
+    """
+
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.query_count = 0
+        self.write_count = 0
+        self.db_time = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(conn, *args) with a pooled read-only connection on the DB thread pool"""
+        def call():
+            started = time.perf_counter()
+            try:
+                with self.database.manager.get_connection() as conn:
+                    return fn(conn, *args)
+            finally:
+                self.query_count += 1
+                self.db_time += time.perf_counter() - started
+        return await self.database.submit(call)
+
+    async def fetch_all(self, sql: str, params: Sequence = ()) -> List[dict]:
+        """Run a query and return all rows as dicts"""
+        def query(conn: sqlite3.Connection):
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        return await self.run(query)
+
+    async def fetch_one(self, sql: str, params: Sequence = ()) -> Optional[dict]:
+        """Run a query and return the first row as a dict, or None"""
+        def query(conn: sqlite3.Connection):
+            row = conn.execute(sql, params).fetchone()
+            return dict(row) if row else None
+        return await self.run(query)
+
+    async def fetch_value(self, sql: str, params: Sequence = ()) -> Any:
+        """Run a query and return the first column of the first row, or None"""
+        def query(conn: sqlite3.Connection):
+            row = conn.execute(sql, params).fetchone()
+            return row[0] if row else None
+        return await self.run(query)
+
+    async def _timed_write(self, awaitable) -> Any:
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.write_count += 1
+            self.db_time += time.perf_counter() - started
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Run a single write statement on the writer and return lastrowid (or rowcount)"""
+        return await self._timed_write(self.database.execute(sql, params))
+
+    async def transaction(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(conn, *args) on the writer: committed with its batch, rolled back on error"""
+        return await self._timed_write(self.database.transaction(fn, *args))
+
+    def server_timing(self) -> str:
+        """Server-Timing header value summarising this request's database work"""
+        return f'db;dur={self.db_time * 1000:.2f};desc="{self.query_count} reads, {self.write_count} writes"'
+
+# Global async database instance
+db = AsyncDatabase(db_manager, db_writer)
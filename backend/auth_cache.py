@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Principal cache for authenticated requests
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+class PrincipalCache:
+    """Thread-safe, bounded, TTL-evicting cache of decoded tokens and user rows
+
+    Entries are keyed by the raw bearer token and hold the decoded JWT claims
+    together with the user row, so repeated requests with the same token skip
+    both the signature check and the users lookup. Entries never outlive the
+    token's own ``exp`` claim. Each entry also records the user's ``users``
+    version from ``table_versions``, which triggers bump on any update or
+    delete of the row (from this process or a maintenance script); callers
+    compare it on every hit and ``invalidate()`` a stale entry, so a role or
+    password change applies to the next request.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # token -> (expires_at, claims, user, users version)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, token: str) -> Optional[Tuple[dict, dict, int]]:
+        """Return (claims, user, users version) for a cached token, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires_at, claims, user, version = entry
+            if expires_at <= now:
+                del self._entries[token]
+                self._evictions += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self._hits += 1
+            return claims, dict(user), version
+
+    def put(self, token: str, claims: dict, user: dict, version: int):
+        """Cache the decoded claims and user row for a token, read at the given users version"""
+        expires_at = time.time() + self.ttl_seconds
+        token_exp = claims.get("exp")
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        with self._lock:
+            self._entries[token] = (expires_at, claims, dict(user), version)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, token: str):
+        """Drop a token whose user row changed since it was cached"""
+        with self._lock:
+            if self._entries.pop(token, None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        """Drop all cached principals"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """Get principal cache statistics"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations
+            }
+
+# Global principal cache instance
+principal_cache = PrincipalCache(max_entries=1024, ttl_seconds=60)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: latency of non-auth endpoints while a login storm is running
+
+Start the backend first (python main.py), then run:
+    python bench_login_storm.py --logins 200 --concurrency 20
+"""
+import argparse
+import statistics
+import threading
+import time
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def probe_latency(url, headers, stop_event, samples):
+    """Hit a cheap endpoint in a loop and record latencies in milliseconds"""
+    session = requests.Session()
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        session.get(url, headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+
+def login_worker(username, password, count, results):
+    """Fire logins back to back and tally response codes"""
+    session = requests.Session()
+    for _ in range(count):
+        response = session.post(f"{BASE_URL}/auth/login", json={"username": username, "password": password})
+        results[response.status_code] = results.get(response.status_code, 0) + 1
+
+def run_phase(name, probe_url, headers, storm=None):
+    samples = []
+    stop_event = threading.Event()
+    prober = threading.Thread(target=probe_latency, args=(probe_url, headers, stop_event, samples))
+    prober.start()
+
+    started = time.perf_counter()
+    results = {}
+    if storm:
+        workers = [
+            threading.Thread(target=login_worker, args=(storm["username"], storm["password"], storm["per_worker"], results))
+            for _ in range(storm["concurrency"])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        time.sleep(3)
+    elapsed = time.perf_counter() - started
+
+    stop_event.set()
+    prober.join()
+
+    print(f"\n📊 {name} ({elapsed:.1f}s, {len(samples)} probe requests)")
+    if results:
+        print(f"   Login responses: {results}")
+    if samples:
+        print(f"   p50={percentile(samples, 50):.1f}ms  p95={percentile(samples, 95):.1f}ms  "
+              f"p99={percentile(samples, 99):.1f}ms  max={max(samples):.1f}ms  mean={statistics.mean(samples):.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Login storm latency benchmark")
+    parser.add_argument("--username", default="user1")
+    parser.add_argument("--password", default="user123")
+    parser.add_argument("--logins", type=int, default=200, help="Total logins in the storm")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent login clients")
+    args = parser.parse_args()
+
+    token = requests.post(f"{BASE_URL}/auth/login", json={"username": args.username, "password": args.password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    probe_url = f"{BASE_URL}/dashboard"
+
+    print("🚀 Login storm benchmark")
+    print(f"   Probe endpoint: {probe_url}")
+    run_phase("Baseline (no logins)", probe_url, headers)
+    run_phase("During login storm", probe_url, headers, storm={
+        "username": args.username,
+        "password": args.password,
+        "concurrency": args.concurrency,
+        "per_worker": max(1, args.logins // args.concurrency)
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark: application import time per package and time until the app serves
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and reports
+where import time goes, then times the FastAPI startup (lifespan) separately.
+Fails if a lazily loaded module is imported by main.py, if the median import
+exceeds --budget-ms, or if a package regressed against a --baseline file:
+    python bench_startup.py --runs 5 --json startup.json
+    python bench_startup.py --baseline startup.json --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Loaded on first use only; importing them from main.py is a regression
+LAZY_MODULES = ('google.generativeai', 'scipy')
+REGRESSION_RATIO = 1.2
+REGRESSION_MIN_MS = 10.0
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_SNIPPET = '''
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.get("/ai/health")
+print("STARTUP " + json.dumps({"import_ms": (imported - started) * 1000, "lifespan_ms": (ready - imported) * 1000}))
+'''
+
+def parse_importtime(stderr: str):
+    """Self time in ms per top-level package, and the set of modules imported"""
+    per_package, modules = {}, set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        modules.add(name)
+        package = name.split('.')[0]
+        per_package[package] = per_package.get(package, 0.0) + int(self_us) / 1000
+    return per_package, modules
+
+def measure_imports(runs: int):
+    samples, totals, modules = {}, [], set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise SystemExit(f"❌ import main failed:\n{result.stderr[-2000:]}")
+        per_package, run_modules = parse_importtime(result.stderr)
+        modules |= run_modules
+        totals.append(sum(per_package.values()))
+        for package, ms in per_package.items():
+            samples.setdefault(package, []).append(ms)
+    per_package = {package: round(statistics.median(values), 2) for package, values in samples.items()}
+    return round(statistics.median(totals), 2), per_package, modules
+
+def measure_startup(runs: int):
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', STARTUP_SNIPPET], cwd=BACKEND_DIR, capture_output=True, text=True)
+        line = next((line for line in result.stdout.splitlines() if line.startswith('STARTUP ')), None)
+        if line is None:
+            raise SystemExit(f"❌ app startup failed:\n{result.stderr[-2000:]}")
+        timings.append(json.loads(line[len('STARTUP '):]))
+    return {key: round(statistics.median(timing[key] for timing in timings), 1) for key in timings[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Application startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    parser.add_argument("--budget-ms", type=float, help="Fail if the median import of main exceeds this")
+    parser.add_argument("--baseline", help="JSON from an earlier --json run to compare packages against")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--skip-startup", action="store_true", help="Only measure imports (no database needed)")
+    args = parser.parse_args()
+
+    total_ms, per_package, modules = measure_imports(args.runs)
+    print(f"\n📊 import main: {total_ms:.1f}ms median of {args.runs} runs (sum of module self times)")
+    for package, ms in sorted(per_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"   {package:<28} {ms:8.1f}ms")
+
+    results = {'import_ms': total_ms, 'packages': per_package}
+    if not args.skip_startup:
+        results['startup'] = measure_startup(args.runs)
+        print(f"\n🚀 Startup: import {results['startup']['import_ms']:.1f}ms, "
+              f"lifespan {results['startup']['lifespan_ms']:.1f}ms (median)")
+
+    failures = []
+    eager = [module for module in LAZY_MODULES if module in modules]
+    if eager:
+        failures.append(f"lazily loaded modules imported at startup: {', '.join(eager)}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.1f}ms, budget is {args.budget_ms:.1f}ms")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['packages']
+        for package, ms in sorted(per_package.items()):
+            before = baseline.get(package, 0.0)
+            if ms > before * REGRESSION_RATIO and ms - before > REGRESSION_MIN_MS:
+                failures.append(f"{package} import regressed: {before:.1f}ms -> {ms:.1f}ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\n✅ Results written to {args.json}")
+    if failures:
+        for failure in failures:
+            print(f"⚠️  {failure}")
+        sys.exit(1)
+    print("✅ No import-time regressions")
+
+if __name__ == "__main__":
+    main()
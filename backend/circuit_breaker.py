@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Circuit breaker for calls to flaky external services
+"""
+import threading
+import time
+from typing import Callable
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for a while instead of waiting on it every time
+
+    ``closed``: calls go through; ``failure_threshold`` consecutive failures open
+    the circuit. ``open``: ``allow()`` returns False until ``reset_timeout``
+    seconds have passed, then the circuit goes ``half_open`` and lets a single
+    trial call through. Its success closes the circuit, its failure opens it
+    again for another ``reset_timeout``. A trial that never reports back (e.g. a
+    cancelled request) is given up on after ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+
+        # Metrics
+        self._successes = 0
+        self._failures = 0
+        self._rejected = 0
+        self._opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == 'open' and self._clock() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may be made now (in half-open state, only the first caller gets True)"""
+        with self._lock:
+            if self._state == 'open' and self._clock() - self._opened_at >= self.reset_timeout:
+                self._state, self._trial_in_flight = 'half_open', False
+            if self._state == 'closed':
+                return True
+            now = self._clock()
+            if self._state == 'half_open' and (not self._trial_in_flight or now - self._trial_started >= self.reset_timeout):
+                self._trial_in_flight, self._trial_started = True, now
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._successes += 1
+            self._consecutive_failures = 0
+            self._state, self._trial_in_flight = 'closed', False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            if self._state == 'half_open' or self._consecutive_failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self._opened += 1
+                self._state, self._trial_in_flight = 'open', False
+                self._opened_at = self._clock()
+
+    def get_stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            retry_in = max(0.0, self.reset_timeout - (self._clock() - self._opened_at)) if state == 'open' else 0.0
+            return {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout_seconds": self.reset_timeout,
+                "retry_in_seconds": round(retry_in, 1),
+                "successes": self._successes,
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "times_opened": self._opened
+            }
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of image classifications: in-memory LRU over a SQLite tier
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from async_db import AsyncDatabase, db
+
+CACHE_MEMORY_ENTRIES = int(os.getenv("CLASSIFY_CACHE_MEMORY_ENTRIES", "1024"))
+CACHE_MAX_ROWS = int(os.getenv("CLASSIFY_CACHE_MAX_ROWS", "50000"))
+CACHE_TTL_SECONDS = float(os.getenv("CLASSIFY_CACHE_TTL", str(30 * 24 * 3600)))
+EVICT_EVERY = 100  # Stores between eviction passes over the SQLite tier
+
+def ensure_classification_cache(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            content_hash TEXT NOT NULL,
+            classifier_version TEXT NOT NULL,
+            result TEXT NOT NULL,
+            latency_ms REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (content_hash, classifier_version)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_classification_cache_created_at ON classification_cache(created_at)")
+
+def content_hash(image) -> str:
+    """Hash of a preprocessed PIL image's pixels, so lossless re-encodings (PNG, WebP lossless) share a key
+
+    Lossy recompression changes the pixels and so the key; the perceptual
+    hash index catches those near-duplicates.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def _lookup(conn: sqlite3.Connection, content_hash: str, version: str, min_created_at: float):
+    return conn.execute('''
+        SELECT result, latency_ms, created_at FROM classification_cache
+        WHERE content_hash = ? AND classifier_version = ? AND created_at >= ?
+    ''', (content_hash, version, min_created_at)).fetchone()
+
+def _store(conn: sqlite3.Connection, content_hash: str, version: str, result: str, latency_ms: float, created_at: float):
+    conn.execute('''
+        INSERT OR REPLACE INTO classification_cache (content_hash, classifier_version, result, latency_ms, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (content_hash, version, result, latency_ms, created_at))
+
+def _evict(conn: sqlite3.Connection, min_created_at: float, max_rows: int) -> int:
+    """Drop expired rows, then the oldest ones beyond max_rows"""
+    evicted = conn.execute('DELETE FROM classification_cache WHERE created_at < ?', (min_created_at,)).rowcount
+    cutoff = conn.execute('SELECT created_at FROM classification_cache ORDER BY created_at DESC LIMIT 1 OFFSET ?',
+                          (max_rows,)).fetchone()
+    if cutoff is not None:
+        evicted += conn.execute('DELETE FROM classification_cache WHERE created_at <= ?', (cutoff[0],)).rowcount
+    return evicted
+
+class ClassificationCache:
+    """Classification results keyed by image content hash and classifier version
+
+    Lookups check a bounded in-memory LRU, then the ``classification_cache``
+    table (read pool); results are written through to both. Entries expire
+    after ``ttl`` seconds and the table is trimmed to ``max_rows`` (oldest
+    first) every EVICT_EVERY stores. The version in the key is the model name
+    plus a prompt hash, so changing either stops old results being served.
+    """
+
+    def __init__(self, database: AsyncDatabase, max_entries: int = CACHE_MEMORY_ENTRIES,
+                 max_rows: int = CACHE_MAX_ROWS, ttl: float = CACHE_TTL_SECONDS):
+        self.database = database
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._memory = OrderedDict()  # (hash, version) -> (result JSON, latency_ms, created_at)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._saved_latency_ms = 0.0
+
+    def _remember(self, key: tuple, entry: tuple):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    async def get(self, content_hash: str, version: str) -> Optional[dict]:
+        key = (content_hash, version)
+        min_created_at = time.time() - self.ttl
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[2] < min_created_at:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                self._saved_latency_ms += entry[1]
+                return json.loads(entry[0])
+        row = await self.database.run(_lookup, content_hash, version, min_created_at)
+        if row is None:
+            self._misses += 1
+            return None
+        self._remember(key, tuple(row))
+        self._disk_hits += 1
+        self._saved_latency_ms += row[1]
+        return json.loads(row[0])
+
+    async def put(self, content_hash: str, version: str, result: dict, latency_ms: float):
+        created_at, serialized = time.time(), json.dumps(result)
+        self._remember((content_hash, version), (serialized, latency_ms, created_at))
+        await self.database.transaction(_store, content_hash, version, serialized, latency_ms, created_at)
+        self._stores += 1
+        if self._stores % EVICT_EVERY == 0:
+            self._evictions += await self.database.transaction(_evict, time.time() - self.ttl, self.max_rows)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            size = len(self._memory)
+        hits = self._memory_hits + self._disk_hits
+        lookups = hits + self._misses
+        return {
+            "memory_size": size,
+            "max_entries": self.max_entries,
+            "max_rows": self.max_rows,
+            "ttl_seconds": self.ttl,
+            "memory_hits": self._memory_hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "stores": self._stores,
+            "evictions": self._evictions,
+            "saved_latency_ms": round(self._saved_latency_ms, 1)
+        }
+
+# Global classification cache instance
+classification_cache = ClassificationCache(db)
@@ -4,20 +4,66 @@ Database connection manager with pooling for performance optimization
 """
 import sqlite3
 import threading
+from bisect import bisect_left
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, Optional
 import time
 
+# Upper bounds (ms) of the acquire wait-time histogram buckets; the last bucket is open-ended
+WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection became available within the acquire timeout"""
+
+class _PooledConnection:
+    """A pooled connection plus the bookkeeping needed for lifetime and idle checks"""
+    __slots__ = ("conn", "created_at", "last_used", "generation")
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.generation = generation
+
 class DatabaseManager:
-    """Thread-safe database connection manager with pooling"""
-    
-    def __init__(self, db_path: str, max_connections: int = 10):
+    """Thread-safe database connection manager with pooling
+
+    Waiters block on a condition variable (never while spinning on the lock) and
+    give up after ``acquire_timeout`` seconds. Connections are retired once they
+    are older than ``max_lifetime`` or have sat idle longer than ``idle_timeout``,
+    and are only health-checked when they have been idle for longer than
+    ``health_check_interval``. With ``query_only`` set, connections refuse writes,
+    which is how the read pool is kept separate from the single writer.
+    """
+
+    def __init__(self, db_path: str, max_connections: int = 10, acquire_timeout: float = 5.0,
+                 max_lifetime: float = 1800.0, idle_timeout: float = 300.0,
+                 health_check_interval: float = 30.0, query_only: bool = False):
         self.db_path = db_path
         self.max_connections = max_connections
-        self._pool = []
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.query_only = query_only
+        self._pool = []  # idle _PooledConnection entries, most recently used last
         self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
         self._created_connections = 0
-        
+        self._generation = 0
+
+        # Metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._opened_total = 0
+        self._closed_expired = 0
+        self._closed_idle = 0
+        self._health_check_failures = 0
+
     def _create_connection(self) -> sqlite3.Connection:
         """Create a new database connection"""
         conn = sqlite3.connect(self.db_path, check_same_thread=False)
@@ -26,68 +72,174 @@ class DatabaseManager:
         conn.execute("PRAGMA synchronous=NORMAL")  # Balance between safety and speed
         conn.execute("PRAGMA cache_size=10000")  # Increase cache size
         conn.execute("PRAGMA temp_store=MEMORY")  # Store temp tables in memory
+        if self.query_only:
+            conn.execute("PRAGMA query_only=ON")  # Writes go through the single writer
         return conn
-    
-    @contextmanager
-    def get_connection(self) -> Generator[sqlite3.Connection, None, None]:
-        """Get a database connection from the pool"""
-        conn = None
+
+    def _discard(self, entry: _PooledConnection):
+        """Close a connection and release its slot (caller must hold the lock)"""
         try:
-            with self._lock:
-                if self._pool:
-                    conn = self._pool.pop()
-                elif self._created_connections < self.max_connections:
-                    conn = self._create_connection()
-                    self._created_connections += 1
-                else:
-                    # Wait for a connection to become available
-                    while not self._pool and self._created_connections >= self.max_connections:
-                        time.sleep(0.001)  # Small delay to prevent busy waiting
+            entry.conn.close()
+        except sqlite3.Error:
+            pass
+        self._created_connections -= 1
+        self._available.notify()
+
+    def _reap_idle(self, now: float):
+        """Retire idle connections past their idle timeout or lifetime (caller must hold the lock)"""
+        keep = []
+        for entry in self._pool:
+            if now - entry.last_used > self.idle_timeout:
+                self._closed_idle += 1
+                self._discard(entry)
+            elif now - entry.created_at > self.max_lifetime:
+                self._closed_expired += 1
+                self._discard(entry)
+            else:
+                keep.append(entry)
+        self._pool = keep
+
+    def _record_wait(self, waited: float):
+        """Record how long a checkout waited (caller must hold the lock)"""
+        waited_ms = waited * 1000
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+        self._wait_histogram[bisect_left(WAIT_BUCKETS_MS, waited_ms)] += 1
+
+    def _acquire(self, timeout: Optional[float]) -> _PooledConnection:
+        """Check out a pooled connection, creating one if there is room"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            needs_check = False
+            with self._available:
+                waited = False
+                while True:
+                    now = time.monotonic()
+                    self._reap_idle(now)
                     if self._pool:
-                        conn = self._pool.pop()
-                    else:
-                        conn = self._create_connection()
+                        entry = self._pool.pop()
+                        needs_check = now - entry.last_used > self.health_check_interval
+                        break
+                    if self._created_connections < self.max_connections:
                         self._created_connections += 1
-            
-            yield conn
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
+                        entry = None
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout:.1f}s waiting for a database connection "
+                            f"({self.max_connections} in use)"
+                        )
+                    if not waited:
+                        self._waits += 1
+                        waited = True
+                    self._available.wait(remaining)
+                self._checkouts += 1
+                self._record_wait(time.monotonic() - started)
+                generation = self._generation
+
+            if entry is None:
+                # Open outside the lock so other threads can keep checking in/out
                 try:
-                    # Return connection to pool if it's still valid
-                    conn.execute("SELECT 1")  # Test if connection is still valid
-                    with self._lock:
-                        if len(self._pool) < self.max_connections:
-                            self._pool.append(conn)
-                        else:
-                            conn.close()
-                            self._created_connections -= 1
-                except sqlite3.Error:
-                    # Connection is invalid, close it
-                    conn.close()
-                    with self._lock:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._available:
                         self._created_connections -= 1
-    
+                        self._available.notify()
+                    raise
+                with self._lock:
+                    self._opened_total += 1
+                return _PooledConnection(conn, generation)
+
+            if not needs_check:
+                return entry
+            try:
+                entry.conn.execute("SELECT 1")  # Lazy health check for long-idle connections
+                return entry
+            except sqlite3.Error:
+                with self._available:
+                    self._health_check_failures += 1
+                    self._discard(entry)
+
+    def _release(self, entry: _PooledConnection):
+        """Return a connection to the pool, or retire it if it is stale"""
+        now = time.monotonic()
+        with self._available:
+            if (entry.generation != self._generation
+                    or now - entry.created_at > self.max_lifetime
+                    or len(self._pool) >= self.max_connections):
+                self._closed_expired += 1
+                self._discard(entry)
+                return
+            entry.last_used = now
+            self._pool.append(entry)
+            self._available.notify()
+
+    @contextmanager
+    def get_connection(self, timeout: Optional[float] = None) -> Generator[sqlite3.Connection, None, None]:
+        """Get a database connection from the pool
+
+        Blocks for up to ``timeout`` seconds (default: the pool's acquire timeout)
+        and raises PoolTimeoutError if no connection becomes available.
+        """
+        entry = self._acquire(timeout)
+        conn = entry.conn
+        try:
+            yield conn
+            if conn.in_transaction:
+                # Never hand an open transaction to the next borrower
+                conn.rollback()
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                with self._available:
+                    self._discard(entry)
+                raise
+            self._release(entry)
+            raise
+        except BaseException:
+            with self._available:
+                self._discard(entry)
+            raise
+        else:
+            self._release(entry)
+
     def close_all(self):
-        """Close all connections in the pool"""
-        with self._lock:
-            for conn in self._pool:
-                conn.close()
+        """Close all idle connections; connections in use are closed when returned"""
+        with self._available:
+            self._generation += 1
+            for entry in self._pool:
+                self._discard(entry)
             self._pool.clear()
-            self._created_connections = 0
-    
+
     def get_stats(self) -> dict:
         """Get connection pool statistics"""
         with self._lock:
+            histogram = {}
+            for bound, count in zip(WAIT_BUCKETS_MS, self._wait_histogram):
+                histogram[f"le_{bound}ms"] = count
+            histogram[f"gt_{WAIT_BUCKETS_MS[-1]}ms"] = self._wait_histogram[-1]
             return {
                 "pool_size": len(self._pool),
                 "created_connections": self._created_connections,
-                "max_connections": self.max_connections
+                "in_use": self._created_connections - len(self._pool),
+                "max_connections": self.max_connections,
+                "query_only": self.query_only,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_time_total_ms": round(self._wait_time_total * 1000, 3),
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+                "wait_time_histogram": histogram,
+                "connections_opened": self._opened_total,
+                "closed_expired": self._closed_expired,
+                "closed_idle": self._closed_idle,
+                "health_check_failures": self._health_check_failures
             }
 
-# Global database manager instance
-db_manager = DatabaseManager('e_waste.db', max_connections=10)
-
+# Global database manager instance (read pool; writes go through db_writer)
+db_manager = DatabaseManager('e_waste.db', max_connections=10, query_only=True)
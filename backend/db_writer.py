@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Single-writer SQLite connection with group commit
+"""
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+class DatabaseWriter:
+    """Serializes all write transactions through one connection on one thread
+
+    Callers submit ``fn(conn, *args)`` units of work. The writer thread collects
+    whatever is queued within ``batch_window`` seconds (up to ``max_batch`` jobs),
+    runs each job inside its own SAVEPOINT and commits the whole batch at once.
+    A failing job only rolls back its own savepoint; the rest of the batch still
+    commits. With a single writer there is no lock contention between writers,
+    so ``database is locked`` errors disappear and one commit covers many requests.
+    """
+
+    def __init__(self, db_path: str, batch_window: float = 0.002, max_batch: int = 64):
+        self.db_path = db_path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._jobs = 0
+        self._failed_jobs = 0
+        self._batches = 0
+        self._commit_failures = 0
+        self._largest_batch = 0
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """Create the dedicated write connection"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=10000")
+        # temp_store stays FILE: with MEMORY, statement journals inside the per-job
+        # savepoint make large trigger-heavy updates (route scheduling) ~20x slower
+        conn.execute("PRAGMA busy_timeout=5000")  # Out-of-process scripts may still write
+        return conn
+
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued writes and stop the writer thread"""
+        with self._start_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        """Queue fn(conn, *args) for the next group commit and return a Future for its result"""
+        self.start()
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    async def transaction(self, fn: Callable[..., Any], *args) -> Any:
+        """Await the result of fn(conn, *args) once its batch has committed"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _collect_batch(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Put the stop marker back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: list):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = fn(conn, *args)
+                    conn.execute("RELEASE SAVEPOINT job")
+                    outcomes.append((future, result, None))
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT job")
+                    conn.execute("RELEASE SAVEPOINT job")
+                    outcomes.append((future, None, e))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # The batch as a whole failed (e.g. commit error): fail every job in it
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._stats_lock:
+                self._commit_failures += 1
+            for fn, args, future in batch:
+                if future.done() or (not future.running() and not future.set_running_or_notify_cancel()):
+                    continue
+                future.set_exception(e)
+            return
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is not None:
+                failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        with self._stats_lock:
+            self._batches += 1
+            self._jobs += len(outcomes)
+            self._failed_jobs += failed
+            self._largest_batch = max(self._largest_batch, len(outcomes))
+
+    def _run(self):
+        conn = self._create_connection()
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    break
+                self._run_batch(conn, self._collect_batch(first))
+        finally:
+            conn.close()
+
+    def get_stats(self) -> dict:
+        """Get writer statistics"""
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batch_window_ms": self.batch_window * 1000,
+                "max_batch": self.max_batch,
+                "jobs": self._jobs,
+                "failed_jobs": self._failed_jobs,
+                "batches": self._batches,
+                "avg_batch_size": round(self._jobs / self._batches, 2) if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "commit_failures": self._commit_failures
+            }
+
+# Global database writer instance
+db_writer = DatabaseWriter('e_waste.db')
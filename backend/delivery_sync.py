@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Batched, idempotent delivery status sync for agents replaying offline queues
+"""
+import sqlite3
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+DELIVERY_POINTS = 20  # Fixed points per completed delivery
+DELIVERY_STATUSES = ('assigned', 'picked_up', 'delivered')
+SYNC_MAX_ITEMS = 500
+SQL_CHUNK = 500  # Bound on ? placeholders per IN (...) query
+
+def ensure_delivery_sync(conn: sqlite3.Connection):
+    """Outcome of every synced update, keyed by the agent's idempotency key"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS delivery_sync_keys (
+            delivery_guy_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            booking_id INTEGER,
+            status TEXT,
+            result TEXT NOT NULL,
+            detail TEXT,
+            points_awarded INTEGER NOT NULL DEFAULT 0,
+            client_timestamp TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (delivery_guy_id, idempotency_key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_points_history_transaction_id ON points_history(transaction_id)")
+
+def _chunks(values: Sequence, size: int = SQL_CHUNK) -> Iterable[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def award_delivery_points(conn: sqlite3.Connection, deliveries: Iterable[Tuple[int, Optional[int]]]) -> Dict[int, int]:
+    """Award DELIVERY_POINTS once per delivered booking, for (booking_id, owner user_id) pairs
+
+    Existing awards are found with one query per chunk and balances are
+    updated once per user. Returns the points newly awarded per booking.
+    """
+    candidates = {booking_id: user_id for booking_id, user_id in deliveries if user_id}
+    if not candidates:
+        return {}
+    booking_ids = list(candidates)
+    awarded = set()
+    for chunk in _chunks(booking_ids):
+        awarded.update(conn.execute(
+            f"SELECT user_id, transaction_id FROM points_history WHERE transaction_id IN ({','.join('?' * len(chunk))})",
+            chunk).fetchall())
+    new = [(booking_id, user_id) for booking_id, user_id in candidates.items() if (user_id, booking_id) not in awarded]
+    if not new:
+        return {}
+    per_user = Counter(user_id for _, user_id in new)
+    now = datetime.utcnow()
+    conn.executemany('INSERT OR IGNORE INTO user_points (user_id, points_balance) VALUES (?, 0)',
+                     [(user_id,) for user_id in per_user])
+    conn.executemany('UPDATE user_points SET points_balance = points_balance + ?, updated_at = ? WHERE user_id = ?',
+                     [(count * DELIVERY_POINTS, now, user_id) for user_id, count in per_user.items()])
+    conn.executemany('INSERT INTO points_history (user_id, transaction_id, points_awarded) VALUES (?, ?, ?)',
+                     [(user_id, booking_id, DELIVERY_POINTS) for booking_id, user_id in new])
+    return {booking_id: DELIVERY_POINTS for booking_id, _ in new}
+
+def _completed_at(client_timestamp: Optional[datetime]) -> datetime:
+    """When the agent marked it delivered, as naive UTC, never later than now"""
+    now = datetime.utcnow()
+    if client_timestamp is None:
+        return now
+    if client_timestamp.tzinfo is not None:
+        client_timestamp = client_timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(client_timestamp, now)
+
+def _result(update: dict, result: str, detail: Optional[str] = None, points_awarded: int = 0) -> dict:
+    return {'idempotency_key': update['idempotency_key'], 'booking_id': update['booking_id'], 'status': update['status'],
+            'result': result, 'detail': detail, 'points_awarded': points_awarded}
+
+def sync_statuses(conn: sqlite3.Connection, delivery_guy: dict,
+                  updates: List[dict]) -> Tuple[List[dict], Dict[int, Optional[int]]]:
+    """Validate and apply an agent's ordered status updates in one transaction
+
+    Each update is a dict with idempotency_key, booking_id, status and
+    client_timestamp. Keys seen before return their stored booking, status and
+    outcome as 'duplicate', whatever the replayed payload says; otherwise an update is 'applied' or 'rejected' (not the agent's
+    current assignment, unknown status, or moving a delivery backwards).
+    Updates are checked in order against the state left by earlier ones, and
+    every outcome is stored so a retried batch gets identical answers.
+    Returns the per-update results and the owners of the bookings changed.
+    """
+    keys = [update['idempotency_key'] for update in updates]
+    seen = {}
+    for chunk in _chunks(list(dict.fromkeys(keys))):
+        for row in conn.execute(f'''
+            SELECT idempotency_key, booking_id, status, result, detail, points_awarded FROM delivery_sync_keys
+            WHERE delivery_guy_id = ? AND idempotency_key IN ({','.join('?' * len(chunk))})
+        ''', [delivery_guy['id'], *chunk]).fetchall():
+            seen[row['idempotency_key']] = dict(row)
+
+    booking_ids = list({update['booking_id'] for update in updates})
+    current = {}
+    for chunk in _chunks(booking_ids):
+        for row in conn.execute(f'''
+            SELECT b.id, b.status, b.user_id, d.id as delivery_id, d.status as delivery_status
+            FROM bookings b
+            JOIN deliveries d ON d.id = b.current_delivery_id
+            WHERE b.id IN ({','.join('?' * len(chunk))}) AND d.delivery_guy_id = ?
+        ''', [*chunk, delivery_guy['id']]).fetchall():
+            current[row['id']] = dict(row)
+
+    results, stored, transitions = [], [], []
+    for update in updates:
+        key = update['idempotency_key']
+        if key in seen:
+            # Filled in at the end, once points for this batch are known
+            results.append((update, seen[key]))
+            continue
+        booking = current.get(update['booking_id'])
+        if update['status'] not in DELIVERY_STATUSES:
+            outcome = _result(update, 'rejected', 'Invalid status')
+        elif booking is None:
+            outcome = _result(update, 'rejected', 'Delivery assignment not found')
+        elif DELIVERY_STATUSES.index(update['status']) < DELIVERY_STATUSES.index(booking['delivery_status']):
+            outcome = _result(update, 'rejected', f"Delivery is already {booking['delivery_status']}")
+        elif update['status'] == booking['delivery_status']:
+            outcome = _result(update, 'applied', 'No change')
+        else:
+            outcome = _result(update, 'applied')
+            transitions.append((update, booking['status']))
+            booking['status'] = booking['delivery_status'] = update['status']
+            booking['completed_at'] = _completed_at(update['client_timestamp']) if update['status'] == 'delivered' else None
+        results.append(outcome)
+        seen[key] = outcome
+        stored.append(outcome)
+
+    if transitions:
+        # Final state per booking, one history row per transition
+        final = {update['booking_id']: current[update['booking_id']] for update, _ in transitions}
+        conn.executemany('UPDATE deliveries SET status = ?, completed_at = ? WHERE id = ?',
+                         [(booking['delivery_status'], booking['completed_at'], booking['delivery_id'])
+                          for booking in final.values()])
+        conn.executemany('UPDATE bookings SET status = ? WHERE id = ?',
+                         [(booking['status'], booking_id) for booking_id, booking in final.items()])
+        conn.executemany('INSERT INTO order_status_history (booking_id, old_status, new_status, updated_by) VALUES (?, ?, ?, ?)',
+                         [(update['booking_id'], old_status, update['status'], delivery_guy['username'])
+                          for update, old_status in transitions])
+        points = award_delivery_points(conn, [(booking_id, booking['user_id']) for booking_id, booking in final.items()
+                                              if booking['status'] == 'delivered'])
+        # Credit the points to the update that delivered the booking
+        for outcome in reversed(stored):
+            if outcome['result'] == 'applied' and outcome['status'] == 'delivered' and outcome['booking_id'] in points:
+                outcome['points_awarded'] = points.pop(outcome['booking_id'])
+
+    # A duplicate reports the stored update, not whatever payload was replayed under its key
+    results = [{**_result(item[1], 'duplicate', item[1]['detail'], item[1]['points_awarded']),
+                'original_result': item[1]['result']} if isinstance(item, tuple) else item
+               for item in results]
+    client_timestamps = {update['idempotency_key']: update['client_timestamp'] for update in updates}
+    conn.executemany('''
+        INSERT INTO delivery_sync_keys
+            (delivery_guy_id, idempotency_key, booking_id, status, result, detail, points_awarded, client_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(delivery_guy['id'], outcome['idempotency_key'], outcome['booking_id'], outcome['status'], outcome['result'],
+           outcome['detail'], outcome['points_awarded'], client_timestamps[outcome['idempotency_key']])
+          for outcome in stored])
+    return results, {update['booking_id']: current[update['booking_id']]['user_id'] for update, _ in transitions}
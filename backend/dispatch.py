@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Automatic dispatch: match open routes to delivery agents as an assignment problem
+"""
+import math
+import os
+import sqlite3
+from typing import Dict, List, Optional
+import numpy as np
+from routing import haversine_km
+
+# Workload penalty, in km of extra travel per stop an agent already has open
+KM_PER_OPEN_STOP = float(os.getenv("DISPATCH_KM_PER_OPEN_STOP", "0.5"))
+
+def agent_workloads(conn: sqlite3.Connection) -> List[dict]:
+    """Delivery agents with their open stops and the centre of those stops (None if idle)
+
+    Only each booking's current delivery counts, so reassigned bookings are not
+    double-counted. An idle agent is placed at their last completed stop, if any.
+    """
+    rows = conn.execute('''
+        SELECT u.id, u.username,
+               COUNT(b.id) as open_stops, AVG(b.lat) as lat, AVG(b.lon) as lon,
+               (SELECT lb.lat FROM deliveries ld JOIN bookings lb ON lb.id = ld.booking_id
+                WHERE ld.delivery_guy_id = u.id AND ld.status = 'delivered' AND lb.lat IS NOT NULL
+                ORDER BY ld.completed_at DESC LIMIT 1) as last_lat,
+               (SELECT lb.lon FROM deliveries ld JOIN bookings lb ON lb.id = ld.booking_id
+                WHERE ld.delivery_guy_id = u.id AND ld.status = 'delivered' AND lb.lat IS NOT NULL
+                ORDER BY ld.completed_at DESC LIMIT 1) as last_lon
+        FROM users u
+        LEFT JOIN deliveries d ON d.delivery_guy_id = u.id AND d.status IN ('assigned', 'picked_up')
+        LEFT JOIN bookings b ON b.current_delivery_id = d.id
+        WHERE u.role = 'delivery'
+        GROUP BY u.id
+        ORDER BY u.id
+    ''').fetchall()
+    return [{'delivery_guy_id': row['id'], 'username': row['username'], 'open_stops': row['open_stops'],
+             'lat': row['lat'] if row['lat'] is not None else row['last_lat'],
+             'lon': row['lon'] if row['lon'] is not None else row['last_lon']}
+            for row in rows]
+
+def dispatchable_routes(conn: sqlite3.Connection) -> List[dict]:
+    """Undispatched routes with their stops still waiting for an agent"""
+    rows = conn.execute('''
+        SELECT r.id, r.centroid_lat, r.centroid_lon, COUNT(b.id) as stops
+        FROM routes r
+        JOIN bookings b ON b.route_id = r.id AND b.status = 'scheduled' AND b.current_delivery_id IS NULL
+        WHERE r.dispatched_at IS NULL
+        GROUP BY r.id
+        ORDER BY r.id
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+def plan_dispatch(conn: sqlite3.Connection, km_per_open_stop: float = KM_PER_OPEN_STOP) -> dict:
+    """Assign every dispatchable route to an agent, minimizing travel plus workload
+
+    Each agent is offered ceil(routes / agents) slots; slot s costs the distance
+    from the agent to the route plus the penalty for the agent's open stops and
+    s average routes' worth of stops already handed out in this plan, so one
+    Hungarian solve (scipy linear_sum_assignment) balances load and proximity.
+    Agents with no known position get no distance term.
+    """
+    # SciPy is only needed here, so it is not loaded at application startup
+    from scipy.optimize import linear_sum_assignment
+    routes = dispatchable_routes(conn)
+    agents = agent_workloads(conn)
+    plan = {'assignments': [], 'agents': [], 'unassigned_routes': [route['id'] for route in routes]}
+    if not routes or not agents:
+        plan['agents'] = [{**agent, 'new_stops': 0, 'open_stops_after': agent['open_stops']} for agent in agents]
+        return plan
+
+    slots = math.ceil(len(routes) / len(agents))
+    route_lat = np.array([route['centroid_lat'] if route['centroid_lat'] is not None else np.nan for route in routes])
+    route_lon = np.array([route['centroid_lon'] if route['centroid_lon'] is not None else np.nan for route in routes])
+    mean_stops = float(np.mean([route['stops'] for route in routes]))
+
+    distances = np.zeros((len(routes), len(agents)))
+    for a, agent in enumerate(agents):
+        if agent['lat'] is not None:
+            distances[:, a] = haversine_km(route_lat, route_lon, agent['lat'], agent['lon'])
+    distances = np.nan_to_num(distances, nan=0.0)
+    open_stops = np.array([agent['open_stops'] for agent in agents], dtype=float)
+    # Columns are (slot, agent) pairs: column s * agents + a is agent a's s-th new route
+    workload = np.concatenate([open_stops + s * mean_stops for s in range(slots)])
+    cost = np.tile(distances, (1, slots)) + km_per_open_stop * workload[None, :]
+    route_rows, columns = linear_sum_assignment(cost)
+
+    new_stops = np.zeros(len(agents), dtype=int)
+    for r, column in zip(route_rows.tolist(), columns.tolist()):
+        a = column % len(agents)
+        route, agent = routes[r], agents[a]
+        new_stops[a] += route['stops']
+        plan['assignments'].append({
+            'route_id': route['id'],
+            'stops': route['stops'],
+            'delivery_guy_id': agent['delivery_guy_id'],
+            'username': agent['username'],
+            'distance_km': round(float(distances[r, a]), 3) if agent['lat'] is not None else None
+        })
+    plan['agents'] = [{**agent, 'new_stops': int(new_stops[a]), 'open_stops_after': agent['open_stops'] + int(new_stops[a])}
+                      for a, agent in enumerate(agents)]
+    plan['unassigned_routes'] = []
+    return plan
+
+def apply_dispatch(conn: sqlite3.Connection, plan: dict, updated_by: str) -> Dict[int, List[int]]:
+    """Create the deliveries for a plan and mark its routes dispatched; returns booking ids per agent"""
+    assigned: Dict[int, List[int]] = {}
+    history = []
+    for assignment in plan['assignments']:
+        booking_ids = [row[0] for row in conn.execute('''
+            SELECT id FROM bookings
+            WHERE route_id = ? AND status = 'scheduled' AND current_delivery_id IS NULL
+            ORDER BY id
+        ''', (assignment['route_id'],)).fetchall()]
+        assigned.setdefault(assignment['delivery_guy_id'], []).extend(booking_ids)
+        history.extend((booking_id, 'scheduled', 'assigned', updated_by) for booking_id in booking_ids)
+    # trg_deliveries_set_current points each booking at its new delivery row
+    conn.executemany("INSERT INTO deliveries (booking_id, delivery_guy_id, status) VALUES (?, ?, 'assigned')",
+                     [(booking_id, delivery_guy_id) for delivery_guy_id, booking_ids in assigned.items()
+                      for booking_id in booking_ids])
+    conn.executemany("UPDATE bookings SET status = 'assigned' WHERE id = ?",
+                     [(booking_id,) for booking_id, _, _, _ in history])
+    conn.executemany('INSERT INTO order_status_history (booking_id, old_status, new_status, updated_by) VALUES (?, ?, ?, ?)',
+                     history)
+    conn.executemany('UPDATE routes SET dispatched_at = CURRENT_TIMESTAMP, delivery_guy_id = ? WHERE id = ?',
+                     [(assignment['delivery_guy_id'], assignment['route_id']) for assignment in plan['assignments']])
+    return assigned
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+In-process change-event broker behind the /events Server-Sent Events feed
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Iterable, Optional
+
+HEARTBEAT_SECONDS = 15.0
+REPLAY_BUFFER_SIZE = 2048
+SUBSCRIBER_QUEUE_SIZE = 256
+
+class ChangeEvent:
+    """A committed change, delivered to admins and to the users listed in ``user_ids``"""
+    __slots__ = ("id", "type", "data", "user_ids")
+
+    def __init__(self, event_id: str, event_type: str, data: dict, user_ids: frozenset):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+        self.user_ids = user_ids
+
+    def visible_to(self, user: dict) -> bool:
+        return user['role'] == 'admin' or user['id'] in self.user_ids
+
+    def encode(self) -> str:
+        payload = json.dumps({"type": self.type, **self.data}, default=str)
+        return f"id: {self.id}\ndata: {payload}\n\n"
+
+class _Subscriber:
+    __slots__ = ("user", "queue", "overflowed")
+
+    def __init__(self, user: dict):
+        self.user = user
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+class EventBroker:
+    """Fan out change events to connected SSE clients
+
+    Publishing happens on the event loop after the write has committed. Each
+    subscriber is a bounded queue, so an idle client is just a suspended
+    coroutine; a client that falls too far behind is disconnected and catches up
+    from the replay buffer when it reconnects with Last-Event-ID. Event ids carry
+    a per-process boot id, so an id from before a restart (or one that has left
+    the buffer) gets a ``reset`` event telling the client to refetch everything.
+    """
+
+    def __init__(self, buffer_size: int = REPLAY_BUFFER_SIZE, heartbeat: float = HEARTBEAT_SECONDS):
+        self.heartbeat = heartbeat
+        self._boot_id = format(int(time.time()), 'x')
+        self._sequence = itertools.count(1)
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+
+        # Metrics
+        self._published = 0
+        self._delivered = 0
+        self._dropped_subscribers = 0
+        self._resets = 0
+
+    def publish(self, event_type: str, data: dict, user_ids: Iterable[Optional[int]] = ()) -> ChangeEvent:
+        """Record an event and push it to every subscriber allowed to see it"""
+        event = ChangeEvent(f"{self._boot_id}-{next(self._sequence)}", event_type, data,
+                            frozenset(user_id for user_id in user_ids if user_id is not None))
+        self._buffer.append(event)
+        self._published += 1
+        for subscriber in self._subscribers:
+            if subscriber.overflowed or not event.visible_to(subscriber.user):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                self._delivered += 1
+            except asyncio.QueueFull:
+                subscriber.overflowed = True  # The stream closes once the queue drains
+        return event
+
+    def _replay(self, user: dict, last_event_id: Optional[str]) -> Optional[list]:
+        """Buffered events after last_event_id, or None if the id cannot be resumed from"""
+        if not last_event_id:
+            return []
+        boot_id, _, sequence = last_event_id.partition('-')
+        if boot_id != self._boot_id or not sequence.isdigit():
+            return None
+        last = int(sequence)
+        oldest = int(self._buffer[0].id.partition('-')[2]) if self._buffer else None
+        if oldest is not None and last < oldest - 1:
+            return None  # Events were evicted from the buffer
+        return [event for event in self._buffer
+                if int(event.id.partition('-')[2]) > last and event.visible_to(user)]
+
+    async def stream(self, user: dict, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        """SSE frames for one client: replay, then live events with heartbeats"""
+        subscriber = _Subscriber(user)
+        # Subscribe before replaying so nothing published in between is lost
+        self._subscribers.add(subscriber)
+        try:
+            yield "retry: 3000\n\n"
+            replay = self._replay(user, last_event_id)
+            if replay is None:
+                self._resets += 1
+                yield ChangeEvent(f"{self._boot_id}-{next(self._sequence)}", 'reset', {}, frozenset()).encode()
+                replay = []
+            sent = {event.id for event in replay}
+            for event in replay:
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event.id in sent:
+                    continue
+                yield event.encode()
+                if subscriber.overflowed and subscriber.queue.empty():
+                    # Too slow: disconnect and let the client resume from Last-Event-ID
+                    self._dropped_subscribers += 1
+                    break
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def get_stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "buffered_events": len(self._buffer),
+            "published": self._published,
+            "delivered": self._delivered,
+            "dropped_subscribers": self._dropped_subscribers,
+            "resets": self._resets
+        }
+
+# Global event broker instance
+event_broker = EventBroker()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Streaming NDJSON/CSV exports driven by fetchmany, so memory stays flat for any table size
+"""
+import csv
+import io
+import json
+from itertools import chain
+from typing import Iterator
+from database_manager import DatabaseManager
+from pagination import ListFilters, booking_filter_clauses, date_range_clauses, where_sql
+
+EXPORT_BATCH_SIZE = 1000
+
+# Each export joins its rows to the owning booking as `b` so the list filters apply unchanged
+EXPORT_QUERIES = {
+    'bookings': '''
+        SELECT b.* FROM bookings b
+        {where}
+        ORDER BY b.id
+    ''',
+    'materials': '''
+        SELECT m.id, m.booking_id, m.material, m.quantity, b.category, b.pincode, b.state, b.created_at
+        FROM materials m
+        JOIN bookings b ON b.id = m.booking_id
+        {where}
+        ORDER BY m.id
+    ''',
+    'deliveries': '''
+        SELECT d.id, d.booking_id, d.delivery_guy_id, u.username as delivery_guy, d.status,
+               d.assigned_at, d.completed_at, (b.current_delivery_id = d.id) as is_current,
+               b.category, b.pincode, b.created_at
+        FROM deliveries d
+        JOIN bookings b ON b.id = d.booking_id
+        LEFT JOIN users u ON u.id = d.delivery_guy_id
+        {where}
+        ORDER BY d.id
+    ''',
+    'points': '''
+        SELECT ph.id, ph.user_id, u.username, ph.transaction_id, ph.points_awarded, ph.timestamp,
+               b.category, b.pincode
+        FROM points_history ph
+        LEFT JOIN users u ON u.id = ph.user_id
+        LEFT JOIN bookings b ON b.id = ph.transaction_id
+        {where}
+        ORDER BY ph.id
+    ''',
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def export_query(dataset: str, filters: ListFilters):
+    """Build the SQL and parameters for an export"""
+    if dataset == 'points':
+        # Points rows are dated by their own timestamp; redemptions have no booking
+        booking_filters = filters.model_copy(update={'created_from': None, 'created_to': None})
+        clauses, params = booking_filter_clauses(booking_filters)
+        range_clauses, range_params = date_range_clauses('ph.timestamp', filters.created_from, filters.created_to)
+        clauses, params = clauses + range_clauses, params + range_params
+    else:
+        clauses, params = booking_filter_clauses(filters)
+    return EXPORT_QUERIES[dataset].format(where=where_sql(clauses)), params
+
+def _export_chunks(manager: DatabaseManager, dataset: str, fmt: str, filters: ListFilters,
+                   batch_size: int) -> Iterator[str]:
+    sql, params = export_query(dataset, filters)
+    with manager.get_connection() as conn:
+        cursor = conn.execute(sql, params)
+        try:
+            columns = [column[0] for column in cursor.description]
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow(columns)
+                yield buffer.getvalue()
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if fmt == 'csv':
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(tuple(row) for row in rows)
+                    yield buffer.getvalue()
+                else:
+                    yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+        except GeneratorExit:
+            pass  # Client went away mid-stream; the connection still goes back to the pool
+        finally:
+            cursor.close()
+
+def open_export(manager: DatabaseManager, dataset: str, fmt: str, filters: ListFilters,
+                batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[str]:
+    """Start an export and return an iterator over its chunks of at most ``batch_size`` rows
+
+    The first chunk is produced here, so pool timeouts and SQL errors surface
+    before any bytes are sent. The rest is a sync generator that StreamingResponse
+    iterates on a worker thread, keeping the event loop free; its pooled
+    connection is returned when the stream ends or the client disconnects.
+    """
+    chunks = _export_chunks(manager, dataset, fmt, filters, batch_size)
+    first = next(chunks, None)
+    return chain([first] if first is not None else [], chunks)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Offline geocoder: pincode/area gazetteer in SQLite with a memoized address resolver
+
+Usage:
+    python geocoder.py import <gazetteer.csv>   # load a pincode directory, then refine bookings
+    python geocoder.py backfill                 # fill lat/lon for bookings that have none
+"""
+import csv
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+BACKFILL_CHUNK_SIZE = 1000
+
+# Bundled fallback: approximate geographic centre of each state / union territory
+STATE_CENTROIDS = {
+    'andaman and nicobar islands': (11.7401, 92.6586),
+    'andhra pradesh': (15.9129, 79.7400),
+    'arunachal pradesh': (28.2180, 94.7278),
+    'assam': (26.2006, 92.9376),
+    'bihar': (25.0961, 85.3131),
+    'chandigarh': (30.7333, 76.7794),
+    'chhattisgarh': (21.2787, 81.8661),
+    'dadra and nagar haveli and daman and diu': (20.3974, 72.8328),
+    'delhi': (28.7041, 77.1025),
+    'goa': (15.2993, 74.1240),
+    'gujarat': (22.2587, 71.1924),
+    'haryana': (29.0588, 76.0856),
+    'himachal pradesh': (31.1048, 77.1734),
+    'jammu and kashmir': (33.7782, 76.5762),
+    'jharkhand': (23.6102, 85.2799),
+    'karnataka': (15.3173, 75.7139),
+    'kerala': (10.8505, 76.2711),
+    'ladakh': (34.1526, 77.5771),
+    'lakshadweep': (10.5667, 72.6417),
+    'madhya pradesh': (22.9734, 78.6569),
+    'maharashtra': (19.7515, 75.7139),
+    'manipur': (24.6637, 93.9063),
+    'meghalaya': (25.4670, 91.3662),
+    'mizoram': (23.1645, 92.9376),
+    'nagaland': (26.1584, 94.5624),
+    'odisha': (20.9517, 85.0985),
+    'puducherry': (11.9416, 79.8083),
+    'punjab': (31.1471, 75.3412),
+    'rajasthan': (27.0238, 74.2179),
+    'sikkim': (27.5330, 88.5122),
+    'tamil nadu': (11.1271, 78.6569),
+    'telangana': (18.1124, 79.0193),
+    'tripura': (23.9408, 91.9882),
+    'uttar pradesh': (26.8467, 80.9462),
+    'uttarakhand': (30.0668, 79.0193),
+    'west bengal': (22.9868, 87.8550),
+}
+
+# Abbreviations and old names seen in user-entered addresses
+STATE_ALIASES = {
+    'an': 'andaman and nicobar islands', 'ap': 'andhra pradesh', 'ar': 'arunachal pradesh', 'as': 'assam',
+    'br': 'bihar', 'ch': 'chandigarh', 'cg': 'chhattisgarh', 'ct': 'chhattisgarh', 'dl': 'delhi',
+    'new delhi': 'delhi', 'nct of delhi': 'delhi', 'ga': 'goa', 'gj': 'gujarat', 'hr': 'haryana',
+    'hp': 'himachal pradesh', 'jk': 'jammu and kashmir', 'j k': 'jammu and kashmir', 'jh': 'jharkhand',
+    'ka': 'karnataka', 'kl': 'kerala', 'la': 'ladakh', 'ld': 'lakshadweep', 'mp': 'madhya pradesh',
+    'mh': 'maharashtra', 'mn': 'manipur', 'ml': 'meghalaya', 'mz': 'mizoram', 'nl': 'nagaland',
+    'od': 'odisha', 'or': 'odisha', 'orissa': 'odisha', 'py': 'puducherry', 'pondicherry': 'puducherry',
+    'pb': 'punjab', 'rj': 'rajasthan', 'sk': 'sikkim', 'tn': 'tamil nadu', 'ts': 'telangana', 'tg': 'telangana',
+    'tr': 'tripura', 'up': 'uttar pradesh', 'uk': 'uttarakhand', 'ut': 'uttarakhand', 'uttaranchal': 'uttarakhand',
+    'wb': 'west bengal', 'dadra and nagar haveli': 'dadra and nagar haveli and daman and diu',
+    'daman and diu': 'dadra and nagar haveli and daman and diu', 'dn': 'dadra and nagar haveli and daman and diu',
+}
+
+# Words that vary between how users and the postal directory write the same locality
+AREA_NOISE = {'layout', 'nagar', 'colony', 'sector', 'phase', 'stage', 'block', 'extension', 'extn',
+              'road', 'rd', 'main', 'cross', 'east', 'west', 'north', 'south', 'so', 'bo', 'ho', 'po'}
+
+# Resolution precision, finest first
+PRECISIONS = ('area', 'pincode', 'district', 'state')
+# State centroids are hundreds of km off: such bookings keep their coordinates but are never routed
+UNROUTABLE_PRECISION = 'state'
+
+# Column names accepted by import_gazetteer (India Post directory and simple exports)
+CSV_COLUMNS = {
+    'pincode': ('pincode', 'pin', 'postal_code'),
+    'area': ('area', 'officename', 'office_name', 'locality', 'place_name'),
+    'district': ('district', 'districtname', 'district_name'),
+    'state': ('state', 'statename', 'state_name'),
+    'lat': ('lat', 'latitude'),
+    'lon': ('lon', 'lng', 'longitude'),
+}
+
+Coordinates = Tuple[float, float, str]  # lat, lon, precision
+
+def normalize_text(value: Optional[str]) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    if not value:
+        return ''
+    value = value.lower().replace('&', ' and ')
+    return ' '.join(re.sub(r'[^a-z0-9 ]+', ' ', value).split())
+
+def normalize_pincode(value: Optional[str]) -> str:
+    """Six-digit pincode, or '' if the value is not one"""
+    digits = re.sub(r'\D', '', value or '')
+    return digits if len(digits) == 6 else ''
+
+def normalize_state(value: Optional[str]) -> str:
+    state = normalize_text(value)
+    return STATE_ALIASES.get(state, state)
+
+def area_key(value: Optional[str]) -> str:
+    """Normalized locality name with postal suffixes and generic words removed"""
+    # Single letters are mostly split abbreviations such as "S.O" or "H.O"
+    words = [word for word in normalize_text(value).split()
+             if word not in AREA_NOISE and len(word) > 1 and not word.isdigit()]
+    return ' '.join(words)
+
+def ensure_gazetteer(conn: sqlite3.Connection):
+    """Create the gazetteer table (empty until a pincode directory is imported)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gazetteer (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pincode TEXT NOT NULL,
+            area TEXT,
+            area_key TEXT NOT NULL,
+            district TEXT,
+            state_key TEXT NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            UNIQUE (pincode, area_key)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gazetteer_area_state ON gazetteer(area_key, state_key)")
+    # Any change (including an import by another process) bumps the version the resolver memo is keyed on
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_gazetteer_version_{event.lower()}
+            AFTER {event} ON gazetteer
+            BEGIN
+                INSERT INTO table_versions (scope, user_id, version) VALUES ('gazetteer', 0, 1)
+                ON CONFLICT(scope, user_id) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+def gazetteer_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT version FROM table_versions WHERE scope = 'gazetteer' AND user_id = 0").fetchone()
+    return row[0] if row else 0
+
+class AddressResolver:
+    """Resolve booking addresses to coordinates from the gazetteer, memoized in a bounded LRU
+
+    Lookups fall back from the most to the least precise match: pincode and
+    area, pincode centroid, area within the state, the pincode's 3-digit
+    sorting district, and finally the bundled state centroid. Results
+    (including misses) are memoized by normalized address for one gazetteer
+    version: a repeat address costs a single primary-key read of the version,
+    and the memo is dropped as soon as the gazetteer changes, even when another
+    process imported the data.
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._memo = OrderedDict()  # (pincode, area_key, state_key) -> Coordinates or None
+        self._version = None  # Gazetteer version the memo was filled from
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._precision_counts = {precision: 0 for precision in PRECISIONS}
+        self._unresolved = 0
+
+    def resolve(self, conn: sqlite3.Connection, pincode: Optional[str], area: Optional[str] = None,
+                state: Optional[str] = None) -> Optional[Coordinates]:
+        """(lat, lon, precision) for an address, or None if nothing matches"""
+        key = (normalize_pincode(pincode), area_key(area), normalize_state(state))
+        version = gazetteer_version(conn)
+        with self._lock:
+            if version != self._version:
+                self._memo.clear()
+                self._version = version
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self._hits += 1
+                return self._memo[key]
+            self._misses += 1
+        result = self._lookup(conn, *key)
+        with self._lock:
+            if result is None:
+                self._unresolved += 1
+            else:
+                self._precision_counts[result[2]] += 1
+            if version != self._version:
+                return result
+            self._memo[key] = result
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return result
+
+    def _lookup(self, conn: sqlite3.Connection, pincode: str, area: str, state: str) -> Optional[Coordinates]:
+        if pincode and area:
+            row = conn.execute('SELECT lat, lon FROM gazetteer WHERE pincode = ? AND area_key = ?',
+                               (pincode, area)).fetchone()
+            if row:
+                return row[0], row[1], 'area'
+        if pincode:
+            row = conn.execute('SELECT AVG(lat), AVG(lon) FROM gazetteer WHERE pincode = ?', (pincode,)).fetchone()
+            if row[0] is not None:
+                return row[0], row[1], 'pincode'
+        if area and state:
+            row = conn.execute('SELECT AVG(lat), AVG(lon) FROM gazetteer WHERE area_key = ? AND state_key = ?',
+                               (area, state)).fetchone()
+            if row[0] is not None:
+                return row[0], row[1], 'area'
+        if pincode:
+            # First three digits identify the sorting district
+            prefix = pincode[:3]
+            row = conn.execute('SELECT AVG(lat), AVG(lon) FROM gazetteer WHERE pincode >= ? AND pincode < ?',
+                               (prefix + '000', prefix + '999~')).fetchone()
+            if row[0] is not None:
+                return row[0], row[1], 'district'
+        if state in STATE_CENTROIDS:
+            lat, lon = STATE_CENTROIDS[state]
+            return lat, lon, 'state'
+        return None
+
+    def clear(self):
+        """Drop memoized results"""
+        with self._lock:
+            self._memo.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._memo),
+                "gazetteer_version": self._version,
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "resolved_by_precision": dict(self._precision_counts),
+                "unresolved": self._unresolved
+            }
+
+def _pick(row: dict, field: str) -> Optional[str]:
+    for name in CSV_COLUMNS[field]:
+        value = row.get(name)
+        if value not in (None, '', 'NA'):
+            return value
+    return None
+
+def import_gazetteer(conn: sqlite3.Connection, rows: Iterable[dict]) -> int:
+    """Upsert gazetteer rows (dicts keyed by any CSV_COLUMNS alias); returns rows imported"""
+    batch = []
+    for raw in rows:
+        row = {normalize_text(name).replace(' ', ''): value for name, value in raw.items() if name}
+        pincode = normalize_pincode(_pick(row, 'pincode'))
+        try:
+            lat, lon = float(_pick(row, 'lat')), float(_pick(row, 'lon'))
+        except (TypeError, ValueError):
+            continue
+        if not pincode or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            continue
+        area = _pick(row, 'area')
+        batch.append((pincode, area, area_key(area), _pick(row, 'district'),
+                      normalize_state(_pick(row, 'state')), lat, lon))
+    conn.executemany('''
+        INSERT INTO gazetteer (pincode, area, area_key, district, state_key, lat, lon)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(pincode, area_key) DO UPDATE SET
+            area = excluded.area, district = excluded.district, state_key = excluded.state_key,
+            lat = excluded.lat, lon = excluded.lon
+    ''', batch)
+    return len(batch)
+
+def backfill_chunk(conn: sqlite3.Connection, resolver: AddressResolver, refine: bool = False,
+                   after_id: int = 0, chunk_size: int = BACKFILL_CHUNK_SIZE) -> Tuple[int, int]:
+    """Geocode up to chunk_size bookings after after_id
+
+    Covers bookings without coordinates, plus (with ``refine``) those only
+    resolved to a district or state. Returns (last id seen, rows updated);
+    a last id of 0 means there is nothing left.
+    """
+    condition = "lat IS NULL"
+    if refine:
+        condition += " OR geo_precision IN ('district', 'state')"
+    rows = conn.execute(f'''
+        SELECT id, pincode, area, state FROM bookings
+        WHERE id > ? AND ({condition})
+        ORDER BY id LIMIT ?
+    ''', (after_id, chunk_size)).fetchall()
+    if not rows:
+        return 0, 0
+    updates = []
+    for booking_id, pincode, area, state in rows:
+        result = resolver.resolve(conn, pincode, area, state)
+        if result is not None:
+            updates.append((result[0], result[1], result[2], booking_id))
+    conn.executemany('UPDATE bookings SET lat = ?, lon = ?, geo_precision = ? WHERE id = ?', updates)
+    return rows[-1][0], len(updates)
+
+def backfill(conn: sqlite3.Connection, resolver: AddressResolver, refine: bool = False) -> int:
+    """Geocode existing bookings, committing one chunk at a time"""
+    after_id, total = 0, 0
+    while True:
+        after_id, updated = backfill_chunk(conn, resolver, refine, after_id)
+        conn.commit()
+        total += updated
+        if not after_id:
+            return total
+
+# Global address resolver instance
+address_resolver = AddressResolver()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('import', 'backfill') or (sys.argv[1] == 'import' and len(sys.argv) < 3):
+        print(__doc__)
+        sys.exit(1)
+    from schema import ensure_schema
+    conn = sqlite3.connect('e_waste.db')
+    ensure_schema(conn)
+    conn.commit()
+    refine = False
+    if sys.argv[1] == 'import':
+        with open(sys.argv[2], newline='', encoding='utf-8-sig') as f:
+            imported = import_gazetteer(conn, csv.DictReader(f))
+        conn.commit()
+        print(f"✅ Imported {imported} gazetteer entries")
+        refine = True
+    updated = backfill(conn, address_resolver, refine=refine)
+    conn.close()
+    print(f"✅ Geocoded {updated} bookings")
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash index of classified images for near-duplicate detection
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from itertools import combinations
+from typing import List, Optional
+from async_db import AsyncDatabase, db
+from events import event_broker
+
+HASH_SIZE = 8  # dHash grid: 8x8 gradient bits, a 64-bit hash
+REUSE_RADIUS = int(os.getenv("IMAGE_REUSE_RADIUS", "4"))  # Close enough to reuse a cached classification
+REVIEW_RADIUS = int(os.getenv("IMAGE_REVIEW_RADIUS", "8"))  # Close enough to flag another user's upload for review
+REVIEW_STATUSES = ('pending', 'cleared', 'rejected')
+
+IMAGE_HASH_COLUMNS = '''
+    i.id, i.content_hash, i.user_id, u.username, i.match_id, m.user_id AS match_user_id,
+    i.match_distance, i.review_status, i.reviewed_by, i.reviewed_at, i.created_at
+'''
+
+def ensure_image_hashes(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phash INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            user_id INTEGER REFERENCES users(id),
+            match_id INTEGER REFERENCES image_hashes(id),
+            match_distance INTEGER,
+            review_status TEXT,
+            reviewed_by INTEGER REFERENCES users(id),
+            reviewed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_hashes_review ON image_hashes(review_status, created_at, id)
+        WHERE review_status IS NOT NULL
+    ''')
+
+def dhash(image, size: int = HASH_SIZE) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a (size+1) x size greyscale thumbnail
+
+    Survives recompression, rescaling and small crops or colour changes; similar
+    images differ in few bits (Hamming distance).
+    """
+    from PIL import Image
+    pixels = list(image.convert('L').resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+# SQLite integers are signed 64-bit
+def _to_db(phash: int) -> int:
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+def _from_db(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+class MultiIndexHash:
+    """Multi-index hashing of 64-bit hashes for Hamming-radius queries
+
+    Each hash is split into ``blocks`` substrings and indexed in one table per
+    substring. If two hashes are within radius r, by the pigeonhole principle
+    at least one pair of substrings is within r // blocks, so a query only
+    probes the buckets at that small distance in each table and checks the
+    candidates found there, instead of every stored hash. Images with the same
+    hash share an entry.
+    """
+
+    def __init__(self, bits: int = HASH_SIZE * HASH_SIZE, blocks: int = 4):
+        self.blocks = blocks
+        self.block_bits = bits // blocks
+        self._mask = (1 << self.block_bits) - 1
+        self._tables = [{} for _ in range(blocks)]  # substring -> hashes
+        self._items = {}  # hash -> items
+        self._flips = {}  # sub-radius -> XOR masks of up to that many bits
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def distinct(self) -> int:
+        return len(self._items)
+
+    def _substrings(self, value: int):
+        return [(value >> (index * self.block_bits)) & self._mask for index in range(self.blocks)]
+
+    def _flip_masks(self, radius: int):
+        masks = self._flips.get(radius)
+        if masks is None:
+            masks = [sum(1 << bit for bit in bits)
+                     for count in range(radius + 1) for bits in combinations(range(self.block_bits), count)]
+            self._flips[radius] = masks
+        return masks
+
+    def add(self, value: int, item):
+        self._size += 1
+        items = self._items.get(value)
+        if items is None:
+            items = self._items[value] = []
+            for table, substring in zip(self._tables, self._substrings(value)):
+                table.setdefault(substring, []).append(value)
+        items.append(item)
+
+    def search(self, value: int, radius: int):
+        """(distance, item) pairs within radius, nearest first, and the number of candidate hashes checked"""
+        masks = self._flip_masks(radius // self.blocks)
+        candidates = set()
+        for table, substring in zip(self._tables, self._substrings(value)):
+            for mask in masks:
+                bucket = table.get(substring ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for candidate in candidates:
+            distance = hamming(value, candidate)
+            if distance <= radius:
+                found.extend((distance, item) for item in self._items[candidate])
+        found.sort(key=lambda pair: pair[0])
+        return found, len(candidates)
+
+@dataclass
+class ImageMatch:
+    image_id: int
+    content_hash: str
+    user_id: int
+    distance: int
+
+def _load_hashes(conn: sqlite3.Connection):
+    return conn.execute('SELECT id, phash, content_hash, user_id FROM image_hashes').fetchall()
+
+def _insert_hash(conn: sqlite3.Connection, phash: int, content_hash: str, user_id: int,
+                 match: Optional[ImageMatch], review_status: Optional[str]) -> int:
+    return conn.execute('''
+        INSERT INTO image_hashes (phash, content_hash, user_id, match_id, match_distance, review_status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (_to_db(phash), content_hash, user_id, match.image_id if match else None,
+          match.distance if match else None, review_status)).lastrowid
+
+def get_image_review(conn: sqlite3.Connection, image_id: int) -> Optional[dict]:
+    row = conn.execute(f'''
+        SELECT {IMAGE_HASH_COLUMNS} FROM image_hashes i
+        LEFT JOIN users u ON u.id = i.user_id
+        LEFT JOIN image_hashes m ON m.id = i.match_id
+        WHERE i.id = ? AND i.review_status IS NOT NULL
+    ''', (image_id,)).fetchone()
+    return dict(row) if row else None
+
+def resolve_image_review(conn: sqlite3.Connection, image_id: int, status: str, admin_id: int) -> int:
+    return conn.execute('''
+        UPDATE image_hashes SET review_status = ?, reviewed_by = ?, reviewed_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND review_status IS NOT NULL
+    ''', (status, admin_id, image_id)).rowcount
+
+class ImageHashIndex:
+    """dHashes of classified images in a multi-index hash table, persisted in ``image_hashes``
+
+    The index is built from the table on first use (not at startup) and kept in
+    memory; every classified image is added, except a user's repeat upload of
+    a picture they already have indexed at distance 0. A new image within
+    REUSE_RADIUS of an indexed one can reuse its cached classification, and one
+    within REVIEW_RADIUS of another user's image is recorded as pending admin
+    review.
+    """
+
+    def __init__(self, database: AsyncDatabase, reuse_radius: int = REUSE_RADIUS, review_radius: int = REVIEW_RADIUS):
+        self.database = database
+        self.reuse_radius = reuse_radius
+        self.review_radius = review_radius
+        self._index: Optional[MultiIndexHash] = None
+        self._index_lock = threading.Lock()
+        self._load_lock = asyncio.Lock()
+
+        # Metrics
+        self._queries = 0
+        self._candidates = 0
+        self._flagged = 0
+        self._reused = 0
+        self._repeats = 0
+
+    async def _ensure_loaded(self) -> MultiIndexHash:
+        if self._index is not None:
+            return self._index
+        async with self._load_lock:
+            if self._index is None:
+                rows = await self.database.run(_load_hashes)
+
+                def build():
+                    index = MultiIndexHash()
+                    for image_id, phash, content_hash, user_id in rows:
+                        index.add(_from_db(phash), (image_id, content_hash, user_id))
+                    return index
+
+                self._index = await asyncio.to_thread(build)
+                print(f"✅ Image hash index loaded: {len(self._index)} images")
+        return self._index
+
+    async def find(self, phash: int) -> List[ImageMatch]:
+        """Indexed images within review_radius of phash, nearest first"""
+        index = await self._ensure_loaded()
+
+        def search():
+            with self._index_lock:
+                return index.search(phash, self.review_radius)
+
+        found, candidates = await asyncio.to_thread(search)
+        self._queries += 1
+        self._candidates += candidates
+        return [ImageMatch(image_id, content_hash, user_id, distance) for distance, (image_id, content_hash, user_id) in found]
+
+    def reusable(self, matches: List[ImageMatch]) -> List[ImageMatch]:
+        return [match for match in matches if match.distance <= self.reuse_radius]
+
+    def record_reuse(self):
+        self._reused += 1
+
+    async def record(self, phash: int, content_hash: str, user_id: int, matches: List[ImageMatch]) -> dict:
+        """Store a classified image; flag it when it is a near-duplicate of another user's image
+
+        A picture the same user already has indexed at distance 0 (including the
+        identical content hash) is not stored again.
+        """
+        index = await self._ensure_loaded()
+        repeat = next((match for match in matches if match.user_id == user_id and match.distance == 0), None)
+        if repeat is not None:
+            self._repeats += 1
+            return {'image_id': repeat.image_id, 'flagged': False}
+        match = next((match for match in matches if match.user_id != user_id), None)
+        review_status = 'pending' if match is not None else None
+        image_id = await self.database.transaction(_insert_hash, phash, content_hash, user_id, match, review_status)
+        with self._index_lock:
+            index.add(phash, (image_id, content_hash, user_id))
+        if match is not None:
+            self._flagged += 1
+            event_broker.publish('image.flagged', {'image_id': image_id, 'match_id': match.image_id,
+                                                   'distance': match.distance, 'user_id': user_id})
+        return {'image_id': image_id, 'flagged': match is not None}
+
+    def get_stats(self) -> dict:
+        index = self._index
+        return {
+            "loaded": index is not None,
+            "images": len(index) if index else 0,
+            "distinct_hashes": index.distinct if index else 0,
+            "reuse_radius": self.reuse_radius,
+            "review_radius": self.review_radius,
+            "queries": self._queries,
+            "avg_candidates": round(self._candidates / self._queries, 1) if self._queries else 0.0,
+            "reused": self._reused,
+            "repeats": self._repeats,
+            "flagged": self._flagged
+        }
+
+# Global image hash index instance
+image_index = ImageHashIndex(db)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Durable in-process background jobs for long-running admin operations
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from async_db import AsyncDatabase, db
+from events import EventBroker, event_broker
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = 2.0  # Doubles with every failed attempt
+POLL_SECONDS = 30.0  # Fallback for jobs queued by other processes; submits wake workers directly
+PROGRESS_INTERVAL_SECONDS = 0.5  # Progress writes are throttled to this rate per job
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+JOB_COLUMNS = '''id, kind, status, params, progress, message, result, error, attempts, max_attempts,
+                 cancel_requested, created_by, created_at, started_at, finished_at'''
+
+def ensure_jobs(conn: sqlite3.Connection):
+    """Job queue and history; run_after is a unix time so retries can be delayed"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            params TEXT NOT NULL DEFAULT '{}',
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 1,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL DEFAULT 0,
+            created_by INTEGER REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            heartbeat_at TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at, id)")
+
+def job_response(row) -> Optional[dict]:
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+def get_job(conn: sqlite3.Connection, job_id: int) -> Optional[dict]:
+    return job_response(conn.execute(f'SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+def _insert_job(conn: sqlite3.Connection, kind: str, params: dict, max_attempts: int,
+                created_by: Optional[int]) -> dict:
+    cur = conn.execute('INSERT INTO jobs (kind, params, max_attempts, created_by) VALUES (?, ?, ?, ?)',
+                       (kind, json.dumps(params, default=str), max_attempts, created_by))
+    return get_job(conn, cur.lastrowid)
+
+def _claim_job(conn: sqlite3.Connection, kinds: List[str], now: float) -> Optional[dict]:
+    """Mark the oldest runnable job as running and return it (the single writer makes this atomic)"""
+    row = conn.execute(f'''
+        SELECT id FROM jobs
+        WHERE status = 'queued' AND run_after <= ? AND kind IN ({','.join('?' * len(kinds))})
+        ORDER BY run_after, id LIMIT 1
+    ''', [now, *kinds]).fetchone()
+    if row is None:
+        return None
+    conn.execute('''
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, message = NULL,
+                        started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (row[0],))
+    return get_job(conn, row[0])
+
+# Replaces the last progress message once a job stops for good
+FINAL_MESSAGES = {'succeeded': 'Completed', 'failed': 'Failed', 'cancelled': 'Cancelled'}
+
+def _recover_jobs(conn: sqlite3.Connection) -> int:
+    """Requeue jobs left running by a crash; ones out of attempts or being cancelled are closed"""
+    conn.execute('''
+        UPDATE jobs SET status = 'cancelled', message = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND cancel_requested = 1
+    ''', (FINAL_MESSAGES['cancelled'],))
+    conn.execute('''
+        UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart', message = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND attempts >= max_attempts
+    ''', (FINAL_MESSAGES['failed'],))
+    return conn.execute('''
+        UPDATE jobs SET status = 'queued', run_after = 0, message = 'Requeued after a restart'
+        WHERE status = 'running'
+    ''').rowcount
+
+def _store_progress(conn: sqlite3.Connection, job_id: int, progress: float, message: Optional[str]):
+    conn.execute('''
+        UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'running'
+    ''', (progress, message, job_id))
+
+def _finish_job(conn: sqlite3.Connection, job_id: int, status: str, result: Any = None,
+                error: Optional[str] = None) -> dict:
+    conn.execute('''
+        UPDATE jobs SET status = ?, result = ?, error = ?, message = ?, finished_at = CURRENT_TIMESTAMP,
+                        progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END
+        WHERE id = ?
+    ''', (status, json.dumps(result, default=str) if result is not None else None, error, FINAL_MESSAGES[status],
+          status, job_id))
+    return get_job(conn, job_id)
+
+def _requeue_job(conn: sqlite3.Connection, job_id: int, run_after: float, error: str) -> dict:
+    conn.execute('''
+        UPDATE jobs SET status = 'queued', run_after = ?, error = ?, message = 'Waiting to retry'
+        WHERE id = ?
+    ''', (run_after, error, job_id))
+    return get_job(conn, job_id)
+
+def _cancel_job(conn: sqlite3.Connection, job_id: int) -> Optional[dict]:
+    """Cancel a queued job outright; a running one is flagged and stops at its next checkpoint"""
+    conn.execute('''
+        UPDATE jobs SET status = 'cancelled', cancel_requested = 1, message = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'queued'
+    ''', (FINAL_MESSAGES['cancelled'], job_id))
+    conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+    return get_job(conn, job_id)
+
+def _retry_job(conn: sqlite3.Connection, job_id: int) -> Optional[dict]:
+    """Put a failed or cancelled job back in the queue with a fresh set of attempts"""
+    conn.execute('''
+        UPDATE jobs SET status = 'queued', attempts = 0, cancel_requested = 0, run_after = 0, progress = 0,
+                        message = NULL, result = NULL, error = NULL, started_at = NULL, finished_at = NULL
+        WHERE id = ? AND status IN ('failed', 'cancelled')
+    ''', (job_id,))
+    return get_job(conn, job_id)
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint once cancellation of the running job was requested"""
+
+class JobContext:
+    """Handle passed to a job handler for progress reporting and cancellation checks"""
+
+    def __init__(self, manager: 'JobManager', job: dict):
+        self.manager = manager
+        self.id = job['id']
+        self.kind = job['kind']
+        self.attempt = job['attempts']
+        self.created_by = job['created_by']
+        self._last_progress = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        """Safe to read from worker threads"""
+        return self.id in self.manager._cancel_requested
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    async def progress(self, fraction: float, message: Optional[str] = None, force: bool = False):
+        """Record progress (0-1) and stop here if the job was cancelled"""
+        self.check_cancelled()
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_progress = now
+        fraction = round(min(max(fraction, 0.0), 1.0), 4)
+        await self.manager.database.transaction(_store_progress, self.id, fraction, message)
+        self.manager.broker.publish('job.progress', {'job_id': self.id, 'kind': self.kind, 'progress': fraction,
+                                                     'message': message}, [self.created_by])
+
+JobHandler = Callable[..., Awaitable[Any]]
+
+class JobManager:
+    """Worker pool running jobs from the SQLite ``jobs`` table
+
+    Jobs are rows, so they survive restarts: ``start()`` requeues anything a
+    crash left running before the workers begin claiming. Workers are asyncio
+    tasks; handlers keep the event loop free by doing their database work
+    through the read pool and short writer transactions, and CPU-heavy steps
+    in a thread. A failed attempt is retried with exponential backoff until
+    the kind's ``max_attempts`` is used up. Cancellation is cooperative: the
+    handler stops at its next ``progress()`` or ``check_cancelled()`` call.
+    """
+
+    def __init__(self, database: AsyncDatabase, broker: EventBroker, workers: int = JOB_WORKERS):
+        self.database = database
+        self.broker = broker
+        self.workers = workers
+        self._handlers: Dict[str, tuple] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._running: Set[int] = set()
+        self._cancel_requested: Set[int] = set()
+
+        # Metrics
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._retried = 0
+        self._cancelled = 0
+        self._recovered = 0
+
+    def register(self, kind: str, handler: JobHandler, max_attempts: int = JOB_MAX_ATTEMPTS):
+        """handler(ctx, **params) is awaited for each job of this kind; its return value is the result"""
+        self._handlers[kind] = (handler, max_attempts)
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._recovered += await self.database.transaction(_recover_jobs)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Interrupted jobs stay 'running' and are requeued by the next start()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def submit(self, kind: str, params: Optional[dict] = None, created_by: Optional[int] = None) -> dict:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job = await self.database.transaction(_insert_job, kind, params or {}, self._handlers[kind][1], created_by)
+        self._submitted += 1
+        self._publish(job)
+        self._notify()
+        return job
+
+    async def cancel(self, job_id: int) -> Optional[dict]:
+        job = await self.database.transaction(_cancel_job, job_id)
+        if job is not None and job['status'] == 'running':
+            self._cancel_requested.add(job_id)
+        elif job is not None and job['status'] == 'cancelled' and job_id not in self._running:
+            self._publish(job)
+        return job
+
+    async def retry(self, job_id: int) -> Optional[dict]:
+        job = await self.database.transaction(_retry_job, job_id)
+        if job is not None and job['status'] == 'queued':
+            self._publish(job)
+            self._notify()
+        return job
+
+    def _publish(self, job: dict):
+        self.broker.publish('job.updated', {'job_id': job['id'], 'kind': job['kind'], 'status': job['status'],
+                                            'progress': job['progress'], 'error': job['error']}, [job['created_by']])
+
+    async def _worker(self):
+        while True:
+            self._wake.clear()
+            job = await self.database.transaction(_claim_job, list(self._handlers), time.time())
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._running.add(job['id'])
+            try:
+                await self._run(job)
+            finally:
+                self._running.discard(job['id'])
+                self._cancel_requested.discard(job['id'])
+
+    async def _run(self, job: dict):
+        handler, max_attempts = self._handlers[job['kind']]
+        self._publish(job)
+        try:
+            result = await handler(JobContext(self, job), **job['params'])
+        except JobCancelled:
+            self._cancelled += 1
+            job = await self.database.transaction(_finish_job, job['id'], 'cancelled')
+        except asyncio.CancelledError:
+            raise  # Shutting down; recovered on the next start
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] < max_attempts and job['id'] not in self._cancel_requested:
+                self._retried += 1
+                delay = RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1)
+                job = await self.database.transaction(_requeue_job, job['id'], time.time() + delay, error)
+                asyncio.get_running_loop().call_later(delay, self._notify)
+                print(f"🔄 Job {job['id']} ({job['kind']}) failed, retrying in {delay:.0f}s: {error}")
+            else:
+                self._failed += 1
+                job = await self.database.transaction(_finish_job, job['id'], 'failed', None, error)
+                print(f"⚠️ Job {job['id']} ({job['kind']}) failed: {error}")
+        else:
+            self._succeeded += 1
+            job = await self.database.transaction(_finish_job, job['id'], 'succeeded', result)
+        self._publish(job)
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": len(self._running),
+            "kinds": sorted(self._handlers),
+            "submitted": self._submitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "retried": self._retried,
+            "cancelled": self._cancelled,
+            "recovered": self._recovered
+        }
+
+# Global job manager instance
+job_manager = JobManager(db, event_broker)
@@ -1,20 +1,43 @@
 #!/usr/bin/env python3
-from fastapi import FastAPI, HTTPException, Body, Query, Depends, status, File, UploadFile
+from fastapi import FastAPI, HTTPException, Body, Query, Depends, status, File, UploadFile, Request, Response, BackgroundTasks
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager
+import asyncio
 import sqlite3
-import numpy as np
-import pandas as pd
-from sklearn.cluster import KMeans
 from pydantic import BaseModel
-from typing import Optional
+from typing import Callable, Dict, List, Optional
 import os
 from dotenv import load_dotenv
-from ai_image_classifier import EwasteImageClassifier
-from database_manager import db_manager
+from ai_image_classifier import ClassifierUnavailable, EwasteImageClassifier
+from classification_cache import classification_cache
+from image_index import (IMAGE_HASH_COLUMNS, REVIEW_STATUSES, image_index, get_image_review,
+                         resolve_image_review)
+from database_manager import db_manager, PoolTimeoutError
+from schema import ensure_schema
+from pagination import (ListFilters, PageParams, list_filters, page_params, booking_filter_clauses,
+                        date_range_clauses, keyset_clause, where_sql, limit_sql, paginate)
+from async_db import db, RequestDatabase
+from exports import EXPORT_FORMATS, EXPORT_QUERIES, open_export
+from db_writer import db_writer
+from events import event_broker
+from geocoder import UNROUTABLE_PRECISION, address_resolver, backfill_chunk
+from jobs import JOB_COLUMNS, JOB_STATUSES, JobContext, job_manager, job_response, get_job
+from dispatch import plan_dispatch, apply_dispatch
+from delivery_sync import DELIVERY_STATUSES, SYNC_MAX_ITEMS, award_delivery_points, sync_statuses
+from routing import (REBALANCE_DRIFT, plan_routes, plan_pincode_routes, route_summary, plan_stop_order, store_stop_order,
+                     attach_to_route, attach_by_pincode, rebalance_candidates)
+from analytics import INTERVALS, GROUP_BYS, MAX_HOURLY_DAYS, recovery_equivalents, timeseries
+from rollups import GLOBAL_ROLLUP, category_counts, dashboard_totals
+from yields import (yield_engine, publish_yield_version, recompute_chunk, stale_booking_count,
+                    store_booking_materials)
+from versions import GLOBAL_VERSION, VersionKey, version_key, fetch_versions, make_etag, etag_matches
+from auth_cache import principal_cache
+from password_hasher import PasswordHasher, HasherBusyError
 
 # Load environment variables from .env file
 load_dotenv(dotenv_path="../.env")  # Load from parent directory
@@ -24,28 +47,48 @@ load_dotenv()  # Also try current directory
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+HASH_MAX_WORKERS = int(os.getenv("HASH_MAX_WORKERS", "4"))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "32"))
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")  # Files written by export jobs
 
 # Initialize AI Image Classifier
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 print(f"GEMINI_API_KEY loaded: {'Yes' if GEMINI_API_KEY else 'No'}")
 if GEMINI_API_KEY and GEMINI_API_KEY != "your_gemini_api_key_here":
-    try:
-        image_classifier = EwasteImageClassifier(GEMINI_API_KEY)
-        print("AI Image Classifier initialized successfully!")
-    except Exception as e:
-        print(f"Error initializing AI classifier: {e}")
-        image_classifier = None
+    # Cheap: the SDK is loaded and the connection tested by the warm-up task at startup
+    image_classifier = EwasteImageClassifier(GEMINI_API_KEY, cache=classification_cache, index=image_index)
 else:
     image_classifier = None
     print("Warning: GEMINI_API_KEY not found or invalid. Image classification will not work.")
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(pwd_context, max_workers=HASH_MAX_WORKERS, max_queue=HASH_MAX_QUEUE)
 
 # Security
 security = HTTPBearer()
 
-app = FastAPI(title="Smart E-Waste to Renewable Platform")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db_writer.start()
+    await db.transaction(ensure_schema)
+    await db.run(yield_engine.load)
+    await job_manager.start()
+    warmup = None
+    if image_classifier is not None:
+        # Serve immediately; /ai/health reports the classifier's readiness while it warms up
+        warmup = asyncio.create_task(asyncio.to_thread(image_classifier.warm_up))
+    yield
+    if warmup is not None:
+        # Don't wait on a warm-up still testing the connection; its thread ends within the warm-up timeout
+        warmup.cancel()
+        await asyncio.gather(warmup, return_exceptions=True)
+    await job_manager.stop()
+    # Flush pending group commits before the worker exits
+    db.shutdown()
+    password_hasher.shutdown()
+
+app = FastAPI(title="Smart E-Waste to Renewable Platform", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -55,6 +98,20 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+@app.middleware("http")
+async def db_timing_middleware(request: Request, call_next):
+    response = await call_next(request)
+    # get_request_db leaves its per-request stats on request.state
+    request_db = getattr(request.state, 'db', None)
+    if request_db is not None:
+        response.headers['Server-Timing'] = request_db.server_timing()
+    return response
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    # Pool exhausted: tell the client to back off instead of failing with a 500
+    return JSONResponse(status_code=503, content={"detail": "Database busy, please retry shortly"})
+
 # Pydantic models
 class UserCreate(BaseModel):
     username: str
@@ -90,32 +147,51 @@ class DeliveryAssignment(BaseModel):
     booking_id: int
     delivery_guy_id: int
 
-def get_conn():
-    """Deprecated: Use db_manager.get_connection() instead for better performance"""
-    conn = sqlite3.connect('e_waste.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def get_user(username: str):
-    with db_manager.get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        if user:
-            return dict(user)
-        return None
+class DeliveryStatusUpdate(BaseModel):
+    idempotency_key: str
+    booking_id: int
+    status: str
+    client_timestamp: Optional[datetime] = None
+
+class DeliveryStatusSync(BaseModel):
+    updates: List[DeliveryStatusUpdate]
+
+class CategoryYield(BaseModel):
+    avg_weight: float
+    yields: Dict[str, float]
+
+class YieldTableUpdate(BaseModel):
+    categories: Dict[str, CategoryYield]
+
+class ImageReviewDecision(BaseModel):
+    status: str
 
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
+async def get_request_db(request: Request) -> RequestDatabase:
+    """Per-request database stats, shared by the auth dependency and the handler"""
+    request_db = RequestDatabase(db)
+    request.state.db = request_db
+    return request_db
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HasherBusyError:
+        raise HTTPException(status_code=503, detail="Authentication service busy, please retry shortly")
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusyError:
+        raise HTTPException(status_code=503, detail="Authentication service busy, please retry shortly")
+
+async def get_user(username: str, db: RequestDatabase):
+    return await db.fetch_one("SELECT * FROM users WHERE username = ?", (username,))
+
+async def authenticate_user(username: str, password: str, db: RequestDatabase):
+    user = await get_user(username, db)
     if not user:
         return False
-    if not verify_password(password, user['password_hash']):
+    if not await verify_password(password, user['password_hash']):
         return False
     return user
 
@@ -129,14 +205,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def resolve_principal(token: str, db: RequestDatabase) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Polling traffic reuses the same token, so serve the principal from cache when possible; one primary-key
+    # read of the user's version catches role, password or removal changes made since it was cached
+    cached = principal_cache.get(token)
+    if cached:
+        _, user, version = cached
+        if await db.run(fetch_versions, [('users', user['id'])]) == [version]:
+            return user
+        principal_cache.invalidate(token)
+    
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         role: str = payload.get("role")
         if username is None or role is None:
@@ -145,14 +230,34 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    user = get_user(username=token_data.username)
+    user = await get_user(token_data.username, db)
     if user is None:
         raise credentials_exception
+    if user['role'] != token_data.role:
+        # Role changed since the token was issued
+        raise credentials_exception
+    # Read after the row: a change in between only makes the entry look stale
+    version, = await db.run(fetch_versions, [('users', user['id'])])
+    principal_cache.put(token, payload, user, version)
     return user
 
-def require_role(required_role: str):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security),
+                           db: RequestDatabase = Depends(get_request_db)):
+    return await resolve_principal(credentials.credentials, db)
+
+async def get_stream_user(token: Optional[str] = Query(None, description="Bearer token (EventSource cannot send headers)"),
+                          credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+                          db: RequestDatabase = Depends(get_request_db)):
+    if credentials is not None:
+        token = credentials.credentials
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return await resolve_principal(token, db)
+
+def require_role(*roles: str):
     def role_checker(current_user: dict = Depends(get_current_user)):
-        if current_user['role'] != required_role:
+        if current_user['role'] not in roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not enough permissions"
@@ -160,33 +265,52 @@ def require_role(required_role: str):
         return current_user
     return role_checker
 
+def conditional_get(keys_for: Callable[[dict], List[VersionKey]], user_dependency: Callable = get_current_user):
+    """ETag check for polled endpoints, driven by the table version counters
+
+    A matching If-None-Match is answered with 304 after a single lookup in
+    table_versions. Versions are read before the handler runs, so a concurrent
+    write can only make the ETag older than the body, never newer. Pass the
+    endpoint's role check as ``user_dependency`` so it runs before the 304.
+    """
+    async def check(request: Request, response: Response, current_user: dict = Depends(user_dependency),
+                    db: RequestDatabase = Depends(get_request_db)):
+        keys = keys_for(current_user)
+        versions = await db.run(fetch_versions, keys)
+        etag = make_etag(request.url.path, request.url.query, current_user, keys, versions)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+    return check
+
 # Authentication endpoints
 @app.post("/auth/register", response_model=dict)
-async def register(user: UserCreate):
+async def register(user: UserCreate, db: RequestDatabase = Depends(get_request_db)):
     if user.role not in ['user', 'delivery']:
         raise HTTPException(status_code=400, detail="Invalid role. Only 'user' and 'delivery' roles are allowed for registration.")
     
-    with db_manager.get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Check if user already exists
-        cursor.execute("SELECT id FROM users WHERE username = ?", (user.username,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Username already registered")
-        
-        # Create new user
-        hashed_password = get_password_hash(user.password)
-        cursor.execute(
+    # Check if user already exists
+    if await get_user(user.username, db):
+        raise HTTPException(status_code=400, detail="Username already registered")
+    
+    # The existence check has already returned its pooled connection, so the slow hash holds none
+    hashed_password = await get_password_hash(user.password)
+    
+    # Create new user (the UNIQUE constraint catches a concurrent registration)
+    try:
+        await db.execute(
             "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
             (user.username, hashed_password, user.role)
         )
-        conn.commit()
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="Username already registered")
     
     return {"message": "User registered successfully"}
 
 @app.post("/auth/login", response_model=Token)
-async def login(user: UserLogin):
-    user_data = authenticate_user(user.username, user.password)
+async def login(user: UserLogin, db: RequestDatabase = Depends(get_request_db)):
+    user_data = await authenticate_user(user.username, user.password, db)
     if not user_data:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -195,394 +319,846 @@ async def login(user: UserLogin):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user_data['username'], "role": user_data['role']}, 
+        data={"sub": user_data['username'], "role": user_data['role']},
         expires_delta=access_token_expires
     )
     return {
-        "access_token": access_token, 
+        "access_token": access_token,
         "token_type": "bearer",
         "role": user_data['role']
     }
 
 # Protected booking endpoints
-@app.get('/bookings')
-async def list_bookings(current_user: dict = Depends(get_current_user)):
-    with db_manager.get_connection() as conn:
-        if current_user['role'] == 'user':
-            # Users can only see their own bookings - filter by user_id for consistency
-            rows = conn.execute('SELECT * FROM bookings WHERE user_id = ?', (current_user['id'],)).fetchall()
-        else:
-            # Admin and delivery can see all bookings
-            rows = conn.execute('SELECT * FROM bookings').fetchall()
-        return [dict(row) for row in rows]
+@app.get('/bookings', dependencies=[Depends(conditional_get(lambda user: [version_key('bookings', user)]))])
+async def list_bookings(filters: ListFilters = Depends(list_filters), page: PageParams = Depends(page_params),
+                        current_user: dict = Depends(get_current_user), db: RequestDatabase = Depends(get_request_db)):
+    clauses, params = booking_filter_clauses(filters)
+    if current_user['role'] == 'user':
+        # Users can only see their own bookings - filter by user_id for consistency
+        clauses.insert(0, 'b.user_id = ?')
+        params.insert(0, current_user['id'])
+    # Admin and delivery can see all bookings
+    keyset, keyset_params = keyset_clause(page, 'b.created_at', 'b.id')
+    order = 'ORDER BY b.created_at DESC, b.id DESC' if page.limit is not None else ''
+    rows = await db.fetch_all(
+        f'SELECT b.* FROM bookings b {where_sql(clauses + keyset)} {order} {limit_sql(page)}',
+        params + keyset_params
+    )
+    return paginate(rows, page)
+
+def _insert_booking(conn, booking: BookingCreate, current_user: dict):
+    table = yield_engine.table
+    # Offline gazetteer lookup (memoized); unresolvable addresses are stored without coordinates
+    lat, lon, geo_precision = address_resolver.resolve(conn, booking.pincode, booking.area, booking.state) or (None, None, None)
+    # Join the nearest open route if one is close enough (without usable coordinates, a route serving the same
+    # pincode); otherwise wait for the next schedule_routes
+    routable = lat is not None and geo_precision != UNROUTABLE_PRECISION
+    attached = attach_to_route(conn, lat, lon) if routable else attach_by_pincode(conn, booking.pincode)
+    route_id, drift = attached or (None, 0.0)
+    cur = conn.cursor()
+    cur.execute(
+        '''INSERT INTO bookings (user_id, customer_name, category, device_model, apartment_name, street_number, area, state, pincode, status, route_id, scheduled, yield_version, lat, lon, geo_precision)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (current_user['id'], current_user['username'], booking.category, booking.device_model, booking.apartment_name,
+         booking.street_number, booking.area, booking.state, booking.pincode, 'scheduled' if attached else 'pending',
+         route_id, 1 if attached else 0, table.version, lat, lon, geo_precision)
+    )
+    booking_id = cur.lastrowid
+    
+    # Estimated materials from the current yield table; derived mode stores none
+    # and computes totals from category counts instead
+    if yield_engine.mode == 'stored':
+        store_booking_materials(conn, table, [booking_id], [booking.category])
+    return {'id': booking_id, 'route_id': route_id, 'drift': drift}
 
 @app.post('/bookings')
-async def create_booking(booking: BookingCreate, current_user: dict = Depends(require_role('user'))):
-    with db_manager.get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            '''INSERT INTO bookings (user_id, customer_name, category, device_model, apartment_name, street_number, area, state, pincode, status, route_id, scheduled) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', NULL, 0)''',
-            (current_user['id'], current_user['username'], booking.category, booking.device_model, booking.apartment_name, 
-             booking.street_number, booking.area, booking.state, booking.pincode)
-        )
-        booking_id = cur.lastrowid
-        
-        # Generate estimated materials based on category (without weight dependency)
-        yield_map = {
-            'smartphone': {'copper': 0.05, 'lithium': 0.003, 'cobalt': 0.001, 'nickel': 0.01, 'rare_earth': 0.002},
-            'laptop': {'copper': 0.10, 'lithium': 0.005, 'cobalt': 0.003, 'nickel': 0.02, 'rare_earth': 0.003},
-            'battery': {'copper': 0.0, 'lithium': 0.20, 'cobalt': 0.05, 'nickel': 0.05, 'rare_earth': 0.01},
-            'other': {'copper': 0.07, 'lithium': 0.002, 'cobalt': 0.001, 'nickel': 0.003, 'rare_earth': 0.001}
-        }
-        
-        # Use average weight estimates for material calculation
-        avg_weights = {
-            'smartphone': 0.2,
-            'laptop': 2.0,
-            'battery': 1.0,
-            'other': 1.5
-        }
-        
-        category = booking.category
-        estimated_weight = avg_weights.get(category, 1.0)
-        yields = yield_map.get(category, {})
-        
-        for metal, frac in yields.items():
-            qty = round(estimated_weight * frac, 4)
-            cur.execute('INSERT INTO materials (booking_id, material, quantity) VALUES (?, ?, ?)', (booking_id, metal, qty))
-        
-        conn.commit()
-        return {'id': booking_id, 'message': 'Booking created'}
-
-@app.post('/schedule_routes')
-async def schedule_routes(k: int = Query(3, description='Number of clusters/routes'), current_user: dict = Depends(require_role('admin'))):
-    with db_manager.get_connection() as conn:
-        df = pd.read_sql_query('SELECT * FROM bookings WHERE scheduled = 0', conn)
-        if df.empty:
-            return {'message': 'No unscheduled bookings'}
-        
-        # Simple route assignment based on pincode for now
-        # In a real system, you'd use a geocoding service to convert addresses to coordinates
-        unique_pincodes = df['pincode'].unique()
-        n_clusters = int(min(len(unique_pincodes), k))
-        
-        # Assign routes based on pincode groups
-        pincode_to_route = {}
-        for i, pincode in enumerate(unique_pincodes):
-            pincode_to_route[pincode] = (i % n_clusters) + 1
-        
-        df['route_id'] = df['pincode'].map(pincode_to_route)
-        df['scheduled'] = 1
-        
-        # Batch update for better performance
-        update_data = [(int(row['route_id']), 'scheduled', int(row['id'])) for _, row in df.iterrows()]
-        conn.executemany('UPDATE bookings SET route_id = ?, scheduled = 1, status = ? WHERE id = ?', update_data)
-        
-        conn.commit()
-        summary = df.groupby('route_id').size().to_dict()
-        return {'routes': summary}
-
-@app.get('/routes')
-async def list_routes(current_user: dict = Depends(get_current_user)):
-    with db_manager.get_connection() as conn:
-        if current_user['role'] == 'delivery':
-            # Delivery guys see only their assigned routes
-            rows = conn.execute('''
-                SELECT b.route_id, COUNT(*) as num_stops, COUNT(*) as total_bookings 
-                FROM bookings b 
-                JOIN deliveries d ON b.id = d.booking_id 
-                WHERE d.delivery_guy_id = ? AND b.scheduled = 1 
-                GROUP BY b.route_id
-            ''', (current_user['id'],)).fetchall()
-        else:
-            # Admin sees all routes
-            rows = conn.execute('SELECT route_id, COUNT(*) as num_stops, COUNT(*) as total_bookings FROM bookings WHERE scheduled = 1 GROUP BY route_id').fetchall()
-        
-        result = []
-        for row in rows:
-            result.append({'route_id': row['route_id'], 'num_stops': row['num_stops'], 'total_bookings': row['total_bookings']})
-        return result
-
-@app.get('/dashboard')
-async def dashboard(current_user: dict = Depends(get_current_user)):
-    with db_manager.get_connection() as conn:
-        cur = conn.cursor()
-        
-        if current_user['role'] == 'user':
-            # User dashboard - only their bookings - filter by user_id for consistency
-            total_bookings = cur.execute('SELECT COUNT(*) FROM bookings WHERE user_id = ?', (current_user['id'],)).fetchone()[0]
-            metals_rows = cur.execute('''
-                SELECT m.material, SUM(m.quantity) as total_qty 
-                FROM materials m 
-                JOIN bookings b ON m.booking_id = b.id 
-                WHERE b.user_id = ? 
-                GROUP BY m.material
-            ''', (current_user['id'],)).fetchall()
-        else:
-            # Admin dashboard - all data
-            total_bookings = cur.execute('SELECT COUNT(*) FROM bookings').fetchone()[0]
-            metals_rows = cur.execute('SELECT material, SUM(quantity) as total_qty FROM materials GROUP BY material').fetchall()
-        
-        metals_dict = {}
-        for row in metals_rows:
-            metals_dict[row['material']] = row['total_qty']
-        
-        ev_battery_units = 0
-        if all(m in metals_dict for m in ['lithium','cobalt','nickel']):
-            ev_battery_units = int(min(metals_dict['lithium']/5, metals_dict['cobalt']/2, metals_dict['nickel']/3))
-        
-        solar_units = 0
-        if all(m in metals_dict for m in ['rare_earth','copper']):
-            solar_units = int(min(metals_dict['rare_earth']/0.5, metals_dict['copper']/1))
-        
-        return {
-            'total_bookings': total_bookings,
-            'metals': metals_dict,
-            'ev_battery_units': ev_battery_units,
-            'solar_panel_units': solar_units,
-            'user_role': current_user['role']
-        }
+async def create_booking(booking: BookingCreate, background_tasks: BackgroundTasks, current_user: dict = Depends(require_role('user')), db: RequestDatabase = Depends(get_request_db)):
+    created = await db.transaction(_insert_booking, booking, current_user)
+    booking_id = created['id']
+    event_broker.publish('booking.created',
+                         {'booking_id': booking_id, 'status': 'scheduled' if created['route_id'] else 'pending', 'route_id': created['route_id']},
+                         [current_user['id']])
+    if created['drift'] > REBALANCE_DRIFT:
+        background_tasks.add_task(_rebalance_routes)
+    elif created['route_id']:
+        background_tasks.add_task(_reoptimize_route, created['route_id'])
+    return {'id': booking_id, 'message': 'Booking created'}
+
+def _unscheduled_bookings(conn):
+    """Unscheduled bookings as (booking_id, user_id, lat, lon) rows to cluster and (booking_id, user_id, pincode)
+    rows without usable coordinates (none, or only a state centroid) to group by pincode, and the agent count
+    """
+    located = [tuple(row) for row in conn.execute('''
+        SELECT id, user_id, lat, lon FROM bookings
+        WHERE scheduled = 0 AND lat IS NOT NULL AND geo_precision IS NOT ?
+        ORDER BY id
+    ''', (UNROUTABLE_PRECISION,)).fetchall()]
+    unlocated = [tuple(row) for row in conn.execute('''
+        SELECT id, user_id, pincode FROM bookings
+        WHERE scheduled = 0 AND (lat IS NULL OR geo_precision IS ?)
+        ORDER BY id
+    ''', (UNROUTABLE_PRECISION,)).fetchall()]
+    agents = conn.execute("SELECT COUNT(*) FROM users WHERE role = 'delivery'").fetchone()[0]
+    return located, unlocated, agents
+
+def _plan_located(located: List[tuple], k: int, max_stops: Optional[int]):
+    _, _, lats, lons = zip(*located)
+    return plan_routes(lats, lons, k, max_stops)
+
+def _check_unscheduled(conn, booking_ids: List[int]):
+    unscheduled = 0
+    for start in range(0, len(booking_ids), 500):
+        chunk = booking_ids[start:start + 500]
+        unscheduled += conn.execute(f'''
+            SELECT COUNT(*) FROM bookings WHERE scheduled = 0 AND id IN ({','.join('?' * len(chunk))})
+        ''', chunk).fetchone()[0]
+    if unscheduled != len(booking_ids):
+        # Another run got there first; the job is retried against a fresh snapshot
+        raise RuntimeError("Unscheduled bookings changed while planning")
+
+def _next_route_id(conn) -> int:
+    # New routes are numbered after existing ones
+    return conn.execute('''
+        SELECT MAX(COALESCE((SELECT MAX(route_id) FROM bookings), 0), COALESCE((SELECT MAX(id) FROM routes), 0))
+    ''').fetchone()[0] + 1
+
+def _store_planned_routes(conn, located: List[tuple], plan, max_stops: Optional[int]):
+    """Create the routes of a plan made outside the writer, if its bookings are all still unscheduled"""
+    _check_unscheduled(conn, [row[0] for row in located])
+    return _create_routes(conn, located, plan, max_stops)
+
+def _store_pincode_routes(conn, unlocated: List[tuple], labels, max_stops: Optional[int]):
+    """Create routes (no centroid, stops in pincode order) for (booking_id, user_id, pincode) rows grouped by pincode"""
+    booking_ids, user_ids, _ = zip(*unlocated)
+    _check_unscheduled(conn, list(booking_ids))
+    first_route_id = _next_route_id(conn)
+    route_ids = (labels + first_route_id).tolist()
+    conn.executemany("UPDATE bookings SET route_id = ?, scheduled = 1, status = 'scheduled' WHERE id = ?",
+                     zip(route_ids, booking_ids))
+    summary = {}
+    for route_id in route_ids:
+        summary[route_id] = summary.get(route_id, 0) + 1
+    conn.executemany('INSERT INTO routes (id, stops, scheduled_stops, capacity) VALUES (?, ?, ?, ?)',
+                     [(route_id, stops, stops, max_stops) for route_id, stops in summary.items()])
+    for route_id in summary:
+        store_stop_order(conn, route_id)
+    return summary, {user_id for user_id in user_ids if user_id is not None}
+
+def _create_routes(conn, located: List[tuple], plan, max_stops: Optional[int]):
+    """Put clustered (booking_id, user_id, lat, lon) rows on new routes, one per plan cluster"""
+    booking_ids, user_ids, _, _ = zip(*located)
+    first_route_id = _next_route_id(conn)
+    route_ids = (plan.labels + first_route_id).tolist()
+    conn.executemany("UPDATE bookings SET route_id = ?, scheduled = 1, status = 'scheduled' WHERE id = ?",
+                     zip(route_ids, booking_ids))
+    summary, per_route = route_summary(list(range(first_route_id, first_route_id + plan.k)), plan)
+    conn.executemany('''
+        INSERT INTO routes (id, stops, scheduled_stops, capacity, centroid_lat, centroid_lon, radius_km)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(route_id, metrics['stops'], metrics['stops'], max_stops, metrics['centroid']['lat'], metrics['centroid']['lon'],
+           metrics['mean_radius_km']) for route_id, metrics in per_route.items()])
+    metrics = {**plan.metrics(), 'per_route': per_route}
+    return summary, metrics, list({user_id for user_id in user_ids if user_id is not None})
+
+def _rebalance_open_routes(conn):
+    """Recluster the bookings of routes nobody has started, keeping (at least) the route count and the largest capacity"""
+    route_ids = rebalance_candidates(conn)
+    if not route_ids:
+        return None
+    placeholders = ','.join('?' * len(route_ids))
+    located = [tuple(row) for row in conn.execute(f'''
+        SELECT id, user_id, lat, lon FROM bookings WHERE route_id IN ({placeholders}) AND lat IS NOT NULL ORDER BY id
+    ''', route_ids).fetchall()]
+    capacities = conn.execute(f'SELECT capacity FROM routes WHERE id IN ({placeholders})', route_ids).fetchall()
+    max_stops = None if any(row[0] is None for row in capacities) else max(row[0] for row in capacities)
+    conn.execute(f'DELETE FROM route_stops WHERE route_id IN ({placeholders})', route_ids)
+    conn.execute(f'DELETE FROM routes WHERE id IN ({placeholders})', route_ids)
+    if not located:
+        return None
+    summary, metrics, user_ids = _create_routes(conn, located, _plan_located(located, len(route_ids), max_stops), max_stops)
+    return route_ids, summary, user_ids
+
+_rebalance_running = False
+
+async def _rebalance_routes():
+    # Several bookings can cross the drift threshold at once; one rebalance covers them all
+    global _rebalance_running
+    if _rebalance_running:
+        return
+    _rebalance_running = True
+    try:
+        result = await db.transaction(_rebalance_open_routes)
+    finally:
+        _rebalance_running = False
+    if result is None:
+        return
+    old_route_ids, summary, user_ids = result
+    print(f"🔄 Rebalanced {len(old_route_ids)} open routes ({sum(summary.values())} bookings)")
+    event_broker.publish('routes.rebalanced', {'replaced': old_route_ids, 'routes': summary}, user_ids)
+    await _optimize_routes(list(summary))
+
+async def _optimize_route(route_id: int):
+    # Order stops on a read connection, then store the sequence in a short write
+    order = await db.run(plan_stop_order, route_id)
+    return await db.transaction(store_stop_order, route_id, order)
+
+async def _optimize_routes(route_ids: List[int]):
+    for route_id in route_ids:
+        await _optimize_route(route_id)
+    event_broker.publish('routes.optimized', {'route_ids': route_ids})
+
+# Only touched on the event loop, with no await between check and update
+_routes_optimizing = set()
+_routes_dirty = set()
+
+async def _reoptimize_route(route_id: int):
+    # Background re-order of a route that is not ordered yet. A request while a pass for the same route runs
+    # marks it dirty and the pass repeats, so stops that joined after it read the route are ordered too
+    if route_id in _routes_optimizing:
+        _routes_dirty.add(route_id)
+        return
+    _routes_optimizing.add(route_id)
+    try:
+        while True:
+            _routes_dirty.discard(route_id)
+            await _optimize_routes([route_id])
+            if route_id not in _routes_dirty:
+                break
+    finally:
+        _routes_optimizing.discard(route_id)
+
+async def _schedule_routes_job(ctx: JobContext, k: Optional[int] = None, max_stops: Optional[int] = None):
+    # Geocode in short writes, cluster on a worker thread, then create the routes in one write
+    after_id = 0
+    while True:
+        after_id, _ = await db.transaction(backfill_chunk, address_resolver, False, after_id)
+        if not after_id:
+            break
+        await ctx.progress(0.05, 'Geocoding bookings')
+    located, unlocated, agents = await db.run(_unscheduled_bookings)
+    if not located and not unlocated:
+        return {'message': 'No unscheduled bookings', 'routes': {}, 'unlocated': 0}
+    # One route per delivery agent unless k is given, shared between clustered and pincode-grouped bookings
+    k = k or agents or 1
+    k_located = max(1, round(k * len(located) / (len(located) + len(unlocated)))) if located else 0
+    summary, metrics, user_ids = {}, None, set()
+    if unlocated:
+        # No usable coordinates (e.g. no gazetteer imported): group by pincode, stops already in order
+        labels = plan_pincode_routes([row[2] for row in unlocated], max(1, k - k_located), max_stops)
+        pincode_summary, pincode_users = await db.transaction(_store_pincode_routes, unlocated, labels, max_stops)
+        summary.update(pincode_summary)
+        user_ids.update(pincode_users)
+    clustered = {}
+    if located:
+        await ctx.progress(0.1, f'Clustering {len(located)} bookings', force=True)
+        plan = await asyncio.to_thread(_plan_located, located, k_located, max_stops)
+        ctx.check_cancelled()
+        clustered, metrics, located_users = await db.transaction(_store_planned_routes, located, plan, max_stops)
+        summary.update(clustered)
+        user_ids.update(located_users)
+    event_broker.publish('routes.scheduled', {'routes': summary}, list(user_ids))
+
+    # Stop sequences last; until a route is done /routes/{id}/stops lists its stops unordered
+    route_ids = list(clustered)
+    for i, route_id in enumerate(route_ids):
+        await ctx.progress(0.5 + 0.5 * i / len(route_ids), f'Ordering stops ({i}/{len(route_ids)} routes)')
+        await _optimize_route(route_id)
+    event_broker.publish('routes.optimized', {'route_ids': route_ids})
+    return {'routes': summary, 'metrics': metrics, 'unlocated': len(unlocated),
+            'pincode_routes': sorted(set(summary) - set(clustered))}
+
+@app.post('/schedule_routes', status_code=202)
+async def schedule_routes(k: Optional[int] = Query(None, ge=1, description='Number of routes (default: one per delivery agent)'),
+                          max_stops: Optional[int] = Query(None, ge=1, description='Maximum stops per route (raises k if needed)'),
+                          current_user: dict = Depends(require_role('admin'))):
+    return await job_manager.submit('schedule_routes', {'k': k, 'max_stops': max_stops}, current_user['id'])
+
+def _routes_version_keys(user: dict) -> List[VersionKey]:
+    if user['role'] == 'delivery':
+        return [version_key('deliveries', user), ('routes', GLOBAL_VERSION)]
+    return [('bookings', GLOBAL_VERSION), ('routes', GLOBAL_VERSION)]
+
+@app.get('/routes', dependencies=[Depends(conditional_get(_routes_version_keys))])
+async def list_routes(current_user: dict = Depends(get_current_user), db: RequestDatabase = Depends(get_request_db)):
+    if current_user['role'] == 'delivery':
+        # Delivery guys see only their assigned routes
+        rows = await db.fetch_all('''
+            SELECT b.route_id, COUNT(*) as num_stops, COUNT(*) as total_bookings, r.distance_km
+            FROM bookings b
+            JOIN deliveries d ON d.id = b.current_delivery_id
+            LEFT JOIN routes r ON r.id = b.route_id
+            WHERE d.delivery_guy_id = ? AND b.scheduled = 1
+            GROUP BY b.route_id
+        ''', (current_user['id'],))
+    else:
+        # Admin sees all routes
+        rows = await db.fetch_all('''
+            SELECT b.route_id, COUNT(*) as num_stops, COUNT(*) as total_bookings, r.distance_km
+            FROM bookings b
+            LEFT JOIN routes r ON r.id = b.route_id
+            WHERE b.scheduled = 1
+            GROUP BY b.route_id
+        ''')
+    
+    result = []
+    for row in rows:
+        result.append({'route_id': row['route_id'], 'num_stops': row['num_stops'], 'total_bookings': row['total_bookings'],
+                       'distance_km': row['distance_km']})
+    return result
+
+@app.get('/routes/{route_id}/stops', dependencies=[Depends(conditional_get(_routes_version_keys, require_role('admin', 'delivery')))])
+async def list_route_stops(route_id: int, background_tasks: BackgroundTasks,
+                           current_user: dict = Depends(require_role('admin', 'delivery')),
+                           db: RequestDatabase = Depends(get_request_db)):
+    route = await db.fetch_one('SELECT id as route_id, stops as num_stops, distance_km, centroid_lat, centroid_lon, optimized_at FROM routes WHERE id = ?', (route_id,))
+    if not route:
+        raise HTTPException(status_code=404, detail="Route not found")
+    if route['optimized_at'] is None:
+        # Not ordered yet (just scheduled, or a booking joined): the background pass orders it, reads never write
+        background_tasks.add_task(_reoptimize_route, route_id)
+
+    # Delivery guys get the stops assigned to them; in route order once ordered, stops without a sequence last
+    assignee_clause, params = '', [route_id]
+    if current_user['role'] == 'delivery':
+        assignee_clause, params = 'AND d.delivery_guy_id = ?', [route_id, current_user['id']]
+    stops = await db.fetch_all(f'''
+        SELECT rs.sequence, rs.leg_km, b.id as booking_id, b.customer_name, b.category, b.apartment_name,
+               b.street_number, b.area, b.state, b.pincode, b.lat, b.lon, b.status
+        FROM bookings b
+        LEFT JOIN route_stops rs ON rs.booking_id = b.id AND rs.route_id = b.route_id
+        LEFT JOIN deliveries d ON d.id = b.current_delivery_id
+        WHERE b.route_id = ? {assignee_clause}
+        ORDER BY rs.sequence IS NULL, rs.sequence, b.id
+    ''', params)
+    if current_user['role'] == 'delivery' and not stops:
+        raise HTTPException(status_code=404, detail="Route not found")
+    return {**route, 'stops': stops}
+
+@app.get('/dashboard', dependencies=[Depends(conditional_get(
+    lambda user: [version_key('bookings', user), version_key('materials', user), ('yields', GLOBAL_VERSION)]))])
+async def dashboard(current_user: dict = Depends(get_current_user), db: RequestDatabase = Depends(get_request_db)):
+    # Constant-time read from the trigger-maintained rollups (see rollups.py)
+    rollup_user = current_user['id'] if current_user['role'] == 'user' else GLOBAL_ROLLUP
+    if yield_engine.mode == 'derived':
+        total_bookings, counts = await db.run(category_counts, rollup_user)
+        metals_dict = yield_engine.table.totals(counts)
+    else:
+        total_bookings, metals_dict = await db.run(dashboard_totals, rollup_user)
+    
+    ev_battery_units, solar_units = recovery_equivalents(metals_dict)
+    
+    return {
+        'total_bookings': total_bookings,
+        'metals': metals_dict,
+        'ev_battery_units': int(ev_battery_units),
+        'solar_panel_units': int(solar_units),
+        'user_role': current_user['role']
+    }
+
+# Analytics endpoints
+@app.get('/analytics/timeseries', dependencies=[Depends(conditional_get(
+    lambda user: [('bookings', GLOBAL_VERSION), ('yields', GLOBAL_VERSION)], require_role('admin')))])
+async def analytics_timeseries(interval: str = Query('day', description="hour, day, week or month"),
+                               start: Optional[date] = Query(None, description="First day (default: 30 days before end)"),
+                               end: Optional[date] = Query(None, description="Last day, inclusive (default: today, UTC)"),
+                               group_by: str = Query('none', description="none, state, pincode or category"),
+                               state: Optional[str] = Query(None), pincode: Optional[str] = Query(None),
+                               category: Optional[str] = Query(None),
+                               current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(INTERVALS)}")
+    if group_by not in GROUP_BYS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(GROUP_BYS)}")
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=30)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if interval == 'hour' and (end - start).days >= MAX_HOURLY_DAYS:
+        raise HTTPException(status_code=400, detail=f"Hourly series are limited to {MAX_HOURLY_DAYS} days")
+    series = await db.run(timeseries, yield_engine.table, interval, start, end, group_by, state, pincode, category)
+    return {'interval': interval, 'start': start, 'end': end, 'group_by': group_by, 'series': series}
 
 # Admin endpoints
-@app.get('/admin/pickups')
-async def get_pending_pickups(current_user: dict = Depends(require_role('admin'))):
-    conn = get_conn()
-    # Get the most recent delivery assignment for each booking
-    # Sort unassigned bookings first, then by creation date
-    rows = conn.execute('''
-        SELECT b.*, d.status as delivery_status, u.username as delivery_guy 
-        FROM bookings b 
-        LEFT JOIN deliveries d ON b.id = d.booking_id 
-        LEFT JOIN users u ON d.delivery_guy_id = u.id 
-        WHERE d.id = (
-            SELECT MAX(d2.id) 
-            FROM deliveries d2 
-            WHERE d2.booking_id = b.id
-        ) OR d.id IS NULL
-        ORDER BY 
-            CASE WHEN u.username IS NULL THEN 0 ELSE 1 END,
-            b.created_at DESC
-    ''').fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+@app.get('/admin/pickups', dependencies=[Depends(conditional_get(
+    lambda user: [('bookings', GLOBAL_VERSION), ('deliveries', GLOBAL_VERSION)], require_role('admin')))])
+async def get_pending_pickups(filters: ListFilters = Depends(list_filters), page: PageParams = Depends(page_params),
+                              assigned: Optional[bool] = Query(None, description="Only assigned (true) or unassigned (false) bookings"),
+                              current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    clauses, params = booking_filter_clauses(filters)
+    if assigned is not None:
+        clauses.append('b.current_delivery_id IS NOT NULL' if assigned else 'b.current_delivery_id IS NULL')
+    keyset, keyset_params = keyset_clause(page, 'b.created_at', 'b.id')
+    if page.limit is not None:
+        # Pages walk a stable (created_at, id) order; use ?assigned=false for the unassigned queue
+        order = 'ORDER BY b.created_at DESC, b.id DESC'
+    else:
+        # Sort unassigned bookings first, then by creation date
+        order = 'ORDER BY CASE WHEN u.username IS NULL THEN 0 ELSE 1 END, b.created_at DESC'
+    # Join each booking to its current delivery assignment
+    rows = await db.fetch_all(f'''
+        SELECT b.*, d.status as delivery_status, u.username as delivery_guy
+        FROM bookings b
+        LEFT JOIN deliveries d ON d.id = b.current_delivery_id
+        LEFT JOIN users u ON d.delivery_guy_id = u.id
+        {where_sql(clauses + keyset)}
+        {order}
+        {limit_sql(page)}
+    ''', params + keyset_params)
+    return paginate(rows, page)
 
-@app.post('/admin/assign-delivery')
-async def assign_delivery(assignment: DeliveryAssignment, current_user: dict = Depends(require_role('admin'))):
-    conn = get_conn()
+def _record_status_change(cur, booking_id: int, old_status: Optional[str], new_status: str, updated_by: str):
+    cur.execute('''
+        INSERT INTO order_status_history (booking_id, old_status, new_status, updated_by)
+        VALUES (?, ?, ?, ?)
+    ''', (booking_id, old_status, new_status, updated_by))
+
+def _assign_delivery(conn, assignment: DeliveryAssignment, admin_username: str):
     cur = conn.cursor()
     
     # Check if booking exists
     booking = cur.execute('SELECT * FROM bookings WHERE id = ?', (assignment.booking_id,)).fetchone()
     if not booking:
-        conn.close()
         raise HTTPException(status_code=404, detail="Booking not found")
     
     # Check if delivery guy exists
     delivery_guy = cur.execute('SELECT * FROM users WHERE id = ? AND role = "delivery"', (assignment.delivery_guy_id,)).fetchone()
     if not delivery_guy:
-        conn.close()
         raise HTTPException(status_code=404, detail="Delivery guy not found")
     
-    # Assign delivery
+    previous = cur.execute('SELECT delivery_guy_id FROM deliveries WHERE id = ?', (booking['current_delivery_id'],)).fetchone()
+    
+    # Assign delivery (trg_deliveries_set_current points the booking at the new row;
+    # earlier rows stay as the assignment history)
     cur.execute('''
-        INSERT OR REPLACE INTO deliveries (booking_id, delivery_guy_id, status) 
+        INSERT INTO deliveries (booking_id, delivery_guy_id, status)
         VALUES (?, ?, 'assigned')
     ''', (assignment.booking_id, assignment.delivery_guy_id))
     
     # Update booking status to 'assigned' and mark as scheduled
     cur.execute('''
-        UPDATE bookings 
-        SET status = 'assigned', scheduled = 1 
+        UPDATE bookings
+        SET status = 'assigned', scheduled = 1
         WHERE id = ?
     ''', (assignment.booking_id,))
-    
-    conn.commit()
-    conn.close()
-    
+    _record_status_change(cur, assignment.booking_id, booking['status'], 'assigned', admin_username)
+    return {'user_id': booking['user_id'], 'previous_delivery_guy_id': previous['delivery_guy_id'] if previous else None}
+
+@app.post('/admin/assign-delivery')
+async def assign_delivery(assignment: DeliveryAssignment, current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    change = await db.transaction(_assign_delivery, assignment, current_user['username'])
+    # The previous delivery guy hears about it too, so the booking leaves their list
+    event_broker.publish('delivery.assigned',
+                         {'booking_id': assignment.booking_id, 'delivery_guy_id': assignment.delivery_guy_id, 'status': 'assigned'},
+                         [change['user_id'], assignment.delivery_guy_id, change['previous_delivery_guy_id']])
     return {"message": "Delivery assigned successfully", "booking_id": assignment.booking_id, "delivery_guy_id": assignment.delivery_guy_id}
 
-@app.get('/delivery/assignments')
-async def get_delivery_assignments(current_user: dict = Depends(require_role('delivery'))):
-    conn = get_conn()
-    # Get the most recent delivery status for each booking to avoid duplicates
-    rows = conn.execute('''
+def _auto_assign(conn, admin_username: str):
+    plan = plan_dispatch(conn)
+    assigned = apply_dispatch(conn, plan, admin_username)
+    booking_ids = [booking_id for ids in assigned.values() for booking_id in ids]
+    owners = set()
+    for start in range(0, len(booking_ids), 500):
+        chunk = booking_ids[start:start + 500]
+        owners.update(row[0] for row in conn.execute(
+            f"SELECT DISTINCT user_id FROM bookings WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+    return plan, assigned, owners
+
+@app.post('/admin/auto-assign')
+async def auto_assign(dry_run: bool = Query(False, description='Return the plan without assigning anything'),
+                      current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    if dry_run:
+        plan = await db.run(plan_dispatch)
+        return {'dry_run': True, **plan}
+    # Planned and applied in one writer transaction, so the plan cannot go stale before it commits
+    plan, assigned, owners = await db.transaction(_auto_assign, current_user['username'])
+    if plan['assignments']:
+        event_broker.publish('routes.dispatched',
+                             {'routes': {a['route_id']: a['delivery_guy_id'] for a in plan['assignments']}},
+                             owners | set(assigned))
+    return {'dry_run': False, **plan, 'bookings_assigned': sum(len(ids) for ids in assigned.values())}
+
+@app.get('/delivery/assignments', dependencies=[Depends(conditional_get(
+    lambda user: [version_key('deliveries', user)], require_role('delivery')))])
+async def get_delivery_assignments(filters: ListFilters = Depends(list_filters), page: PageParams = Depends(page_params),
+                                   current_user: dict = Depends(require_role('delivery')), db: RequestDatabase = Depends(get_request_db)):
+    clauses, params = booking_filter_clauses(filters)
+    keyset, keyset_params = keyset_clause(page, 'b.created_at', 'b.id')
+    order = 'ORDER BY b.created_at DESC, b.id DESC' if page.limit is not None else 'ORDER BY d.assigned_at DESC'
+    # Bookings whose current assignment belongs to this delivery guy
+    rows = await db.fetch_all(f'''
         SELECT b.*, d.status as delivery_status, d.assigned_at, d.completed_at
-        FROM bookings b 
-        JOIN deliveries d ON b.id = d.booking_id 
-        WHERE d.delivery_guy_id = ? 
-        AND d.id = (
-            SELECT MAX(d2.id) 
-            FROM deliveries d2 
-            WHERE d2.booking_id = b.id AND d2.delivery_guy_id = ?
-        )
-        ORDER BY d.assigned_at DESC
-    ''', (current_user['id'], current_user['id'])).fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+        FROM deliveries d
+        JOIN bookings b ON b.current_delivery_id = d.id
+        {where_sql(['d.delivery_guy_id = ?'] + clauses + keyset)}
+        {order}
+        {limit_sql(page)}
+    ''', [current_user['id']] + params + keyset_params)
+    return paginate(rows, page)
 
-@app.post('/delivery/update-status')
-async def update_delivery_status(booking_id: int, status: str, current_user: dict = Depends(require_role('delivery'))):
-    if status not in ['assigned', 'picked_up', 'delivered']:
-        raise HTTPException(status_code=400, detail="Invalid status")
-    
-    conn = get_conn()
+def _update_delivery_status(conn, booking_id: int, status: str, delivery_guy: dict):
     cur = conn.cursor()
     
-    # Check if delivery is assigned to this user
+    # Check if the booking's current assignment belongs to this user
     delivery = cur.execute('''
-        SELECT * FROM deliveries 
-        WHERE booking_id = ? AND delivery_guy_id = ?
-    ''', (booking_id, current_user['id'])).fetchone()
+        SELECT d.id, b.status as booking_status, b.user_id
+        FROM bookings b
+        JOIN deliveries d ON d.id = b.current_delivery_id
+        WHERE b.id = ? AND d.delivery_guy_id = ?
+    ''', (booking_id, delivery_guy['id'])).fetchone()
     
     if not delivery:
-        conn.close()
         raise HTTPException(status_code=404, detail="Delivery assignment not found")
     
     # Update delivery status
     cur.execute('''
-        UPDATE deliveries 
-        SET status = ?, completed_at = ? 
-        WHERE booking_id = ? AND delivery_guy_id = ?
-    ''', (status, datetime.utcnow() if status == 'delivered' else None, booking_id, current_user['id']))
+        UPDATE deliveries
+        SET status = ?, completed_at = ?
+        WHERE id = ?
+    ''', (status, datetime.utcnow() if status == 'delivered' else None, delivery['id']))
     
     # Update booking status to match delivery status
     cur.execute('''
-        UPDATE bookings 
-        SET status = ? 
+        UPDATE bookings
+        SET status = ?
         WHERE id = ?
     ''', (status, booking_id))
+    _record_status_change(cur, booking_id, delivery['booking_status'], status, delivery_guy['username'])
     
-    # Award points when delivery is completed
-    if status == 'delivered':
-        # Get the user_id for this booking
-        booking = cur.execute('SELECT user_id FROM bookings WHERE id = ?', (booking_id,)).fetchone()
-        if booking and booking['user_id']:
-            user_id = booking['user_id']
-            points_awarded = 20  # Fixed 20 points per completed transaction
-            
-            # Check if points were already awarded for this booking to prevent duplicates
-            existing_points = cur.execute('''
-                SELECT id FROM points_history 
-                WHERE user_id = ? AND transaction_id = ?
-            ''', (user_id, booking_id)).fetchone()
-            
-            if not existing_points:
-                # Update or create user points balance
-                cur.execute('''
-                    INSERT OR IGNORE INTO user_points (user_id, points_balance) 
-                    VALUES (?, 0)
-                ''', (user_id,))
-                
-                cur.execute('''
-                    UPDATE user_points 
-                    SET points_balance = points_balance + ?, updated_at = ?
-                    WHERE user_id = ?
-                ''', (points_awarded, datetime.utcnow(), user_id))
-                
-                # Add to points history
-                cur.execute('''
-                    INSERT INTO points_history (user_id, transaction_id, points_awarded)
-                    VALUES (?, ?, ?)
-                ''', (user_id, booking_id, points_awarded))
-    
-    conn.commit()
-    conn.close()
+    # Award points when delivery is completed (at most once per booking)
+    points = award_delivery_points(conn, [(booking_id, delivery['user_id'])]) if status == 'delivered' else {}
+    return {'user_id': delivery['user_id'], 'points_awarded': points.get(booking_id, 0)}
+
+@app.post('/delivery/update-status')
+async def update_delivery_status(booking_id: int, status: str, current_user: dict = Depends(require_role('delivery')), db: RequestDatabase = Depends(get_request_db)):
+    if status not in DELIVERY_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status")
     
+    change = await db.transaction(_update_delivery_status, booking_id, status, current_user)
+    audience = [change['user_id'], current_user['id']]
+    event_broker.publish('delivery.status', {'booking_id': booking_id, 'status': status}, audience)
+    if change['points_awarded']:
+        event_broker.publish('points.awarded', {'booking_id': booking_id, 'points': change['points_awarded']}, [change['user_id']])
     return {"message": f"Status updated to {status}"}
 
+@app.post('/delivery/sync')
+async def sync_delivery_statuses(sync: DeliveryStatusSync, current_user: dict = Depends(require_role('delivery')),
+                                 db: RequestDatabase = Depends(get_request_db)):
+    """Apply a queue of status updates recorded offline, in order, in one transaction
+
+    Safe to retry: every update carries an idempotency key and replays get the
+    stored outcome back as 'duplicate' instead of being applied twice.
+    """
+    if len(sync.updates) > SYNC_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_MAX_ITEMS} updates per sync")
+    if not sync.updates:
+        return {'results': []}
+    updates = [update.model_dump() for update in sync.updates]
+    results, owners = await db.transaction(sync_statuses, current_user, updates)
+    for result in results:
+        if result['result'] != 'applied' or result['booking_id'] not in owners:
+            continue
+        user_id = owners[result['booking_id']]
+        event_broker.publish('delivery.status', {'booking_id': result['booking_id'], 'status': result['status']},
+                             [user_id, current_user['id']])
+        if result['points_awarded']:
+            event_broker.publish('points.awarded', {'booking_id': result['booking_id'], 'points': result['points_awarded']},
+                                 [user_id])
+    return {'results': results}
+
 @app.get('/admin/delivery-guys')
-async def get_delivery_guys(current_user: dict = Depends(require_role('admin'))):
-    conn = get_conn()
-    rows = conn.execute('SELECT id, username, created_at FROM users WHERE role = "delivery"').fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+async def get_delivery_guys(current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    return await db.fetch_all('SELECT id, username, created_at FROM users WHERE role = "delivery"')
+
+@app.get('/admin/export/{dataset}')
+async def export_dataset(dataset: str, format: str = Query('ndjson', description="ndjson or csv"),
+                         filters: ListFilters = Depends(list_filters), current_user: dict = Depends(require_role('admin'))):
+    if dataset not in EXPORT_QUERIES:
+        raise HTTPException(status_code=404, detail=f"Unknown export '{dataset}'")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    # Streams on its own pooled connection, not the request-scoped one
+    chunks = await db.submit(lambda: open_export(db_manager, dataset, format, filters))
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _export_job_path(job_id: int, dataset: str, format: str) -> str:
+    return os.path.join(EXPORT_DIR, f"job_{job_id}_{dataset}.{format}")
+
+async def _export_job(ctx: JobContext, dataset: str, format: str, filters: dict):
+    path = _export_job_path(ctx.id, dataset, format)
+
+    def write() -> int:
+        # Same chunked cursor as the streaming export, written to a file on a worker thread
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        size = 0
+        try:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in open_export(db_manager, dataset, format, ListFilters(**filters)):
+                    ctx.check_cancelled()
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return size
+
+    size = await asyncio.to_thread(write)
+    return {'dataset': dataset, 'format': format, 'bytes': size}
+
+@app.post('/admin/export/{dataset}', status_code=202)
+async def queue_export(dataset: str, format: str = Query('ndjson', description="ndjson or csv"),
+                       filters: ListFilters = Depends(list_filters), current_user: dict = Depends(require_role('admin'))):
+    # Same export as GET, written to a file by a job; fetch it from /jobs/{id}/download
+    if dataset not in EXPORT_QUERIES:
+        raise HTTPException(status_code=404, detail=f"Unknown export '{dataset}'")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    return await job_manager.submit('export', {'dataset': dataset, 'format': format,
+                                               'filters': filters.model_dump(mode='json')}, current_user['id'])
+
+def _yield_table_response(table, stale_bookings: int):
+    return {
+        'version': table.version,
+        'mode': yield_engine.mode,
+        'categories': {
+            category: {'yields_kg': dict(zip(table.materials, table.matrix[i].round(4).tolist()))}
+            for i, category in enumerate(table.categories)
+        },
+        'stale_bookings': stale_bookings
+    }
+
+@app.get('/admin/yields')
+async def get_yields(current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    table = yield_engine.table
+    stale = await db.run(stale_booking_count, table.version) if yield_engine.mode == 'stored' else 0
+    return _yield_table_response(table, stale)
+
+async def _recompute_materials_job(ctx: JobContext):
+    # One short writer transaction per chunk, so bookings keep flowing during a recompute
+    table = yield_engine.table
+    stale = await db.run(stale_booking_count, table.version)
+    total = 0
+    while True:
+        updated = await db.transaction(recompute_chunk, table)
+        if not updated:
+            break
+        total += updated
+        await ctx.progress(total / max(stale, total), f'{total} bookings recomputed')
+    print(f"✅ Recomputed materials for {total} bookings (yield version {table.version})")
+    event_broker.publish('materials.recomputed', {'yield_version': table.version, 'bookings': total})
+    return {'yield_version': table.version, 'bookings': total}
+
+@app.post('/admin/yields')
+async def publish_yields(update: YieldTableUpdate, current_user: dict = Depends(require_role('admin')),
+                         db: RequestDatabase = Depends(get_request_db)):
+    for category, entry in update.categories.items():
+        if entry.avg_weight <= 0 or any(not 0 <= fraction <= 1 for fraction in entry.yields.values()):
+            raise HTTPException(status_code=400, detail=f"Invalid yields for '{category}': weight must be positive and fractions within 0-1")
+    weights = {category: entry.avg_weight for category, entry in update.categories.items()}
+    yields = {category: entry.yields for category, entry in update.categories.items()}
+    await db.transaction(publish_yield_version, weights, yields)
+    table = await db.run(yield_engine.load)
+    stale, job = 0, None
+    if yield_engine.mode == 'stored':
+        stale = await db.run(stale_booking_count, table.version)
+        job = await job_manager.submit('recompute_materials', {}, current_user['id'])
+    return {**_yield_table_response(table, stale), 'recompute_job_id': job['id'] if job else None}
+
+async def _geocode_backfill_job(ctx: JobContext, refine: bool = False):
+    last_id = await db.fetch_value('SELECT MAX(id) FROM bookings') or 0
+    after_id, total = 0, 0
+    while True:
+        after_id, updated = await db.transaction(backfill_chunk, address_resolver, refine, after_id)
+        if not after_id:
+            break
+        total += updated
+        await ctx.progress(after_id / last_id if last_id else 1.0, f'{total} bookings geocoded')
+    return {'geocoded': total}
+
+@app.post('/admin/geocode-backfill', status_code=202)
+async def queue_geocode_backfill(refine: bool = Query(False, description="Also re-resolve district/state-level matches"),
+                                 current_user: dict = Depends(require_role('admin'))):
+    return await job_manager.submit('geocode_backfill', {'refine': refine}, current_user['id'])
+
+@app.get('/admin/image-reviews')
+async def list_image_reviews(status: str = Query('pending', description="Review status"), page: PageParams = Depends(page_params),
+                             current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    if status not in REVIEW_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(REVIEW_STATUSES)}")
+    cursor_clauses, cursor_params = keyset_clause(page, 'i.created_at', 'i.id')
+    rows = await db.fetch_all(f'''
+        SELECT {IMAGE_HASH_COLUMNS} FROM image_hashes i
+        LEFT JOIN users u ON u.id = i.user_id
+        LEFT JOIN image_hashes m ON m.id = i.match_id
+        {where_sql(['i.review_status = ?'] + cursor_clauses)}
+        ORDER BY i.created_at DESC, i.id DESC
+        {limit_sql(page)}
+    ''', [status] + cursor_params)
+    return paginate(rows, page)
+
+@app.post('/admin/image-reviews/{image_id}')
+async def resolve_review(image_id: int, decision: ImageReviewDecision, current_user: dict = Depends(require_role('admin'))):
+    if decision.status not in ('cleared', 'rejected'):
+        raise HTTPException(status_code=400, detail="status must be cleared or rejected")
+    if not await db.transaction(resolve_image_review, image_id, decision.status, current_user['id']):
+        raise HTTPException(status_code=404, detail="Flagged image not found")
+    return await db.run(get_image_review, image_id)
+
+job_manager.register('schedule_routes', _schedule_routes_job)
+job_manager.register('recompute_materials', _recompute_materials_job)
+job_manager.register('geocode_backfill', _geocode_backfill_job)
+job_manager.register('export', _export_job)
+
+@app.get('/jobs')
+async def list_jobs(status: Optional[str] = Query(None, description="Job status"), kind: Optional[str] = Query(None, description="Job kind"),
+                    page: PageParams = Depends(page_params), current_user: dict = Depends(require_role('admin')),
+                    db: RequestDatabase = Depends(get_request_db)):
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(JOB_STATUSES)}")
+    clauses, params = [], []
+    for column, value in (('status', status), ('kind', kind)):
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    cursor_clauses, cursor_params = keyset_clause(page, 'created_at', 'id')
+    rows = await db.fetch_all(f'''
+        SELECT {JOB_COLUMNS} FROM jobs
+        {where_sql(clauses + cursor_clauses)}
+        ORDER BY created_at DESC, id DESC
+        {limit_sql(page)}
+    ''', params + cursor_params)
+    return paginate([job_response(row) for row in rows], page)
+
+async def _get_job_or_404(job_id: int, db: RequestDatabase) -> dict:
+    job = await db.run(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get('/jobs/{job_id}')
+async def get_job_status(job_id: int, current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    return await _get_job_or_404(job_id, db)
+
+@app.post('/jobs/{job_id}/cancel')
+async def cancel_job(job_id: int, current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    job = await _get_job_or_404(job_id, db)
+    if job['status'] not in ('queued', 'running'):
+        raise HTTPException(status_code=409, detail=f"Job is already {job['status']}")
+    return await job_manager.cancel(job_id)
+
+@app.post('/jobs/{job_id}/retry')
+async def retry_job(job_id: int, current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    job = await _get_job_or_404(job_id, db)
+    if job['status'] not in ('failed', 'cancelled'):
+        raise HTTPException(status_code=409, detail="Only failed or cancelled jobs can be retried")
+    return await job_manager.retry(job_id)
+
+@app.get('/jobs/{job_id}/download')
+async def download_job_result(job_id: int, current_user: dict = Depends(require_role('admin')), db: RequestDatabase = Depends(get_request_db)):
+    job = await _get_job_or_404(job_id, db)
+    if job['kind'] != 'export' or job['status'] != 'succeeded':
+        raise HTTPException(status_code=409, detail="Only finished export jobs have a download")
+    dataset, format = job['params']['dataset'], job['params']['format']
+    path = _export_job_path(job_id, dataset, format)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Export file is no longer available")
+    return FileResponse(path, media_type=EXPORT_FORMATS[format], filename=f"{dataset}_job_{job_id}.{format}")
+
+@app.get('/admin/system-stats')
+async def get_system_stats(current_user: dict = Depends(require_role('admin'))):
+    return {
+        "db_pool": db_manager.get_stats(),
+        "principal_cache": principal_cache.get_stats(),
+        "password_hasher": password_hasher.get_stats(),
+        "db_writer": db_writer.get_stats(),
+        "events": event_broker.get_stats(),
+        "yields": yield_engine.get_stats(),
+        "geocoder": address_resolver.get_stats(),
+        "jobs": job_manager.get_stats(),
+        "classification_cache": classification_cache.get_stats(),
+        "image_index": image_index.get_stats()
+    }
 
 # Points system endpoints
-@app.get('/points/balance')
-async def get_points_balance(current_user: dict = Depends(require_role('user'))):
-    conn = get_conn()
-    cur = conn.cursor()
-    
+@app.get('/points/balance', dependencies=[Depends(conditional_get(
+    lambda user: [version_key('points', user)], require_role('user')))])
+async def get_points_balance(current_user: dict = Depends(require_role('user')), db: RequestDatabase = Depends(get_request_db)):
     # Get user's points balance
-    points_row = cur.execute('''
+    points_row = await db.fetch_one('''
         SELECT points_balance FROM user_points WHERE user_id = ?
-    ''', (current_user['id'],)).fetchone()
+    ''', (current_user['id'],))
     
     if not points_row:
-        # Initialize points balance if it doesn't exist
-        cur.execute('''
-            INSERT INTO user_points (user_id, points_balance) 
-            VALUES (?, 0)
-        ''', (current_user['id'],))
-        points_balance = 0
-    else:
-        points_balance = points_row['points_balance']
-    
-    conn.commit()
-    conn.close()
+        # The row is created on the first award; writing it here would bump the points version and stale the ETag
+        return {"points_balance": 0}
     
-    return {"points_balance": points_balance}
+    return {"points_balance": points_row['points_balance']}
 
-@app.get('/points/history')
-async def get_points_history(current_user: dict = Depends(require_role('user'))):
-    conn = get_conn()
-    rows = conn.execute('''
+@app.get('/points/history', dependencies=[Depends(conditional_get(
+    lambda user: [version_key('points', user)], require_role('user')))])
+async def get_points_history(created_from: Optional[date] = Query(None, description="On or after this date"),
+                             created_to: Optional[date] = Query(None, description="On or before this date"),
+                             page: PageParams = Depends(page_params),
+                             current_user: dict = Depends(require_role('user')), db: RequestDatabase = Depends(get_request_db)):
+    clauses, params = date_range_clauses('ph.timestamp', created_from, created_to)
+    keyset, keyset_params = keyset_clause(page, 'ph.timestamp', 'ph.id')
+    order = 'ORDER BY ph.timestamp DESC, ph.id DESC' if page.limit is not None else 'ORDER BY ph.timestamp DESC'
+    rows = await db.fetch_all(f'''
         SELECT ph.*, b.category, b.created_at as booking_date
         FROM points_history ph
         LEFT JOIN bookings b ON ph.transaction_id = b.id
-        WHERE ph.user_id = ?
-        ORDER BY ph.timestamp DESC
-    ''', (current_user['id'],)).fetchall()
-    conn.close()
-    
-    return [dict(row) for row in rows]
+        {where_sql(['ph.user_id = ?'] + clauses + keyset)}
+        {order}
+        {limit_sql(page)}
+    ''', [current_user['id']] + params + keyset_params)
+    return paginate(rows, page, time_key='timestamp')
 
-@app.post('/points/redeem')
-async def redeem_points(redeem_data: PointsRedeem, current_user: dict = Depends(require_role('user'))):
-    if redeem_data.points_to_redeem < 60:
-        raise HTTPException(status_code=400, detail="Minimum 60 points required for redemption")
-    
-    conn = get_conn()
+def _redeem_points(conn, user_id: int, points_to_redeem: int):
     cur = conn.cursor()
     
     # Get current points balance
     points_row = cur.execute('''
         SELECT points_balance FROM user_points WHERE user_id = ?
-    ''', (current_user['id'],)).fetchone()
+    ''', (user_id,)).fetchone()
     
     if not points_row:
-        conn.close()
         raise HTTPException(status_code=400, detail="No points balance found")
     
     current_balance = points_row['points_balance']
     
-    if current_balance < redeem_data.points_to_redeem:
-        conn.close()
+    if current_balance < points_to_redeem:
         raise HTTPException(status_code=400, detail="Insufficient points balance")
     
     # Update points balance
-    new_balance = current_balance - redeem_data.points_to_redeem
+    new_balance = current_balance - points_to_redeem
     cur.execute('''
-        UPDATE user_points 
+        UPDATE user_points
         SET points_balance = ?, updated_at = ?
         WHERE user_id = ?
-    ''', (new_balance, datetime.utcnow(), current_user['id']))
+    ''', (new_balance, datetime.utcnow(), user_id))
     
     # Add redemption to history (negative points)
     cur.execute('''
         INSERT INTO points_history (user_id, transaction_id, points_awarded)
         VALUES (?, NULL, ?)
-    ''', (current_user['id'], -redeem_data.points_to_redeem))
+    ''', (user_id, -points_to_redeem))
+    return new_balance
+
+@app.post('/points/redeem')
+async def redeem_points(redeem_data: PointsRedeem, current_user: dict = Depends(require_role('user')), db: RequestDatabase = Depends(get_request_db)):
+    if redeem_data.points_to_redeem < 60:
+        raise HTTPException(status_code=400, detail="Minimum 60 points required for redemption")
+    
+    new_balance = await db.transaction(_redeem_points, current_user['id'], redeem_data.points_to_redeem)
+    event_broker.publish('points.redeemed', {'points': redeem_data.points_to_redeem, 'points_balance': new_balance}, [current_user['id']])
     
     # Generate gift card code (simulated)
     import random
     import string
     gift_card_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
     
-    conn.commit()
-    conn.close()
-    
     return {
         "message": "Points redeemed successfully!",
         "gift_card_code": gift_card_code,
@@ -590,6 +1166,15 @@ async def redeem_points(redeem_data: PointsRedeem, current_user: dict = Depends(
         "remaining_balance": new_balance
     }
 
+# Change feed
+@app.get('/events')
+async def change_events(request: Request, last_event_id: Optional[str] = Query(None, description="Resume after this event id"),
+                        current_user: dict = Depends(get_stream_user)):
+    # The auth lookup has already returned its pooled connection, so the long-lived stream holds none
+    resume_from = request.headers.get('last-event-id') or last_event_id
+    return StreamingResponse(event_broker.stream(current_user, resume_from), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # AI Image Classification endpoints
 @app.post("/ai/classify-image")
 async def classify_image(file: UploadFile = File(...), current_user: dict = Depends(require_role('user'))):
@@ -621,10 +1206,19 @@ async def classify_image(file: UploadFile = File(...), current_user: dict = Depe
             detail="File too large. Please upload an image smaller than 10MB."
         )
     
+    # Cached classifications are served even while the model is warming up or after a failed warm-up
+    try:
+        result = await image_classifier.classify_image(content, current_user['id'])
+    except ClassifierUnavailable as e:
+        if e.state == 'failed':
+            raise HTTPException(
+                status_code=503, 
+                detail="Image classification service not available. Please contact administrator."
+            )
+        raise HTTPException(status_code=503, detail="Image classification is starting up, please retry shortly",
+                            headers={"Retry-After": "2"})
+    
     try:
-        # Classify the image
-        result = image_classifier.classify_image(content)
-        
         # Only use fallback if the API truly failed (error=True) or returned no detection
         api_confidence = result.get("confidence", 0.0)
         is_electronic = result.get("is_electronic_waste", False)
@@ -844,8 +1438,11 @@ async def classify_image(file: UploadFile = File(...), current_user: dict = Depe
 async def ai_health_check():
     """Check if AI image classification service is available"""
     return {
-        "available": image_classifier is not None,
-        "service": "Gemini API" if image_classifier else "Not configured"
+        "available": image_classifier is not None and image_classifier.available,
+        "service": "Gemini API" if image_classifier else "Not configured",
+        "classifier": image_classifier.get_status() if image_classifier else None,
+        "cache": classification_cache.get_stats(),
+        "image_index": image_index.get_stats()
     }
 
 if __name__ == "__main__":
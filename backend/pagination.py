@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Keyset pagination and server-side filters for list endpoints
+"""
+import base64
+import json
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+MAX_PAGE_SIZE = 500
+
+class ListFilters(BaseModel):
+    status: Optional[str] = None
+    category: Optional[str] = None
+    pincode: Optional[str] = None
+    route_id: Optional[int] = None
+    created_from: Optional[date] = None
+    created_to: Optional[date] = None
+
+class PageParams(BaseModel):
+    limit: Optional[int] = None
+    cursor: Optional[Tuple[str, int]] = None
+
+def list_filters(
+    status: Optional[str] = Query(None, description="Booking status"),
+    category: Optional[str] = Query(None, description="Device category"),
+    pincode: Optional[str] = Query(None, description="Pickup pincode"),
+    route_id: Optional[int] = Query(None, description="Route id"),
+    created_from: Optional[date] = Query(None, description="Created on or after this date"),
+    created_to: Optional[date] = Query(None, description="Created on or before this date"),
+) -> ListFilters:
+    return ListFilters(status=status, category=category, pincode=pincode, route_id=route_id,
+                       created_from=created_from, created_to=created_to)
+
+def page_params(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; enables cursor pagination"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+) -> PageParams:
+    if cursor is not None and limit is None:
+        raise HTTPException(status_code=400, detail="cursor requires limit")
+    return PageParams(limit=limit, cursor=decode_cursor(cursor) if cursor else None)
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def date_range_clauses(column: str, created_from: Optional[date], created_to: Optional[date]) -> Tuple[List[str], list]:
+    """SQL conditions for an inclusive date range over a 'YYYY-MM-DD HH:MM:SS' column"""
+    clauses, params = [], []
+    if created_from:
+        clauses.append(f"{column} >= ?")
+        params.append(created_from.isoformat())
+    if created_to:
+        clauses.append(f"{column} < ?")
+        params.append((created_to + timedelta(days=1)).isoformat())
+    return clauses, params
+
+def booking_filter_clauses(filters: ListFilters, alias: str = "b") -> Tuple[List[str], list]:
+    """SQL conditions and parameters for the booking list filters"""
+    clauses, params = [], []
+    for column in ("status", "category", "pincode", "route_id"):
+        value = getattr(filters, column)
+        if value is not None:
+            clauses.append(f"{alias}.{column} = ?")
+            params.append(value)
+    range_clauses, range_params = date_range_clauses(f"{alias}.created_at", filters.created_from, filters.created_to)
+    return clauses + range_clauses, params + range_params
+
+def keyset_clause(page: PageParams, time_column: str, id_column: str) -> Tuple[List[str], list]:
+    """Condition selecting rows after the cursor in (time, id) DESC order"""
+    if page.cursor is None:
+        return [], []
+    return [f"({time_column}, {id_column}) < (?, ?)"], list(page.cursor)
+
+def where_sql(clauses: List[str]) -> str:
+    return ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+def paginate(rows: List[dict], page: PageParams, time_key: str = "created_at", id_key: str = "id"):
+    """Shape rows fetched with LIMIT page.limit + 1 into the paginated response"""
+    if page.limit is None:
+        return rows
+    items = rows[:page.limit]
+    next_cursor = None
+    if len(rows) > page.limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last[time_key], last[id_key])
+    return {"items": items, "next_cursor": next_cursor}
+
+def limit_sql(page: PageParams) -> str:
+    # One extra row tells us whether there is a next page
+    return f"LIMIT {page.limit + 1}" if page.limit is not None else ""
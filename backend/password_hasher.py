@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Bounded executor for bcrypt hashing and verification off the event loop
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+
+class HasherBusyError(Exception):
+    """Raised when the hashing queue is full"""
+
+class PasswordHasher:
+    """Runs password hashing on a dedicated thread pool with a queue-depth cap
+
+    bcrypt releases the GIL while it works, so a small thread pool gives real
+    parallelism without blocking the event loop. At most ``max_workers`` hashes
+    run at once; once ``max_queue`` calls are in flight or waiting, new calls
+    fail fast with HasherBusyError instead of piling up behind the pool.
+    """
+
+    def __init__(self, pwd_context: CryptContext, max_workers: int = 4, max_queue: int = 32):
+        self.pwd_context = pwd_context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hasher")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._rejected += 1
+                raise HasherBusyError("Password hashing queue is full")
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash without blocking the event loop"""
+        return await self._submit(self.pwd_context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password without blocking the event loop"""
+        return await self._submit(self.pwd_context.hash, password)
+
+    def shutdown(self):
+        """Stop the hashing pool"""
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> dict:
+        """Get hashing pool statistics"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "pending": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected
+            }
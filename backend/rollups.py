@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Per-user and global material/booking rollups behind /dashboard
+
+Run directly to rebuild the rollups from bookings and materials.
+"""
+import sqlite3
+from typing import Dict, Tuple
+
+GLOBAL_ROLLUP = 0  # user_id of the platform-wide rows
+
+def _add_material(qty_expr: str, booking_expr: str, material_expr: str) -> str:
+    """Trigger statements adding qty to the booking owner's and the global material total"""
+    return f'''
+            INSERT INTO material_totals (user_id, material, total_qty)
+            SELECT user_id, {material_expr}, {qty_expr}
+            FROM (SELECT {GLOBAL_ROLLUP} as user_id
+                  UNION ALL
+                  SELECT user_id FROM bookings WHERE id = {booking_expr} AND user_id IS NOT NULL)
+            WHERE true
+            ON CONFLICT(user_id, material) DO UPDATE SET total_qty = total_qty + excluded.total_qty;'''
+
+def _add_bookings(count_expr: str, user_expr: str) -> str:
+    """Trigger statements adding to the user's and the global booking count"""
+    return f'''
+            INSERT INTO booking_counts (user_id, total_bookings)
+            SELECT user_id, {count_expr}
+            FROM (SELECT {GLOBAL_ROLLUP} as user_id UNION ALL SELECT {user_expr} WHERE {user_expr} IS NOT NULL)
+            WHERE true
+            ON CONFLICT(user_id) DO UPDATE SET total_bookings = total_bookings + excluded.total_bookings;'''
+
+def _add_category(count_expr: str, user_expr: str, category_expr: str) -> str:
+    """Trigger statements adding to the user's and the global booking count for a category"""
+    return f'''
+            INSERT INTO category_counts (user_id, category, total_bookings)
+            SELECT user_id, {category_expr}, {count_expr}
+            FROM (SELECT {GLOBAL_ROLLUP} as user_id UNION ALL SELECT {user_expr} WHERE {user_expr} IS NOT NULL)
+            WHERE true
+            ON CONFLICT(user_id, category) DO UPDATE SET total_bookings = total_bookings + excluded.total_bookings;'''
+
+def _move_owner(sign: str, user_expr: str) -> str:
+    """Trigger statements moving a re-owned booking's materials in or out of one user's totals"""
+    return f'''
+            INSERT INTO material_totals (user_id, material, total_qty)
+            SELECT {user_expr}, material, {sign}SUM(quantity) FROM materials
+            WHERE booking_id = NEW.id AND {user_expr} IS NOT NULL
+            GROUP BY material
+            ON CONFLICT(user_id, material) DO UPDATE SET total_qty = total_qty + excluded.total_qty;'''
+
+def ensure_rollups(conn: sqlite3.Connection):
+    """Create the rollup tables and the triggers that keep them current
+
+    The triggers run inside the writing transaction, so the rollups commit or
+    roll back together with the booking or material change that moved them.
+    Newly created rollups are built from the existing rows.
+    """
+    created = not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'category_counts'"
+    ).fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS material_totals (
+            user_id INTEGER NOT NULL,
+            material TEXT NOT NULL,
+            total_qty REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, material)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS category_counts (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            total_bookings INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS booking_counts (
+            user_id INTEGER PRIMARY KEY,
+            total_bookings INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    triggers = {
+        'trg_materials_rollup_insert': ('AFTER INSERT ON materials',
+                                        _add_material('NEW.quantity', 'NEW.booking_id', 'NEW.material')),
+        'trg_materials_rollup_delete': ('AFTER DELETE ON materials',
+                                        _add_material('-OLD.quantity', 'OLD.booking_id', 'OLD.material')),
+        'trg_materials_rollup_update': ('AFTER UPDATE OF booking_id, material, quantity ON materials',
+                                        _add_material('-OLD.quantity', 'OLD.booking_id', 'OLD.material')
+                                        + _add_material('NEW.quantity', 'NEW.booking_id', 'NEW.material')),
+        'trg_bookings_rollup_insert': ('AFTER INSERT ON bookings',
+                                       _add_bookings('1', 'NEW.user_id') + _add_category('1', 'NEW.user_id', 'NEW.category')),
+        'trg_bookings_rollup_delete': ('AFTER DELETE ON bookings',
+                                       _add_bookings('-1', 'OLD.user_id') + _add_category('-1', 'OLD.user_id', 'OLD.category')),
+        'trg_bookings_rollup_category': ('AFTER UPDATE OF user_id, category ON bookings '
+                                         'WHEN OLD.user_id IS NOT NEW.user_id OR OLD.category IS NOT NEW.category',
+                                         _add_category('-1', 'OLD.user_id', 'OLD.category')
+                                         + _add_category('1', 'NEW.user_id', 'NEW.category')),
+        'trg_bookings_rollup_owner': ('AFTER UPDATE OF user_id ON bookings WHEN OLD.user_id IS NOT NEW.user_id',
+                                      _add_bookings('-1', 'OLD.user_id') + _add_bookings('1', 'NEW.user_id')
+                                      + _move_owner('-', 'OLD.user_id') + _move_owner('', 'NEW.user_id')),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            BEGIN{body}
+            END
+        ''')
+
+    if created:
+        rebuild_rollups(conn)
+
+def rebuild_rollups(conn: sqlite3.Connection):
+    """Recompute every rollup from bookings and materials (reconciliation)"""
+    conn.execute('DELETE FROM material_totals')
+    conn.execute('DELETE FROM booking_counts')
+    conn.execute('DELETE FROM category_counts')
+    conn.execute(f'''
+        INSERT INTO material_totals (user_id, material, total_qty)
+        SELECT {GLOBAL_ROLLUP}, material, SUM(quantity) FROM materials GROUP BY material
+    ''')
+    conn.execute('''
+        INSERT INTO material_totals (user_id, material, total_qty)
+        SELECT b.user_id, m.material, SUM(m.quantity)
+        FROM materials m
+        JOIN bookings b ON b.id = m.booking_id
+        WHERE b.user_id IS NOT NULL
+        GROUP BY b.user_id, m.material
+    ''')
+    conn.execute(f'''
+        INSERT INTO booking_counts (user_id, total_bookings)
+        SELECT {GLOBAL_ROLLUP}, COUNT(*) FROM bookings
+    ''')
+    conn.execute('''
+        INSERT INTO booking_counts (user_id, total_bookings)
+        SELECT user_id, COUNT(*) FROM bookings WHERE user_id IS NOT NULL GROUP BY user_id
+    ''')
+    rebuild_category_counts(conn)
+
+def rebuild_category_counts(conn: sqlite3.Connection):
+    conn.execute(f'''
+        INSERT INTO category_counts (user_id, category, total_bookings)
+        SELECT {GLOBAL_ROLLUP}, category, COUNT(*) FROM bookings GROUP BY category
+    ''')
+    conn.execute('''
+        INSERT INTO category_counts (user_id, category, total_bookings)
+        SELECT user_id, category, COUNT(*) FROM bookings WHERE user_id IS NOT NULL GROUP BY user_id, category
+    ''')
+
+def dashboard_totals(conn: sqlite3.Connection, user_id: int) -> Tuple[int, Dict[str, float]]:
+    """Booking count and material totals for a user (or GLOBAL_ROLLUP) from the rollups"""
+    row = conn.execute('SELECT total_bookings FROM booking_counts WHERE user_id = ?', (user_id,)).fetchone()
+    metals_rows = conn.execute('SELECT material, total_qty FROM material_totals WHERE user_id = ?', (user_id,)).fetchall()
+    return (row[0] if row else 0), {material: total_qty for material, total_qty in metals_rows}
+
+def category_counts(conn: sqlite3.Connection, user_id: int) -> Tuple[int, Dict[str, int]]:
+    """Booking count and bookings per category for a user (or GLOBAL_ROLLUP) from the rollups"""
+    rows = conn.execute('SELECT category, total_bookings FROM category_counts WHERE user_id = ?', (user_id,)).fetchall()
+    counts = {category: total for category, total in rows}
+    return sum(counts.values()), counts
+
+if __name__ == "__main__":
+    conn = sqlite3.connect('e_waste.db')
+    ensure_rollups(conn)
+    rebuild_rollups(conn)
+    conn.commit()
+    totals = conn.execute('SELECT COUNT(*) FROM material_totals').fetchone()[0]
+    conn.close()
+    print(f"✅ Rebuilt dashboard rollups ({totals} material totals)")
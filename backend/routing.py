@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Capacity-constrained geographic clustering of bookings into delivery routes,
+and stop ordering within a route
+"""
+import math
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+MAX_ITERATIONS = 50
+BALANCE_ITERATIONS = 10
+TOLERANCE_KM = 0.01  # Stop once no centroid moves more than this
+EARTH_RADIUS_KM = 6371.0
+OPTIMIZE_BUDGET_SECONDS = 0.25  # 2-opt time budget per route
+# New bookings join the nearest open route within this distance; farther ones wait for the next schedule
+ATTACH_MAX_KM = float(os.getenv("ROUTE_ATTACH_MAX_KM", "10"))
+# Open routes are reclustered once a route's estimated mean radius grows this much past its scheduled radius
+REBALANCE_DRIFT = float(os.getenv("ROUTE_REBALANCE_DRIFT", "0.5"))
+MIN_RADIUS_KM = 0.5  # Drift baseline floor, so single-stop routes do not rebalance on every attach
+FIT_SAMPLE_SIZE = 20000  # Centroids are fitted on a sample of at most this many (or 50 per route) bookings
+ASSIGN_CANDIDATES = 8  # Nearest centroids ranked per booking by the capped assignment
+SWAP_MAX_POINTS = 5000  # Displaced bookings the outlier repair pass considers
+# Capped plans get enough routes to fill them to this fraction on average; the slack absorbs sampling error
+ROUTE_FILL_TARGET = 0.9
+
+def project(lat: np.ndarray, lon: np.ndarray, ref_lat: Optional[float] = None) -> np.ndarray:
+    """Equirectangular projection to km around ref_lat; shape (n, 2)"""
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    if ref_lat is None:
+        ref_lat = float(lat.mean())
+    return np.column_stack((lon * KM_PER_DEGREE_LON * math.cos(math.radians(ref_lat)), lat * KM_PER_DEGREE_LAT))
+
+def route_count(n: int, k: int, max_stops: Optional[int] = None) -> int:
+    """Number of routes: k, raised so routes are at most ROUTE_FILL_TARGET full, and at most one route per booking"""
+    if max_stops:
+        k = max(k, math.ceil(n / (max_stops * ROUTE_FILL_TARGET)))
+    return max(1, min(k, n))
+
+def _seed_centroids(points: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means++ seeding"""
+    centroids = np.empty((k, 2))
+    centroids[0] = points[rng.integers(len(points))]
+    closest = ((points - centroids[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        total = closest.sum()
+        index = rng.choice(len(points), p=closest / total) if total > 0 else rng.integers(len(points))
+        centroids[i] = points[index]
+        np.minimum(closest, ((points - centroids[i]) ** 2).sum(axis=1), out=closest)
+    return centroids
+
+def _nearest_candidates(points: np.ndarray, centroids: np.ndarray, count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Each point's ``count`` nearest centroids, nearest first, and the squared distances to them (KD-tree query)"""
+    from scipy.spatial import cKDTree  # Loaded on first use, like dispatch
+    count = min(count, len(centroids))
+    distances, candidates = cKDTree(centroids).query(points, k=count)
+    if count == 1:
+        distances, candidates = distances[:, None], candidates[:, None]
+    return candidates.astype(np.intp), distances ** 2
+
+def _greedy_fill(candidates: np.ndarray, candidate_distances: np.ndarray, remaining: np.ndarray) -> np.ndarray:
+    """One sweep in regret order: each point takes its nearest candidate with room left (-1 if none has)
+
+    Points that would lose the most by missing their first choice (largest gap
+    to the second) go first. ``remaining`` is updated in place.
+    """
+    n = len(candidates)
+    if candidates.shape[1] > 1:
+        order = np.argsort(candidate_distances[:, 0] - candidate_distances[:, 1], kind='stable')
+    else:
+        order = np.arange(n)
+    labels = [-1] * n
+    room = remaining.tolist()
+    for point, row in zip(order.tolist(), candidates[order].tolist()):
+        for cluster in row:
+            if room[cluster] > 0:
+                room[cluster] -= 1
+                labels[point] = cluster
+                break
+    remaining[:] = room
+    return np.array(labels, dtype=np.intp)
+
+def _repair_outliers(points: np.ndarray, centroids: np.ndarray, labels: np.ndarray,
+                     candidates: np.ndarray, candidate_distances: np.ndarray, max_points: int):
+    """Swap displaced points into nearer full clusters when that lowers total squared distance
+
+    Points not in their nearest cluster are visited worst first (at most
+    max_points). For each nearer candidate cluster, the member that loses least
+    by moving to the point's cluster is found; they swap if that is an overall
+    improvement. Labels are updated in place.
+    """
+    def squared(indices, cluster):
+        return ((points[indices] - centroids[cluster]) ** 2).sum(axis=-1)
+
+    assigned = squared(np.arange(len(points)), labels)
+    displaced = np.flatnonzero(candidates[:, 0] != labels)
+    if not displaced.size:
+        return
+    loss = assigned[displaced] - candidate_distances[displaced, 0]
+    displaced = displaced[np.argsort(-loss, kind='stable')[:max_points]]
+
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+    members = [order[bounds[cluster]:bounds[cluster + 1]].copy() for cluster in range(len(centroids))]
+    position = np.empty(len(points), dtype=np.intp)
+    for cluster_members in members:
+        position[cluster_members] = np.arange(len(cluster_members))
+
+    for point in displaced.tolist():
+        current = labels[point]
+        for rank, better in enumerate(candidates[point].tolist()):
+            if better == current:
+                break
+            gain = squared(point, current) - candidate_distances[point, rank]
+            others = members[better]
+            if not others.size:
+                continue
+            cost = squared(others, current) - squared(others, better)
+            best = int(cost.argmin())
+            if cost[best] < gain:
+                other = others[best]
+                members[better][best], members[current][position[point]] = point, other
+                position[point], position[other] = best, position[point]
+                labels[point], labels[other] = better, current
+                break
+
+def _bisection_centroids(points: np.ndarray, k: int) -> np.ndarray:
+    """Centroids of k equal-sized cells from recursive median splits along the wider axis
+
+    Seeds capped plans: capacity starts out where the bookings are, which
+    k-means++ (too few centroids in dense areas) does not give.
+    """
+    centroids = []
+    stack = [(np.arange(len(points)), k)]
+    while stack:
+        indices, cells = stack.pop()
+        cell_points = points[indices]
+        if cells == 1:
+            centroids.append(cell_points.mean(axis=0))
+            continue
+        axis = int(np.ptp(cell_points[:, 0]) < np.ptp(cell_points[:, 1]))
+        left = cells // 2
+        cut = round(len(indices) * left / cells)
+        order = np.argpartition(cell_points[:, axis], min(cut, len(indices) - 1))
+        stack.append((indices[order[cut:]], cells - left))
+        stack.append((indices[order[:cut]], left))
+    return np.array(centroids)
+
+def capacitated_assign(points: np.ndarray, centroids: np.ndarray, capacity, max_swaps: int = SWAP_MAX_POINTS) -> np.ndarray:
+    """Assign each point to a centroid with at most ``capacity`` points per cluster (an int or one per cluster)
+
+    Each point's nearest ASSIGN_CANDIDATES centroids are ranked once and capacity
+    is filled in a single regret-ordered sweep; points whose candidates all
+    filled up are assigned among the clusters with room left. A swap pass over
+    at most ``max_swaps`` of the worst-placed points then pulls them back
+    towards their nearest routes.
+    """
+    k = len(centroids)
+    remaining = np.broadcast_to(np.asarray(capacity, dtype=np.int64), (k,)).copy()
+    candidates, candidate_distances = _nearest_candidates(points, centroids, ASSIGN_CANDIDATES)
+    labels = _greedy_fill(candidates, candidate_distances, remaining)
+    leftover = np.flatnonzero(labels < 0)
+    if leftover.size:
+        open_clusters = np.flatnonzero(remaining > 0)
+        labels[leftover] = open_clusters[capacitated_assign(points[leftover], centroids[open_clusters],
+                                                            remaining[open_clusters], 0)]
+    if k > 1 and max_swaps:
+        _repair_outliers(points, centroids, labels, candidates, candidate_distances, max_swaps)
+    return labels
+
+def _lloyd(points: np.ndarray, centroids: np.ndarray, max_iterations: int,
+           capacity: Optional[int] = None) -> Tuple[np.ndarray, int]:
+    """Lloyd iterations updating centroids in place; returns the labels and iterations run"""
+    k = len(centroids)
+    for iteration in range(1, max_iterations + 1):
+        labels = capacitated_assign(points, centroids, capacity, 0) if capacity else _nearest_candidates(points, centroids, 1)[0][:, 0]
+        counts = np.bincount(labels, minlength=k)
+        previous = centroids.copy()
+        for axis in range(2):
+            centroids[:, axis] = np.where(
+                counts > 0, np.bincount(labels, weights=points[:, axis], minlength=k) / np.maximum(counts, 1),
+                centroids[:, axis])
+        if np.sqrt(((centroids - previous) ** 2).sum(axis=1)).max() < TOLERANCE_KM:
+            break
+    return labels, iteration
+
+class RoutePlan:
+    """Cluster labels (0..k-1) per booking, route centroids and compactness metrics"""
+
+    def __init__(self, labels: np.ndarray, centroid_lat: np.ndarray, centroid_lon: np.ndarray,
+                 radius_km: np.ndarray, iterations: int):
+        self.labels = labels
+        self.centroid_lat = centroid_lat
+        self.centroid_lon = centroid_lon
+        self.radius_km = radius_km  # Each booking's distance to its route centroid
+        self.iterations = iterations
+
+    @property
+    def k(self) -> int:
+        return len(self.centroid_lat)
+
+    def route_metrics(self) -> List[dict]:
+        stops = np.bincount(self.labels, minlength=self.k)
+        mean_km = np.bincount(self.labels, weights=self.radius_km, minlength=self.k) / np.maximum(stops, 1)
+        max_km = np.zeros(self.k)
+        np.maximum.at(max_km, self.labels, self.radius_km)
+        return [{'stops': int(stops[i]),
+                 'centroid': {'lat': round(float(self.centroid_lat[i]), 6), 'lon': round(float(self.centroid_lon[i]), 6)},
+                 'mean_radius_km': round(float(mean_km[i]), 3),
+                 'max_radius_km': round(float(max_km[i]), 3)}
+                for i in range(self.k)]
+
+    def metrics(self) -> dict:
+        stops = np.bincount(self.labels, minlength=self.k)
+        return {
+            'routes': self.k,
+            'stops': int(stops.sum()),
+            'iterations': self.iterations,
+            'mean_radius_km': round(float(self.radius_km.mean()), 3),
+            'max_radius_km': round(float(self.radius_km.max()), 3),
+            'inertia_km2': round(float((self.radius_km ** 2).sum()), 3),
+            # 1.0 means perfectly even route sizes
+            'size_imbalance': round(float(stops.max() / stops.mean()), 3)
+        }
+
+def plan_routes(lat: np.ndarray, lon: np.ndarray, k: int, max_stops: Optional[int] = None,
+                seed: int = 0, max_iterations: int = MAX_ITERATIONS) -> RoutePlan:
+    """Balanced k-means over booking coordinates
+
+    Centroids are fitted on a sample: k-means++ and Lloyd iterations, or when
+    max_stops is set, equal-sized bisection cells refined by a few Lloyd rounds
+    with a capacity-constrained assignment step. Every booking is then
+    assigned in one pass. k is raised so capped routes are on average at most
+    ROUTE_FILL_TARGET full.
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    ref_lat = float(lat.mean())
+    points = project(lat, lon, ref_lat)
+    k = route_count(len(points), k, max_stops)
+    rng = np.random.default_rng(seed)
+    n = len(points)
+    sample_size = max(FIT_SAMPLE_SIZE, 50 * k)
+    sample = points if n <= sample_size else points[rng.choice(n, sample_size, replace=False)]
+    if max_stops:
+        # Equal-sized cells, refined by a few balanced rounds
+        centroids = _bisection_centroids(sample, k)
+        _, iterations = _lloyd(sample, centroids, BALANCE_ITERATIONS, math.ceil(max_stops * len(sample) / n))
+    else:
+        centroids = _seed_centroids(sample, k, rng)
+        _, iterations = _lloyd(sample, centroids, max_iterations)
+    # One full pass assigns every booking to the fitted centroids
+    if max_stops:
+        labels = capacitated_assign(points, centroids, max_stops)
+    else:
+        labels = _nearest_candidates(points, centroids, 1)[0][:, 0]
+    # Drop clusters that ended up empty so every route has stops
+    used = np.flatnonzero(np.bincount(labels, minlength=k))
+    if len(used) < k:
+        remap = np.full(k, -1, dtype=np.intp)
+        remap[used] = np.arange(len(used))
+        labels, centroids = remap[labels], centroids[used]
+    radius_km = np.sqrt(((points - centroids[labels]) ** 2).sum(axis=1))
+    centroid_lat = centroids[:, 1] / KM_PER_DEGREE_LAT
+    centroid_lon = centroids[:, 0] / (KM_PER_DEGREE_LON * math.cos(math.radians(ref_lat)))
+    return RoutePlan(labels, centroid_lat, centroid_lon, radius_km, iterations)
+
+def plan_pincode_routes(pincodes: Sequence[Optional[str]], k: int, max_stops: Optional[int] = None) -> np.ndarray:
+    """Route labels (0..) for bookings without usable coordinates: runs of consecutive pincodes
+
+    Pincodes are hierarchical (region, sub-region, sorting district), so
+    numerically close ones are usually close on the ground. Bookings sorted by
+    pincode are cut into routes of about n / route_count(n, k, max_stops)
+    stops, only at a change of pincode unless a route reaches max_stops.
+    """
+    n = len(pincodes)
+    target = math.ceil(n / route_count(n, k, max_stops))
+    labels = np.empty(n, dtype=np.intp)
+    label, size, previous = 0, 0, None
+    for i in sorted(range(n), key=lambda i: (pincodes[i] or '', i)):
+        pincode = pincodes[i] or ''
+        if size and ((size >= target and pincode != previous) or (max_stops and size >= max_stops)):
+            label, size = label + 1, 0
+        labels[i] = label
+        size += 1
+        previous = pincode
+    return labels
+
+def route_summary(route_ids: List[int], plan: RoutePlan) -> Tuple[Dict[int, int], Dict[int, dict]]:
+    """Stops per route id and per-route compactness, keyed by the route ids given to the clusters"""
+    per_route = dict(zip(route_ids, plan.route_metrics()))
+    return {route_id: metrics['stops'] for route_id, metrics in per_route.items()}, per_route
+
+def haversine_matrix(lat: Sequence[float], lon: Sequence[float]) -> np.ndarray:
+    """(n, n) great-circle distances in km"""
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def nearest_neighbour_tour(distances: np.ndarray, start: int = 0) -> np.ndarray:
+    """Greedy open path visiting every stop, always moving to the closest unvisited one"""
+    n = len(distances)
+    tour = np.empty(n, dtype=np.intp)
+    visited = np.zeros(n, dtype=bool)
+    current = start
+    for position in range(n):
+        tour[position] = current
+        visited[current] = True
+        if position < n - 1:
+            current = int(np.argmin(np.where(visited, np.inf, distances[current])))
+    return tour
+
+def two_opt(distances: np.ndarray, tour: np.ndarray, deadline: float) -> Tuple[np.ndarray, int]:
+    """Improve an open path with 2-opt segment reversals until no move helps or the deadline passes
+
+    The path is treated as a cycle through a dummy stop at zero distance from
+    every other stop, so both ends stay free. For each segment start, the best
+    segment end is found in one vectorized pass. Returns the tour and the
+    number of improving moves applied.
+    """
+    n = len(tour)
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = distances
+    path = np.concatenate(([n], tour, [n]))  # The dummy stop at both ends
+    moves = 0
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, n):
+            a, b = path[i - 1], path[i]
+            c, d = path[i + 1:n + 1], path[i + 2:n + 2]
+            delta = padded[a, c] + padded[b, d] - padded[a, b] - padded[c, d]
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                path[i:i + j + 2] = path[i:i + j + 2][::-1].copy()
+                moves += 1
+                improved = True
+        if n < 4:
+            break
+    return path[1:n + 1], moves
+
+class StopOrder:
+    """Visiting order for a route's bookings, with the distance of each leg"""
+
+    def __init__(self, booking_ids: List[int], leg_km: List[float], moves: int = 0, elapsed_ms: float = 0.0):
+        self.booking_ids = booking_ids
+        self.leg_km = leg_km  # leg_km[i] is the distance from stop i - 1 to stop i (0 for the first)
+        self.moves = moves
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def distance_km(self) -> float:
+        return round(sum(self.leg_km), 3)
+
+def order_stops(booking_ids: Sequence[int], lat: Sequence[float], lon: Sequence[float],
+                budget: float = OPTIMIZE_BUDGET_SECONDS) -> StopOrder:
+    """Nearest-neighbour path from the stop farthest from the route centre, improved by 2-opt"""
+    started = time.perf_counter()
+    if not booking_ids:
+        return StopOrder([], [])
+    distances = haversine_matrix(lat, lon)
+    centre = project(lat, lon).mean(axis=0)
+    start = int(np.argmax(((project(lat, lon) - centre) ** 2).sum(axis=1)))
+    tour, moves = two_opt(distances, nearest_neighbour_tour(distances, start), started + budget)
+    legs = np.concatenate(([0.0], distances[tour[:-1], tour[1:]])).round(3).tolist()
+    return StopOrder([int(booking_ids[i]) for i in tour], legs, moves, round((time.perf_counter() - started) * 1000, 2))
+
+def ensure_route_tables(conn: sqlite3.Connection):
+    """Routes created by schedule_routes and their ordered stops"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY,
+            stops INTEGER NOT NULL DEFAULT 0,
+            capacity INTEGER,
+            centroid_lat REAL,
+            centroid_lon REAL,
+            radius_km REAL NOT NULL DEFAULT 0,
+            scheduled_stops INTEGER NOT NULL DEFAULT 0,
+            attached_km REAL NOT NULL DEFAULT 0,
+            distance_km REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            optimized_at TIMESTAMP,
+            dispatched_at TIMESTAMP,
+            delivery_guy_id INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS route_stops (
+            route_id INTEGER NOT NULL,
+            sequence INTEGER NOT NULL,
+            booking_id INTEGER NOT NULL,
+            leg_km REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (route_id, sequence)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_route_stops_booking ON route_stops(booking_id)")
+
+def haversine_km(lat: np.ndarray, lon: np.ndarray, point_lat: float, point_lon: float) -> np.ndarray:
+    """Great-circle distances in km from each (lat, lon) to one point"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    point_lat, point_lon = math.radians(point_lat), math.radians(point_lon)
+    a = np.sin((lat - point_lat) / 2) ** 2 + np.cos(lat) * math.cos(point_lat) * np.sin((lon - point_lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def route_drift(radius_km: float, scheduled_stops: int, attached_km: float, stops: int) -> float:
+    """Growth of a route's mean stop-to-centre distance since it was scheduled (0.5 = 50% wider)"""
+    estimated = (radius_km * scheduled_stops + attached_km) / max(stops, 1)
+    return estimated / max(radius_km, MIN_RADIUS_KM) - 1
+
+def attach_to_route(conn: sqlite3.Connection, lat: float, lon: float) -> Optional[Tuple[int, float]]:
+    """Put a new booking on the nearest open route with spare capacity
+
+    One pass over the open routes' centroids (O(k), independent of how many
+    bookings exist). The route's centroid moves incrementally and its stop
+    order is invalidated. Returns (route_id, drift), or None if no open route
+    is within ATTACH_MAX_KM.
+    """
+    rows = conn.execute('''
+        SELECT id, centroid_lat, centroid_lon, stops, radius_km, scheduled_stops, attached_km FROM routes
+        WHERE dispatched_at IS NULL AND centroid_lat IS NOT NULL AND (capacity IS NULL OR stops < capacity)
+    ''').fetchall()
+    if not rows:
+        return None
+    distances = haversine_km(np.array([row[1] for row in rows]), np.array([row[2] for row in rows]), lat, lon)
+    nearest = int(np.argmin(distances))
+    distance = float(distances[nearest])
+    if distance > ATTACH_MAX_KM:
+        return None
+    route_id, centroid_lat, centroid_lon, stops, radius_km, scheduled_stops, attached_km = rows[nearest]
+    conn.execute('''
+        UPDATE routes
+        SET stops = stops + 1, centroid_lat = ?, centroid_lon = ?, attached_km = attached_km + ?, optimized_at = NULL
+        WHERE id = ?
+    ''', ((centroid_lat * stops + lat) / (stops + 1), (centroid_lon * stops + lon) / (stops + 1), distance, route_id))
+    return route_id, route_drift(radius_km, scheduled_stops, attached_km + distance, stops + 1)
+
+def attach_by_pincode(conn: sqlite3.Connection, pincode: Optional[str]) -> Optional[Tuple[int, float]]:
+    """Put a booking without usable coordinates on an open pincode route that already serves its pincode
+
+    Returns (route_id, 0.0) like attach_to_route (pincode routes have no
+    centroid to drift from), or None.
+    """
+    if not pincode:
+        return None
+    row = conn.execute('''
+        SELECT r.id FROM routes r
+        WHERE r.dispatched_at IS NULL AND r.centroid_lat IS NULL AND (r.capacity IS NULL OR r.stops < r.capacity)
+          AND EXISTS (SELECT 1 FROM bookings b WHERE b.route_id = r.id AND b.pincode = ?)
+        ORDER BY r.stops, r.id LIMIT 1
+    ''', (pincode,)).fetchone()
+    if row is None:
+        return None
+    conn.execute('UPDATE routes SET stops = stops + 1, optimized_at = NULL WHERE id = ?', (row[0],))
+    return row[0], 0.0
+
+def rebalance_candidates(conn: sqlite3.Connection) -> List[int]:
+    """Open routes with coordinates whose stops are all still waiting for a delivery partner"""
+    return [row[0] for row in conn.execute('''
+        SELECT r.id FROM routes r
+        WHERE r.dispatched_at IS NULL AND r.centroid_lat IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM bookings b
+            WHERE b.route_id = r.id AND (b.status != 'scheduled' OR b.current_delivery_id IS NOT NULL)
+        )
+        ORDER BY r.id
+    ''').fetchall()]
+
+def route_stop_coordinates(conn: sqlite3.Connection, route_id: int) -> Tuple[List[int], List[float], List[float]]:
+    rows = conn.execute('''
+        SELECT id, lat, lon FROM bookings
+        WHERE route_id = ? AND lat IS NOT NULL
+        ORDER BY id
+    ''', (route_id,)).fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+
+def pincode_grouped(conn: sqlite3.Connection, route_id: int) -> bool:
+    """Whether a route was grouped by pincode (it has no centroid) rather than clustered by coordinates"""
+    row = conn.execute('SELECT centroid_lat FROM routes WHERE id = ?', (route_id,)).fetchone()
+    return row is not None and row[0] is None
+
+def pincode_stop_order(conn: sqlite3.Connection, route_id: int) -> StopOrder:
+    """All of a pincode route's bookings in pincode order; leg distances are unknown"""
+    booking_ids = [row[0] for row in conn.execute(
+        'SELECT id FROM bookings WHERE route_id = ? ORDER BY pincode, id', (route_id,)).fetchall()]
+    return StopOrder(booking_ids, [0.0] * len(booking_ids))
+
+def plan_stop_order(conn: sqlite3.Connection, route_id: int, budget: float = OPTIMIZE_BUDGET_SECONDS) -> StopOrder:
+    """Order a route's current bookings (read-only; store with store_stop_order)"""
+    if pincode_grouped(conn, route_id):
+        return pincode_stop_order(conn, route_id)
+    return order_stops(*route_stop_coordinates(conn, route_id), budget=budget)
+
+def store_stop_order(conn: sqlite3.Connection, route_id: int, order: Optional[StopOrder] = None,
+                     budget: float = OPTIMIZE_BUDGET_SECONDS) -> StopOrder:
+    """Replace a route's stop sequence; plans it here if no order is given or its bookings changed since"""
+    grouped = pincode_grouped(conn, route_id)
+    if grouped:
+        # Cheap to redo, so always from the current bookings
+        order = pincode_stop_order(conn, route_id)
+    else:
+        booking_ids, lat, lon = route_stop_coordinates(conn, route_id)
+        if order is None or sorted(booking_ids) != sorted(order.booking_ids):
+            order = order_stops(booking_ids, lat, lon, budget)
+    conn.execute('DELETE FROM route_stops WHERE route_id = ?', (route_id,))
+    conn.executemany('INSERT INTO route_stops (route_id, sequence, booking_id, leg_km) VALUES (?, ?, ?, ?)',
+                     [(route_id, sequence, booking_id, leg) for sequence, (booking_id, leg)
+                      in enumerate(zip(order.booking_ids, order.leg_km), start=1)])
+    conn.execute('''
+        UPDATE routes SET stops = ?, distance_km = ?, optimized_at = CURRENT_TIMESTAMP WHERE id = ?
+    ''', (len(order.booking_ids), None if grouped else order.distance_km, route_id))
+    return order
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Idempotent schema upgrades applied at API startup (or run directly as a script)
+"""
+import sqlite3
+from rollups import ensure_rollups
+from analytics import ensure_analytics_rollups
+from geocoder import ensure_gazetteer
+from delivery_sync import ensure_delivery_sync
+from jobs import ensure_jobs
+from classification_cache import ensure_classification_cache
+from image_index import ensure_image_hashes
+from routing import ensure_route_tables
+from yields import DEFAULT_WEIGHTS, DEFAULT_YIELDS, insert_yield_version
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})").fetchall())
+
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, definition: str) -> bool:
+    if column_exists(conn, table, column):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+def ensure_booking_columns(conn: sqlite3.Connection):
+    """Columns create_booking writes that older setup scripts did not create"""
+    add_column_if_missing(conn, 'bookings', 'device_model', 'TEXT')
+    # Coordinates from the offline geocoder (see geocoder.py)
+    add_column_if_missing(conn, 'bookings', 'lat', 'REAL')
+    add_column_if_missing(conn, 'bookings', 'lon', 'REAL')
+    add_column_if_missing(conn, 'bookings', 'geo_precision', 'TEXT')
+
+def ensure_yield_tables(conn: sqlite3.Connection):
+    """Versioned yield tables (seeded with the original estimates as version 1)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS yield_tables (
+            version INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            avg_weight REAL NOT NULL,
+            material TEXT NOT NULL,
+            fraction REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version, category, material)
+        )
+    ''')
+    if conn.execute('SELECT 1 FROM yield_tables LIMIT 1').fetchone() is None:
+        insert_yield_version(conn, 1, DEFAULT_WEIGHTS, DEFAULT_YIELDS)
+    # Existing estimates were all made with the version 1 defaults
+    add_column_if_missing(conn, 'bookings', 'yield_version', 'INTEGER DEFAULT 1')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_yield_version ON bookings(yield_version)")
+
+def ensure_current_delivery(conn: sqlite3.Connection):
+    """Maintain bookings.current_delivery_id and keep assignment history in order_status_history
+
+    deliveries keeps one row per assignment (the assignment history); the booking
+    points at its live assignment, so readers join on a primary key instead of
+    searching for MAX(deliveries.id) per booking.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_status_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            booking_id INTEGER NOT NULL,
+            old_status TEXT,
+            new_status TEXT NOT NULL,
+            updated_by TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (booking_id) REFERENCES bookings (id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_status_history_booking_id ON order_status_history(booking_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_delivery_guy_id ON deliveries(delivery_guy_id)")
+
+    if add_column_if_missing(conn, 'bookings', 'current_delivery_id', 'INTEGER REFERENCES deliveries (id)'):
+        # Backfill from the latest assignment per booking
+        conn.execute('''
+            UPDATE bookings
+            SET current_delivery_id = (SELECT MAX(d.id) FROM deliveries d WHERE d.booking_id = bookings.id)
+        ''')
+
+    # Any insert into deliveries (API or maintenance scripts) moves the pointer
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_deliveries_set_current
+        AFTER INSERT ON deliveries
+        BEGIN
+            UPDATE bookings SET current_delivery_id = NEW.id WHERE id = NEW.booking_id;
+        END
+    ''')
+
+def ensure_list_indexes(conn: sqlite3.Connection):
+    """Composite indexes backing keyset pagination on (created_at, id) and the list filters"""
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_bookings_created_id ON bookings(created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user_created_id ON bookings(user_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_status_created_id ON bookings(status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_category_created_id ON bookings(category, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_pincode_created_id ON bookings(pincode, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_route_created_id ON bookings(route_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_current_delivery_created_id ON bookings(current_delivery_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_points_history_user_timestamp_id ON points_history(user_id, timestamp, id)",
+    ]
+    for index_sql in indexes:
+        conn.execute(index_sql)
+
+def _bump_version(scope: str, user_expr: str) -> str:
+    """Trigger statement incrementing the (scope, user) change counter; NULL users are skipped"""
+    return f'''
+            INSERT INTO table_versions (scope, user_id, version)
+            SELECT '{scope}', {user_expr}, 1 WHERE {user_expr} IS NOT NULL
+            ON CONFLICT(scope, user_id) DO UPDATE SET version = version + 1;'''
+
+def ensure_table_versions(conn: sqlite3.Connection):
+    """Change counters behind the ETags of polled endpoints
+
+    One row per (scope, user_id); user_id 0 is the global counter. Triggers bump
+    the counters in the same transaction as the write, so maintenance scripts are
+    covered too and a rolled-back write never changes an ETag.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            scope TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    delivery_guy = "(SELECT delivery_guy_id FROM deliveries WHERE id = {}.current_delivery_id)"
+    booking_owner = "(SELECT user_id FROM bookings WHERE id = {}.booking_id)"
+    triggers = {
+        # Booking changes also move the current delivery guy's assignment list and routes
+        'bookings': {
+            'INSERT': [('bookings', '0'), ('bookings', 'NEW.user_id')],
+            'UPDATE': [('bookings', '0'), ('bookings', 'NEW.user_id'),
+                       ('bookings', 'CASE WHEN OLD.user_id IS NOT NEW.user_id THEN OLD.user_id END'),
+                       ('deliveries', delivery_guy.format('NEW')),
+                       ('deliveries', f"CASE WHEN OLD.current_delivery_id IS NOT NEW.current_delivery_id "
+                                      f"THEN {delivery_guy.format('OLD')} END")],
+            'DELETE': [('bookings', '0'), ('bookings', 'OLD.user_id'), ('deliveries', delivery_guy.format('OLD'))],
+        },
+        'materials': {
+            'INSERT': [('materials', '0'), ('materials', booking_owner.format('NEW'))],
+            'UPDATE': [('materials', '0'), ('materials', booking_owner.format('NEW'))],
+            'DELETE': [('materials', '0'), ('materials', booking_owner.format('OLD'))],
+        },
+        'deliveries': {
+            'INSERT': [('deliveries', '0'), ('deliveries', 'NEW.delivery_guy_id')],
+            'UPDATE': [('deliveries', '0'), ('deliveries', 'NEW.delivery_guy_id')],
+            'DELETE': [('deliveries', '0'), ('deliveries', 'OLD.delivery_guy_id')],
+        },
+        'user_points': {
+            'INSERT': [('points', 'NEW.user_id')],
+            'UPDATE': [('points', 'NEW.user_id')],
+        },
+        'points_history': {
+            'INSERT': [('points', 'NEW.user_id')],
+        },
+        # A new yield version changes derived material totals for everyone
+        'yield_tables': {
+            'INSERT': [('yields', '0')],
+        },
+        # Cached principals compare this per-user counter, so role or password changes apply at once
+        'users': {
+            'UPDATE': [('users', 'NEW.id'), ('users', 'CASE WHEN OLD.id IS NOT NEW.id THEN OLD.id END')],
+            'DELETE': [('users', 'OLD.id')],
+        },
+        # Route rows are updated whenever their stop sequence is stored
+        'routes': {
+            'INSERT': [('routes', '0')],
+            'UPDATE': [('routes', '0')],
+            'DELETE': [('routes', '0')],
+        },
+    }
+    for table, events in triggers.items():
+        for event, bumps in events.items():
+            body = ''.join(_bump_version(scope, user_expr) for scope, user_expr in bumps)
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN{body}
+                END
+            ''')
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Apply all schema upgrades; safe to run repeatedly"""
+    if not table_exists(conn, 'bookings'):
+        print("⚠️  bookings table not found - run setup_db.py first")
+        return
+    ensure_booking_columns(conn)
+    ensure_yield_tables(conn)
+    ensure_current_delivery(conn)
+    ensure_list_indexes(conn)
+    ensure_route_tables(conn)
+    ensure_table_versions(conn)
+    ensure_rollups(conn)
+    ensure_analytics_rollups(conn)
+    ensure_gazetteer(conn)
+    ensure_delivery_sync(conn)
+    ensure_jobs(conn)
+    ensure_classification_cache(conn)
+    ensure_image_hashes(conn)
+
+if __name__ == "__main__":
+    conn = sqlite3.connect('e_waste.db')
+    ensure_schema(conn)
+    conn.commit()
+    conn.close()
+    print("✅ Schema is up to date")
@@ -0,0 +1,66 @@
+"""
+Shared fixtures: a fresh database in a temporary directory and one app lifespan per session
+"""
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('db')
+    # Modules open e_waste.db relative to the working directory
+    os.chdir(workdir)
+    os.environ['GEMINI_API_KEY'] = ''
+    subprocess.run([sys.executable, str(BACKEND_DIR / 'setup_db.py')], cwd=workdir, check=True, capture_output=True)
+    import main
+    return main
+
+@pytest.fixture(scope='session')
+def client(app_module):
+    from fastapi.testclient import TestClient
+    # The lifespan shuts the DB thread pool down, so it can only run once per process
+    with TestClient(app_module.app) as test_client:
+        yield test_client
+
+@pytest.fixture(scope='session')
+def login(client):
+    def _login(username: str, password: str) -> dict:
+        response = client.post('/auth/login', json={'username': username, 'password': password})
+        assert response.status_code == 200, response.text
+        return {'Authorization': f"Bearer {response.json()['access_token']}"}
+    return _login
+
+@pytest.fixture(scope='session')
+def admin_headers(login):
+    return login('admin', 'admin123')
+
+@pytest.fixture(scope='session')
+def user_headers(login):
+    return login('user1', 'user123')
+
+@pytest.fixture(scope='session')
+def delivery_headers(login):
+    return login('delivery1', 'delivery123')
+
+@pytest.fixture(scope='session')
+def run_job(client):
+    """Submit a job with a POST and wait for it to finish; returns the final job"""
+    def _run_job(url: str, headers: dict, timeout: float = 30.0) -> dict:
+        response = client.post(url, headers=headers)
+        assert response.status_code == 202, response.text
+        job_id = response.json()['id']
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = client.get(f'/jobs/{job_id}', headers=headers).json()
+            if job['status'] in ('succeeded', 'failed', 'cancelled'):
+                return job
+            time.sleep(0.05)
+        raise AssertionError(f"job {job_id} did not finish in {timeout}s")
+    return _run_job
@@ -0,0 +1,25 @@
+"""
+Principal cache: entries are dropped as soon as their users row changes, even from another connection
+"""
+import sqlite3
+from auth_cache import principal_cache
+
+def test_role_change_applies_to_the_next_request(client, login):
+    account = {'username': 'cache_demoted', 'password': 'cache123', 'role': 'delivery'}
+    assert client.post('/auth/register', json=account).status_code == 200
+    headers = login(account['username'], account['password'])
+    assert client.get('/delivery/assignments', headers=headers).status_code == 200
+    assert client.get('/delivery/assignments', headers=headers).status_code == 200
+
+    # A maintenance script demotes the user while the token is still cached
+    with sqlite3.connect('e_waste.db') as conn:
+        conn.execute("UPDATE users SET role = 'user' WHERE username = ?", (account['username'],))
+    invalidations = principal_cache.get_stats()['invalidations']
+    assert client.get('/delivery/assignments', headers=headers).status_code == 401
+    assert principal_cache.get_stats()['invalidations'] == invalidations + 1
+
+def test_unchanged_user_is_served_from_cache(client, user_headers):
+    assert client.get('/bookings', headers=user_headers).status_code == 200
+    hits = principal_cache.get_stats()['hits']
+    assert client.get('/bookings', headers=user_headers).status_code == 200
+    assert principal_cache.get_stats()['hits'] == hits + 1
@@ -0,0 +1,36 @@
+"""
+Image classifier: cached results are served before the model is ready
+"""
+import asyncio
+import io
+import pytest
+from PIL import Image
+from ai_image_classifier import CLASSIFIER_VERSION, ClassifierUnavailable, EwasteImageClassifier
+from async_db import db
+from classification_cache import ClassificationCache, content_hash
+
+def _png(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+@pytest.mark.parametrize('state', ['cold', 'warming', 'failed'])
+def test_cached_result_is_served_until_the_model_is_ready(client, state):
+    cache = ClassificationCache(db)
+    classifier = EwasteImageClassifier('test-key', cache=cache)
+    classifier.state = state
+    cached_image, other_image = _png((200, 10, 10)), _png((10, 200, 10))
+    stored = {'is_electronic_waste': True, 'device_count': 1, 'device_type': 'laptop', 'confidence': 0.9}
+
+    async def scenario():
+        image_hash = content_hash(classifier.preprocess_image(cached_image))
+        await cache.put(image_hash, CLASSIFIER_VERSION, stored, 500.0)
+        result = await classifier.classify_image(cached_image, 3)
+        with pytest.raises(ClassifierUnavailable) as unavailable:
+            await classifier.classify_image(other_image, 3)
+        return result, unavailable.value
+
+    result, unavailable = asyncio.run(scenario())
+    assert result == {**stored, 'cached': True}
+    assert unavailable.state == state
+    assert classifier.model is None
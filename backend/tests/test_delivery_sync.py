@@ -0,0 +1,65 @@
+"""
+Offline delivery sync: a replayed batch gets the stored outcomes and changes nothing
+"""
+import sqlite3
+import uuid
+
+def _assigned_bookings(client, admin_headers, count: int):
+    with sqlite3.connect('e_waste.db') as conn:
+        booking_ids = [conn.execute('''
+            INSERT INTO bookings (user_id, customer_name, category, area, state, pincode, status, scheduled)
+            VALUES (3, 'user1', 'laptop', 'Koramangala', 'Karnataka', '560034', 'pending', 0)
+        ''').lastrowid for _ in range(count)]
+    for booking_id in booking_ids:
+        response = client.post('/admin/assign-delivery', json={'booking_id': booking_id, 'delivery_guy_id': 2},
+                               headers=admin_headers)
+        assert response.status_code == 200, response.text
+    return booking_ids
+
+def _history_rows(booking_ids) -> int:
+    with sqlite3.connect('e_waste.db') as conn:
+        return conn.execute(f'''
+            SELECT COUNT(*) FROM order_status_history WHERE booking_id IN ({','.join('?' * len(booking_ids))})
+        ''', booking_ids).fetchone()[0]
+
+def test_replayed_batch_returns_stored_outcomes(client, admin_headers, delivery_headers, user_headers):
+    first, second = _assigned_bookings(client, admin_headers, 2)
+    key = uuid.uuid4().hex
+    updates = [
+        {'idempotency_key': f'{key}-1', 'booking_id': first, 'status': 'picked_up'},
+        {'idempotency_key': f'{key}-2', 'booking_id': first, 'status': 'delivered'},
+        {'idempotency_key': f'{key}-3', 'booking_id': first, 'status': 'picked_up'},
+        {'idempotency_key': f'{key}-4', 'booking_id': second, 'status': 'bogus'},
+        {'idempotency_key': f'{key}-5', 'booking_id': second, 'status': 'delivered'},
+    ]
+    balance = lambda: client.get('/points/balance', headers=user_headers).json()['points_balance']
+    before = balance()
+
+    applied = client.post('/delivery/sync', json={'updates': updates}, headers=delivery_headers)
+    assert applied.status_code == 200, applied.text
+    results = applied.json()['results']
+    assert [result['result'] for result in results] == ['applied', 'applied', 'rejected', 'rejected', 'applied']
+    awarded = balance() - before
+    assert awarded == sum(result['points_awarded'] for result in results) > 0
+    history = _history_rows([first, second])
+
+    # The client never saw the response and sends the whole queue again
+    replayed = client.post('/delivery/sync', json={'updates': updates}, headers=delivery_headers).json()['results']
+    assert [result['result'] for result in replayed] == ['duplicate'] * len(updates)
+    assert [result['original_result'] for result in replayed] == [result['result'] for result in results]
+    outcome = lambda result: {name: value for name, value in result.items() if name not in ('result', 'original_result')}
+    assert [outcome(result) for result in replayed] == [outcome(result) for result in results]
+    assert balance() - before == awarded
+    assert _history_rows([first, second]) == history
+
+def test_replayed_key_reports_the_stored_update(client, admin_headers, delivery_headers):
+    first, second = _assigned_bookings(client, admin_headers, 2)
+    key = uuid.uuid4().hex
+    update = {'idempotency_key': key, 'booking_id': first, 'status': 'picked_up'}
+    assert client.post('/delivery/sync', json={'updates': [update]}, headers=delivery_headers).status_code == 200
+
+    # A buggy client reuses the key for a different booking and status
+    reused = {'idempotency_key': key, 'booking_id': second, 'status': 'delivered'}
+    result, = client.post('/delivery/sync', json={'updates': [reused]}, headers=delivery_headers).json()['results']
+    assert (result['result'], result['booking_id'], result['status']) == ('duplicate', first, 'picked_up')
+    assert _history_rows([second]) == 1
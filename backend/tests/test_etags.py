@@ -0,0 +1,40 @@
+"""
+Conditional GETs: 304 on a matching ETag, invalidation by writes, role checks before the 304
+"""
+
+BOOKING = {'category': 'smartphone', 'apartment_name': 'Lake View', 'street_number': '12', 'area': 'Koramangala',
+           'state': 'Karnataka', 'pincode': '560034'}
+
+def test_matching_etag_returns_304_until_a_write(client, user_headers):
+    first = client.get('/bookings', headers=user_headers)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    cached = client.get('/bookings', headers={**user_headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+
+    assert client.post('/bookings', json=BOOKING, headers=user_headers).status_code == 200
+    changed = client.get('/bookings', headers={**user_headers, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+def test_role_check_runs_before_the_304(client, user_headers):
+    for path in ('/admin/pickups', '/routes/1/stops'):
+        response = client.get(path, headers={**user_headers, 'If-None-Match': '*'})
+        assert response.status_code == 403, path
+        assert 'ETag' not in response.headers, path
+
+def test_unauthenticated_request_gets_no_etag(client):
+    response = client.get('/bookings', headers={'If-None-Match': '*'})
+    assert response.status_code == 401
+    assert 'ETag' not in response.headers
+
+def test_balance_without_points_is_cacheable(client, login):
+    account = {'username': 'etag_no_points', 'password': 'points123', 'role': 'user'}
+    assert client.post('/auth/register', json=account).status_code == 200
+    headers = login(account['username'], account['password'])
+    first = client.get('/points/balance', headers=headers)
+    assert first.json() == {'points_balance': 0}
+    cached = client.get('/points/balance', headers={**headers, 'If-None-Match': first.headers['ETag']})
+    assert cached.status_code == 304
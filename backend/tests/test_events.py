@@ -0,0 +1,41 @@
+"""
+Change feed over SSE: the stream opens with a reconnect delay
+"""
+import asyncio
+
+async def _first_frame(app, query: str):
+    # TestClient buffers whole bodies, so drive the endless stream at the ASGI level
+    messages, first_body = [], asyncio.Event()
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if message['type'] == 'http.response.body' and message.get('body'):
+            first_body.set()
+
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': '/events', 'raw_path': b'/events', 'root_path': '', 'query_string': query.encode(),
+             'headers': [(b'host', b'testserver')], 'client': ('testclient', 50000), 'server': ('testserver', 80)}
+    call = asyncio.create_task(app(scope, receive, send))
+    try:
+        await asyncio.wait_for(first_body.wait(), timeout=10)
+    finally:
+        disconnect.set()
+        await asyncio.wait_for(call, timeout=10)
+    start = next(message for message in messages if message['type'] == 'http.response.start')
+    body = next(message['body'] for message in messages if message.get('body'))
+    return start['status'], dict(start['headers']), body.decode()
+
+def test_event_stream_starts_with_retry_frame(client, app_module, admin_headers):
+    token = admin_headers['Authorization'].split()[1]
+    status, headers, frame = client.portal.call(_first_frame, app_module.app, f'token={token}')
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/event-stream')
+    assert frame == 'retry: 3000\n\n'
+
+def test_event_stream_requires_a_token(client):
+    assert client.get('/events').status_code == 401
@@ -0,0 +1,72 @@
+"""
+Address resolver: fallbacks, memo invalidation on gazetteer changes, unroutable state centroids
+"""
+import sqlite3
+from geocoder import AddressResolver, ensure_gazetteer, import_gazetteer
+
+GAZETTEER = [{'pincode': '560034', 'officename': 'Koramangala S.O', 'district': 'Bangalore',
+              'statename': 'Karnataka', 'latitude': '12.9352', 'longitude': '77.6245'}]
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            scope TEXT NOT NULL, user_id INTEGER NOT NULL, version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, user_id)
+        ) WITHOUT ROWID
+    ''')
+    ensure_gazetteer(conn)
+    conn.commit()
+    return conn
+
+def test_memo_follows_imports_from_another_connection(tmp_path):
+    path = tmp_path / 'gazetteer.db'
+    conn, importer = _connect(path), _connect(path)
+    resolver = AddressResolver()
+    assert resolver.resolve(conn, '560034', 'Koramangala', 'KA')[2] == 'state'
+    assert resolver.resolve(conn, '560099', None, None) is None
+    assert resolver.get_stats()['hits'] == 0
+
+    # Another process loads the pincode directory
+    import_gazetteer(importer, GAZETTEER)
+    importer.commit()
+
+    assert resolver.resolve(conn, '560034', 'Koramangala', 'KA') == (12.9352, 77.6245, 'area')
+    assert resolver.resolve(conn, '560099', None, None)[2] == 'district'
+    assert resolver.resolve(conn, '560034', 'Koramangala', 'KA')[2] == 'area'
+    assert resolver.get_stats()['hits'] == 1
+
+def test_without_a_gazetteer_bookings_are_grouped_by_pincode(client, user_headers, admin_headers, run_job):
+    # Default install: the gazetteer is empty, so bookings only get their state centroid
+    def book(area: str, pincode: str) -> int:
+        response = client.post('/bookings', headers=user_headers, json={
+            'category': 'laptop', 'apartment_name': 'Rose Villa', 'street_number': '4',
+            'area': area, 'state': 'Kerala', 'pincode': pincode
+        })
+        assert response.status_code == 200, response.text
+        return response.json()['id']
+
+    booking_ids = [book('Palayam', '695001'), book('Vazhuthacaud', '695014'), book('Palayam', '695001')]
+    job = run_job('/schedule_routes?k=1', admin_headers)
+    assert job['status'] == 'succeeded', job
+    assert job['result']['unlocated'] >= 3
+    with sqlite3.connect('e_waste.db') as conn:
+        rows = conn.execute(f'''
+            SELECT geo_precision, scheduled, route_id FROM bookings WHERE id IN ({','.join('?' * len(booking_ids))})
+        ''', booking_ids).fetchall()
+    assert {(precision, scheduled) for precision, scheduled, _ in rows} == {('state', 1)}
+    route_id = rows[0][2]
+    assert {row[2] for row in rows} == {route_id}
+    assert route_id in job['result']['pincode_routes']
+
+    stops = client.get(f'/routes/{route_id}/stops', headers=admin_headers).json()
+    pincodes = [stop['pincode'] for stop in stops['stops']]
+    assert pincodes == sorted(pincodes)
+    assert [stop['sequence'] for stop in stops['stops']] == list(range(1, len(pincodes) + 1))
+
+    # A later booking in a pincode the open route already serves joins it at creation
+    late = book('Palayam', '695001')
+    with sqlite3.connect('e_waste.db') as conn:
+        assert conn.execute('SELECT route_id, scheduled FROM bookings WHERE id = ?', (late,)).fetchone() == (route_id, 1)
+    reordered = client.get(f'/routes/{route_id}/stops', headers=admin_headers).json()
+    assert late in [stop['booking_id'] for stop in reordered['stops']]
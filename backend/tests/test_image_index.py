@@ -0,0 +1,55 @@
+"""
+Perceptual-hash index: multi-index search against brute force, recording of repeat uploads
+"""
+import asyncio
+import random
+from async_db import db
+from image_index import ImageHashIndex, MultiIndexHash, hamming
+
+def _near(rng: random.Random, value: int, bits: int) -> int:
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+def test_search_matches_brute_force():
+    rng = random.Random(25)
+    index, stored = MultiIndexHash(), []
+    bases = [rng.getrandbits(64) for _ in range(200)]
+    for item in range(3000):
+        # Clusters of near-duplicates plus unrelated hashes
+        value = _near(rng, rng.choice(bases), rng.randint(0, 10)) if item % 3 else rng.getrandbits(64)
+        index.add(value, item)
+        stored.append((value, item))
+
+    for radius in (0, 3, 4, 8, 11):
+        for query in [_near(rng, rng.choice(bases), rng.randint(0, 6)) for _ in range(50)]:
+            found, candidates = index.search(query, radius)
+            expected = sorted((hamming(query, value), item) for value, item in stored if hamming(query, value) <= radius)
+            assert sorted(found) == expected
+            assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+            assert candidates <= index.distinct
+
+def test_repeat_upload_by_the_same_user_is_not_recorded_again(client):
+    index = ImageHashIndex(db)
+    phash = random.Random(3).getrandbits(64)
+
+    async def upload(user_id: int, value: int, content_hash: str):
+        matches = await index.find(value)
+        return await index.record(value, content_hash, user_id, matches)
+
+    async def scenario():
+        await index.find(phash)
+        baseline = index.get_stats()['images']
+        first = await upload(3, phash, 'a' * 40)
+        repeat = await upload(3, phash, 'a' * 40)
+        recompressed = await upload(3, phash, 'b' * 40)
+        other_user = await upload(4, phash, 'a' * 40)
+        nearby = await upload(3, phash ^ 0b111, 'c' * 40)
+        return baseline, first, repeat, recompressed, other_user, nearby
+
+    baseline, first, repeat, recompressed, other_user, nearby = asyncio.run(scenario())
+    assert repeat == recompressed == {'image_id': first['image_id'], 'flagged': False}
+    assert other_user['flagged'] and other_user['image_id'] != first['image_id']
+    assert nearby['image_id'] not in (first['image_id'], other_user['image_id'])
+    assert index.get_stats()['images'] == baseline + 3
+    assert index.get_stats()['repeats'] == 2
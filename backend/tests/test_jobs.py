@@ -0,0 +1,46 @@
+"""
+Background jobs: a finished job's message describes how it ended, not its last progress step
+"""
+import asyncio
+import time
+from jobs import job_manager
+
+async def _succeeds(ctx):
+    await ctx.progress(0.5, 'Halfway', force=True)
+    return {'done': True}
+
+async def _fails(ctx):
+    await ctx.progress(0.5, 'Halfway', force=True)
+    raise RuntimeError('boom')
+
+async def _waits_for_cancel(ctx):
+    await ctx.progress(0.1, 'Waiting', force=True)
+    while True:
+        await asyncio.sleep(0.01)
+        await ctx.progress(0.2)
+
+job_manager.register('test_succeeds', _succeeds)
+job_manager.register('test_fails', _fails, max_attempts=1)
+job_manager.register('test_waits_for_cancel', _waits_for_cancel)
+
+def _wait_for(client, headers, job_id: int, statuses) -> dict:
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = client.get(f'/jobs/{job_id}', headers=headers).json()
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} stayed {job['status']}")
+
+def test_final_message_replaces_progress(client, admin_headers):
+    submit = lambda kind: client.portal.call(job_manager.submit, kind, {}, 1)['id']
+    succeeded = _wait_for(client, admin_headers, submit('test_succeeds'), ('succeeded',))
+    assert (succeeded['progress'], succeeded['message']) == (1, 'Completed')
+
+    failed = _wait_for(client, admin_headers, submit('test_fails'), ('failed',))
+    assert failed['message'] == 'Failed' and 'boom' in failed['error']
+
+    running = _wait_for(client, admin_headers, submit('test_waits_for_cancel'), ('running',))
+    assert client.post(f"/jobs/{running['id']}/cancel", headers=admin_headers).status_code == 200
+    cancelled = _wait_for(client, admin_headers, running['id'], ('cancelled',))
+    assert cancelled['message'] == 'Cancelled'
@@ -0,0 +1,15 @@
+"""
+Request-scoped reads under concurrency: more in-flight requests than pooled connections
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+@pytest.mark.parametrize('concurrency', [40, 100])
+def test_concurrent_requests_do_not_exhaust_pool(client, admin_headers, concurrency):
+    def get(_):
+        return client.get('/admin/pickups', headers=admin_headers).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(get, range(concurrency * 2)))
+    assert statuses.count(200) == len(statuses), {status: statuses.count(status) for status in set(statuses)}
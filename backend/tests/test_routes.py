@@ -0,0 +1,63 @@
+"""
+Route scheduling and stop listing: reads never order stops inline
+"""
+import asyncio
+import random
+import sqlite3
+
+def _insert_located_bookings(count: int):
+    rng = random.Random(7)
+    with sqlite3.connect('e_waste.db') as conn:
+        conn.executemany('''
+            INSERT INTO bookings (user_id, customer_name, category, area, state, pincode, status, scheduled, lat, lon)
+            VALUES (3, 'user1', 'laptop', 'Indiranagar', 'Karnataka', '560038', 'pending', 0, ?, ?)
+        ''', [(12.97 + rng.gauss(0, 0.03), 77.64 + rng.gauss(0, 0.03)) for _ in range(count)])
+
+def test_unordered_route_is_listed_and_ordered_in_the_background(client, admin_headers, run_job):
+    _insert_located_bookings(60)
+    job = run_job('/schedule_routes?k=2&max_stops=40', admin_headers)
+    assert job['status'] == 'succeeded', job
+    route_id = next(int(route_id) for route_id in job['result']['routes'] if int(route_id) not in job['result']['pincode_routes'])
+
+    ordered = client.get(f'/routes/{route_id}/stops', headers=admin_headers)
+    assert ordered.status_code == 200
+    assert all(stop['sequence'] is not None for stop in ordered.json()['stops'])
+    # Listing an ordered route writes nothing, so its ETag stays valid
+    again = client.get(f'/routes/{route_id}/stops', headers={**admin_headers, 'If-None-Match': ordered.headers['ETag']})
+    assert again.status_code == 304
+
+    with sqlite3.connect('e_waste.db') as conn:
+        conn.execute('UPDATE routes SET optimized_at = NULL WHERE id = ?', (route_id,))
+        conn.execute('DELETE FROM route_stops WHERE route_id = ?', (route_id,))
+    unordered = client.get(f'/routes/{route_id}/stops', headers=admin_headers).json()
+    assert unordered['optimized_at'] is None
+    assert len(unordered['stops']) == unordered['num_stops']
+    assert all(stop['sequence'] is None for stop in unordered['stops'])
+
+    # The queued background pass has ordered it by the next read
+    reordered = client.get(f'/routes/{route_id}/stops', headers=admin_headers).json()
+    assert reordered['optimized_at'] is not None
+    assert sorted(stop['sequence'] for stop in reordered['stops']) == list(range(1, reordered['num_stops'] + 1))
+
+def test_reorder_requested_during_a_pass_runs_again(client, app_module, monkeypatch):
+    passes = []
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_pass(route_ids):
+            passes.append(route_ids)
+            started.set()
+            await release.wait()
+
+        monkeypatch.setattr(app_module, '_optimize_routes', slow_pass)
+        running = asyncio.create_task(app_module._reoptimize_route(99))
+        await started.wait()
+        # Bookings join while the first pass runs; both requests fold into one more pass
+        await app_module._reoptimize_route(99)
+        await app_module._reoptimize_route(99)
+        release.set()
+        await running
+
+    client.portal.call(scenario)
+    assert passes == [[99], [99]]
@@ -0,0 +1,48 @@
+"""
+Route clustering: capacity limits and compactness of capped plans
+"""
+import numpy as np
+
+from routing import capacitated_assign, plan_pincode_routes, plan_routes
+
+def _city_bookings(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    cities = np.array([[12.97, 77.59], [13.08, 80.27], [17.38, 78.48]])
+    which = rng.integers(0, len(cities), n)
+    return cities[which, 0] + rng.normal(0, 0.1, n), cities[which, 1] + rng.normal(0, 0.1, n)
+
+def test_capped_plan_respects_max_stops():
+    lat, lon = _city_bookings(5000)
+    plan = plan_routes(lat, lon, 3, max_stops=40)
+    stops = np.bincount(plan.labels)
+    assert stops.sum() == 5000
+    assert stops.max() <= 40
+    assert (stops > 0).all()
+
+def test_capped_plan_stays_compact():
+    lat, lon = _city_bookings(5000)
+    uncapped = plan_routes(lat, lon, 150)
+    capped = plan_routes(lat, lon, 3, max_stops=40)
+    # Stops stay near their route, not pushed into whichever far route has room
+    assert capped.radius_km.max() < 3 * uncapped.radius_km.max()
+
+def test_assignment_fills_exact_capacity():
+    rng = np.random.default_rng(1)
+    points, centroids = rng.normal(0, 5, (500, 2)), rng.normal(0, 5, (10, 2))
+    labels = capacitated_assign(points, centroids, 50)
+    assert np.bincount(labels, minlength=10).tolist() == [50] * 10
+
+def test_pincode_routes_are_contiguous_runs_within_the_cap():
+    rng = np.random.default_rng(2)
+    pincodes = [f"{code:06d}" for code in rng.choice([560034, 560038, 560095, 600001, 600020, 695001], 500)] + [None] * 5
+    labels = plan_pincode_routes(pincodes, 3, max_stops=60)
+    stops = np.bincount(labels)
+    assert stops.max() <= 60 and (stops > 0).all()
+    # Sorted by pincode, route labels never go back: each route is one run of neighbouring pincodes
+    in_order = [labels[i] for i in sorted(range(len(pincodes)), key=lambda i: (pincodes[i] or '', i))]
+    assert in_order == sorted(in_order)
+    # Small pincodes are not split across routes
+    uncapped = plan_pincode_routes(pincodes, 3)
+    assert len(np.unique(uncapped)) <= 3
+    for pincode in set(pincodes):
+        assert len({uncapped[i] for i, code in enumerate(pincodes) if code == pincode}) == 1
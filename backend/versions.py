@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Table version counters and the ETags derived from them for conditional GETs
+"""
+import hashlib
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+GLOBAL_VERSION = 0  # table_versions.user_id of the table-wide counter
+
+# Role whose rows a scope is counted per user for; every other role sees the global counter
+SCOPE_OWNER_ROLE = {
+    'bookings': 'user',
+    'materials': 'user',
+    'deliveries': 'delivery',
+    'points': 'user',
+}
+
+VersionKey = Tuple[str, int]
+
+def version_key(scope: str, user: dict) -> VersionKey:
+    """The counter a user's view of a scope depends on"""
+    if user['role'] == SCOPE_OWNER_ROLE[scope]:
+        return scope, user['id']
+    return scope, GLOBAL_VERSION
+
+def fetch_versions(conn: sqlite3.Connection, keys: List[VersionKey]) -> List[int]:
+    """Current counters for the keys, in order (0 for counters never bumped)"""
+    clause = ' OR '.join(['(scope = ? AND user_id = ?)'] * len(keys))
+    params = [value for key in keys for value in key]
+    rows = conn.execute(f'SELECT scope, user_id, version FROM table_versions WHERE {clause}', params).fetchall()
+    found = {(row[0], row[1]): row[2] for row in rows}
+    return [found.get(key, 0) for key in keys]
+
+def make_etag(path: str, query: str, user: dict, keys: List[VersionKey], versions: List[int]) -> str:
+    """Weak ETag for one user's view of a URL at the given table versions"""
+    raw = '|'.join([path, query, str(user['id']), user['role']]
+                   + [f'{scope}:{user_id}:{version}' for (scope, user_id), version in zip(keys, versions)])
+    return 'W/"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value lists the ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    candidates: Iterable[str] = (tag.strip() for tag in if_none_match.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag) == opaque for tag in candidates)
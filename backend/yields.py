@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Vectorized material yield engine backed by versioned yield tables
+
+Run directly to recompute stored material estimates for bookings made under
+an older yield version.
+"""
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+# Version 1: the estimates create_booking has always used (fraction of device weight)
+DEFAULT_YIELDS = {
+    'smartphone': {'copper': 0.05, 'lithium': 0.003, 'cobalt': 0.001, 'nickel': 0.01, 'rare_earth': 0.002},
+    'laptop': {'copper': 0.10, 'lithium': 0.005, 'cobalt': 0.003, 'nickel': 0.02, 'rare_earth': 0.003},
+    'battery': {'copper': 0.0, 'lithium': 0.20, 'cobalt': 0.05, 'nickel': 0.05, 'rare_earth': 0.01},
+    'other': {'copper': 0.07, 'lithium': 0.002, 'cobalt': 0.001, 'nickel': 0.003, 'rare_earth': 0.001}
+}
+
+# Average device weight (kg) per category
+DEFAULT_WEIGHTS = {
+    'smartphone': 0.2,
+    'laptop': 2.0,
+    'battery': 1.0,
+    'other': 1.5
+}
+
+# 'stored' writes per-booking materials rows; 'derived' computes totals from category counts only
+MATERIALS_MODE = os.getenv("MATERIALS_MODE", "stored")
+RECOMPUTE_CHUNK_SIZE = 500
+
+class YieldTable:
+    """One yield version as arrays: ``matrix[c, m]`` is kg of material m per booking of category c
+
+    The last row is all zeros and stands in for unknown categories, which have
+    never produced material estimates.
+    """
+
+    def __init__(self, version: int, weights: Dict[str, float], yields: Dict[str, Dict[str, float]]):
+        self.version = version
+        self.categories = sorted(yields)
+        self.materials = sorted({material for fractions in yields.values() for material in fractions})
+        self.category_index = {category: i for i, category in enumerate(self.categories)}
+        self.matrix = np.zeros((len(self.categories) + 1, len(self.materials)))
+        material_index = {material: i for i, material in enumerate(self.materials)}
+        for category, fractions in yields.items():
+            row = self.category_index[category]
+            for material, fraction in fractions.items():
+                self.matrix[row, material_index[material]] = weights.get(category, 1.0) * fraction
+
+    def category_rows(self, categories: Sequence[str]) -> np.ndarray:
+        unknown = len(self.categories)
+        return np.fromiter((self.category_index.get(c, unknown) for c in categories), dtype=np.intp, count=len(categories))
+
+    def estimate(self, categories: Sequence[str]) -> np.ndarray:
+        """Per-booking material estimates, shape (len(categories), len(materials))"""
+        return np.round(self.matrix[self.category_rows(categories)], 4)
+
+    def totals(self, category_counts: Dict[str, int]) -> Dict[str, float]:
+        """Material totals for a set of bookings given only their category counts"""
+        counts = np.zeros(len(self.categories) + 1)
+        np.add.at(counts, self.category_rows(list(category_counts)), list(category_counts.values()))
+        totals = counts @ np.round(self.matrix, 4)
+        return {material: float(qty) for material, qty in zip(self.materials, totals)}
+
+    def material_rows(self, booking_ids: Sequence[int], categories: Sequence[str]) -> List[Tuple[int, str, float]]:
+        """(booking_id, material, quantity) rows for the materials table"""
+        estimates = self.estimate(categories)
+        known = self.category_rows(categories) < len(self.categories)
+        return [(int(booking_id), material, float(qty))
+                for booking_id, is_known, row in zip(booking_ids, known, estimates) if is_known
+                for material, qty in zip(self.materials, row)]
+
+class YieldEngine:
+    """Current yield table, loaded once and swapped atomically when a new version is published"""
+
+    def __init__(self, mode: str = MATERIALS_MODE):
+        if mode not in ('stored', 'derived'):
+            raise ValueError(f"MATERIALS_MODE must be 'stored' or 'derived', not {mode!r}")
+        self.mode = mode
+        self._table = YieldTable(1, DEFAULT_WEIGHTS, DEFAULT_YIELDS)
+        self._lock = threading.Lock()
+
+    @property
+    def table(self) -> YieldTable:
+        return self._table
+
+    def load(self, conn: sqlite3.Connection) -> YieldTable:
+        """Load the latest yield version from the database"""
+        version = conn.execute('SELECT MAX(version) FROM yield_tables').fetchone()[0]
+        if version is None:
+            return self._table
+        weights, yields = {}, {}
+        for category, avg_weight, material, fraction in conn.execute(
+                'SELECT category, avg_weight, material, fraction FROM yield_tables WHERE version = ?', (version,)):
+            weights[category] = avg_weight
+            yields.setdefault(category, {})[material] = fraction
+        table = YieldTable(version, weights, yields)
+        with self._lock:
+            if table.version >= self._table.version:
+                self._table = table
+        return self._table
+
+    def get_stats(self) -> dict:
+        table = self._table
+        return {
+            "mode": self.mode,
+            "version": table.version,
+            "categories": table.categories,
+            "materials": table.materials
+        }
+
+def insert_yield_version(conn: sqlite3.Connection, version: int, weights: Dict[str, float],
+                         yields: Dict[str, Dict[str, float]]):
+    conn.executemany(
+        'INSERT INTO yield_tables (version, category, avg_weight, material, fraction) VALUES (?, ?, ?, ?, ?)',
+        [(version, category, weights[category], material, fraction)
+         for category, fractions in yields.items() for material, fraction in fractions.items()]
+    )
+
+def publish_yield_version(conn: sqlite3.Connection, weights: Dict[str, float],
+                          yields: Dict[str, Dict[str, float]]) -> int:
+    """Store a new yield version and return its number"""
+    version = (conn.execute('SELECT MAX(version) FROM yield_tables').fetchone()[0] or 0) + 1
+    insert_yield_version(conn, version, weights, yields)
+    return version
+
+def store_booking_materials(conn: sqlite3.Connection, table: YieldTable, booking_ids: Sequence[int],
+                            categories: Sequence[str]):
+    """Write the estimated material rows for bookings (one executemany for the whole set)"""
+    conn.executemany('INSERT INTO materials (booking_id, material, quantity) VALUES (?, ?, ?)',
+                     table.material_rows(booking_ids, categories))
+
+def recompute_chunk(conn: sqlite3.Connection, table: YieldTable, chunk_size: int = RECOMPUTE_CHUNK_SIZE) -> int:
+    """Re-estimate up to chunk_size bookings made under an older yield version
+
+    Meant to run as one short transaction per chunk, so regular writes can
+    interleave with a long recompute. Returns the number of bookings updated;
+    0 means everything is current.
+    """
+    rows = conn.execute('''
+        SELECT id, category FROM bookings
+        WHERE yield_version IS NULL OR yield_version < ?
+        ORDER BY id LIMIT ?
+    ''', (table.version, chunk_size)).fetchall()
+    if not rows:
+        return 0
+    booking_ids = [row[0] for row in rows]
+    categories = [row[1] for row in rows]
+    conn.executemany('DELETE FROM materials WHERE booking_id = ?', [(booking_id,) for booking_id in booking_ids])
+    store_booking_materials(conn, table, booking_ids, categories)
+    conn.executemany('UPDATE bookings SET yield_version = ? WHERE id = ?',
+                     [(table.version, booking_id) for booking_id in booking_ids])
+    return len(rows)
+
+def stale_booking_count(conn: sqlite3.Connection, version: int) -> int:
+    return conn.execute('SELECT COUNT(*) FROM bookings WHERE yield_version IS NULL OR yield_version < ?',
+                        (version,)).fetchone()[0]
+
+# Global yield engine instance
+yield_engine = YieldEngine()
+
+if __name__ == "__main__":
+    from schema import ensure_schema
+    if yield_engine.mode == 'derived':
+        print("✅ MATERIALS_MODE=derived: totals come from category counts, nothing to recompute")
+        raise SystemExit(0)
+    conn = sqlite3.connect('e_waste.db')
+    ensure_schema(conn)
+    conn.commit()
+    table = yield_engine.load(conn)
+    print(f"🔄 Recomputing materials for {stale_booking_count(conn, table.version)} bookings (yield version {table.version})")
+    total = 0
+    while True:
+        updated = recompute_chunk(conn, table)
+        conn.commit()
+        if not updated:
+            break
+        total += updated
+        print(f"   ... {total} bookings")
+    conn.close()
+    print(f"✅ Materials are current with yield version {table.version}")
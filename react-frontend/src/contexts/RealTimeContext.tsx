@@ -1,5 +1,5 @@
 l  wa React, { createContext, useCallback, useContext, useEffect, useRef, useState } from 'react';
-import { adminAPI, bookingAPI, dashboardAPI, deliveryAPI, pointsAPI } from '../services/api';
+import { adminAPI, api, bookingAPI, dashboardAPI, deliveryAPI, pointsAPI } from '../services/api';
 import { useAuth } from './AuthContext';
 
 interface RealTimeContextType {
@@ -54,6 +54,7 @@ export const RealTimeProvider: React.FC<RealTimeProviderProps> = ({ children })
   
   // Refs for tracking
   const refreshTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  const eventRefreshRef = useRef<NodeJS.Timeout | null>(null);
   const isRefreshingRef = useRef(false);
 
   // API refresh functions
@@ -144,25 +145,26 @@ export const RealTimeProvider: React.FC<RealTimeProviderProps> = ({ children })
     }
   }, [user, refreshAssignments, refreshPickups, refreshDashboard, refreshBookings, refreshPoints]);
 
-  // Enhanced polling with immediate refresh on status changes
+  // Server-Sent Events change feed; falls back to polling when the stream is unavailable
   useEffect(() => {
     if (!user) return;
 
-    const startPolling = () => {
-      // Clear existing timeout
-      if (refreshTimeoutRef.current) {
-        clearTimeout(refreshTimeoutRef.current);
+    let eventSource: EventSource | null = null;
+    let polling = false;
+
+    const getPollingInterval = () => {
+      switch (user.role) {
+        case 'delivery': return 10000; // 10 seconds for delivery
+        case 'admin': return 15000;   // 15 seconds for admin
+        case 'user': return 20000;    // 20 seconds for user
+        default: return 30000;        // 30 seconds default
       }
+    };
 
-      // Set up polling based on user role
-      const getPollingInterval = () => {
-        switch (user.role) {
-          case 'delivery': return 10000; // 10 seconds for delivery
-          case 'admin': return 15000;   // 15 seconds for admin
-          case 'user': return 20000;    // 20 seconds for user
-          default: return 30000;        // 30 seconds default
-        }
-      };
+    const startPolling = () => {
+      if (polling) return;
+      polling = true;
+      console.log('🔄 Real-time: Change feed unavailable, polling instead');
 
       const poll = async () => {
         if (!isRefreshingRef.current) {
@@ -173,16 +175,58 @@ export const RealTimeProvider: React.FC<RealTimeProviderProps> = ({ children })
         refreshTimeoutRef.current = setTimeout(poll, getPollingInterval());
       };
 
-      // Start polling
       poll();
     };
 
-    startPolling();
+    // Coalesce bursts of events (e.g. a route schedule) into one refresh
+    const scheduleRefresh = () => {
+      if (eventRefreshRef.current) {
+        clearTimeout(eventRefreshRef.current);
+      }
+      eventRefreshRef.current = setTimeout(() => {
+        refreshAll();
+      }, 300);
+    };
+
+    const token = localStorage.getItem('token');
+    if (typeof EventSource === 'undefined' || !token) {
+      startPolling();
+    } else {
+      // EventSource cannot send headers, so the token goes in the query string;
+      // the browser resends Last-Event-ID itself when it reconnects
+      eventSource = new EventSource(`${api.defaults.baseURL}/events?token=${encodeURIComponent(token)}`);
+      eventSource.onopen = () => {
+        console.log('🔄 Real-time: Change feed connected');
+        scheduleRefresh();
+      };
+      eventSource.onmessage = (e: MessageEvent) => {
+        try {
+          const event = JSON.parse(e.data);
+          console.log(`🔄 Real-time: ${event.type}`);
+        } catch (error) {
+          console.error('Error parsing change event:', error);
+        }
+        scheduleRefresh();
+      };
+      eventSource.onerror = () => {
+        // Transient errors reconnect automatically; a closed stream (e.g. 401) won't
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+          eventSource = null;
+          startPolling();
+        }
+      };
+    }
 
     return () => {
+      if (eventSource) {
+        eventSource.close();
+      }
       if (refreshTimeoutRef.current) {
         clearTimeout(refreshTimeoutRef.current);
       }
+      if (eventRefreshRef.current) {
+        clearTimeout(eventRefreshRef.current);
+      }
     };
   }, [user, refreshAll]);
 